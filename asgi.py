@@ -0,0 +1,204 @@
+'''
+asgi.py -- serves the grading API over ASGI
+Notes:
+   - It is the same Flask app (routes.app), so routes, auth, the XSSI
+     prefix and compression behave exactly as under WSGI
+   - Connections live on the event loop; a request only takes a thread
+     (one of ASGI_WORKERS) while its handler runs, or while the next chunk
+     of a streamed body is produced. Slow clients, idle keep-alive
+     connections and responses waiting on a slow reader cost no thread,
+     so one process holds hundreds of grader connections with a fixed
+     number of threads
+   - Handlers still block their thread on NFS and LDAP while they run;
+     fsio's deadlines bound that (see fsio.py)
+   - Request bodies (login forms) are read before dispatch, up to
+     ASGI_MAX_BODY bytes
+   - Streamed bodies (NDJSON, gradebook exports) are sent chunk by chunk;
+     a client that goes away stops the response and closes its iterator,
+     like a closed WSGI connection does
+   - Run with any ASGI server, e.g.
+         uvicorn virtualgrade.asgi:app --workers 4
+'''
+
+import io
+import sys
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import constants
+from .routes import app as wsgi_app
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_END = object()
+
+
+def _get_executor():
+        global _executor
+        with _executor_lock:
+                if _executor is None:
+                        _executor = ThreadPoolExecutor(
+                            max_workers=constants.ASGI_WORKERS,
+                            thread_name_prefix='vg-asgi')
+                return _executor
+
+
+class _BodyTooLarge(Exception):
+        pass
+
+
+class _Disconnected(Exception):
+        pass
+
+
+async def _read_body(receive):
+        chunks = []
+        size = 0
+        while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                        raise _Disconnected()
+                body = message.get('body', b'')
+                size += len(body)
+                if size > constants.ASGI_MAX_BODY:
+                        raise _BodyTooLarge()
+                chunks.append(body)
+                if not message.get('more_body', False):
+                        return b''.join(chunks)
+
+
+async def _wait_disconnect(receive):
+        while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                        return
+
+
+'''
+_environ -- the WSGI environ for an ASGI http scope and its request body
+'''
+
+
+def _environ(scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+                'REQUEST_METHOD': scope['method'],
+                'SCRIPT_NAME': scope.get('root_path', '').encode().decode(
+                    'latin-1'),
+                'PATH_INFO': scope['path'].encode().decode('latin-1'),
+                'QUERY_STRING': scope.get('query_string', b'').decode(
+                    'latin-1'),
+                'SERVER_NAME': server[0],
+                'SERVER_PORT': str(server[1]),
+                'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version',
+                                                       '1.1'),
+                'REMOTE_ADDR': client[0],
+                'REMOTE_PORT': str(client[1]),
+                'wsgi.version': (1, 0),
+                'wsgi.url_scheme': scope.get('scheme', 'http'),
+                'wsgi.input': io.BytesIO(body),
+                'wsgi.errors': sys.stderr,
+                'wsgi.multithread': True,
+                'wsgi.multiprocess': True,
+                'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+                name = name.decode('latin-1').upper().replace('-', '_')
+                value = value.decode('latin-1')
+                if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+                        key = name
+                else:
+                        key = 'HTTP_' + name
+                if key in environ:
+                        environ[key] += ',' + value
+                else:
+                        environ[key] = value
+        return environ
+
+
+async def _respond(send, status, body):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'text/plain'),
+                                (b'content-length',
+                                 str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+
+'''
+_call -- runs the WSGI app for one request on the pool and sends its
+         response, pulling each body chunk from the pool as the previous one
+         has been sent
+'''
+
+
+async def _call(environ, send, disconnected):
+        loop = asyncio.get_running_loop()
+        executor = _get_executor()
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+                started['status'] = int(status.split(' ', 1)[0])
+                started['headers'] = [(name.lower().encode('latin-1'),
+                                       value.encode('latin-1'))
+                                      for name, value in headers]
+                return None
+
+        result = await loop.run_in_executor(executor, wsgi_app, environ,
+                                            start_response)
+        try:
+                chunks = iter(result)
+                chunk = await loop.run_in_executor(executor, next, chunks,
+                                                   _END)
+                await send({'type': 'http.response.start',
+                            'status': started['status'],
+                            'headers': started['headers']})
+                while chunk is not _END:
+                        if disconnected.done():
+                                return
+                        if chunk:
+                                await send({'type': 'http.response.body',
+                                            'body': chunk,
+                                            'more_body': True})
+                        chunk = await loop.run_in_executor(executor, next,
+                                                           chunks, _END)
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+                if hasattr(result, 'close'):
+                        await loop.run_in_executor(executor, result.close)
+
+
+async def _lifespan(receive, send):
+        while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                        await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                        await send({'type': 'lifespan.shutdown.complete'})
+                        return
+
+
+'''
+app -- the ASGI application
+'''
+
+
+async def app(scope, receive, send):
+        if scope['type'] == 'lifespan':
+                return await _lifespan(receive, send)
+        if scope['type'] != 'http':
+                raise ValueError('unsupported ASGI scope: ' + scope['type'])
+
+        try:
+                body = await _read_body(receive)
+        except _Disconnected:
+                return
+        except _BodyTooLarge:
+                return await _respond(send, 413, b'request body too large')
+
+        disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+        try:
+                await _call(_environ(scope, body), send, disconnected)
+        finally:
+                disconnected.cancel()
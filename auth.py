@@ -2,20 +2,48 @@
 auth.py -- contains the authentication model for virtualgrade, available to all
 Created by: Adam Plumer
 Date created: Dec 9, 2016
+Notes:
+   - Two modes, picked by the 'auth_mode' setting:
+       session: (default) the user and their admin/grading courses are kept
+                in the Flask session
+       token:   nothing is kept on the server; login hands out a signed
+                auth token carrying the user's permissions and a refresh
+                token, both as httponly cookies (the auth token is also
+                accepted as 'Authorization: Bearer <token>'), so any app
+                node with the secret key can serve any request
+   - Auth tokens are short-lived (TOKEN_AUTH_SECS); an expired one is
+     reissued from the refresh token, with permissions looked up again in
+     the group index, so a permission change takes effect within
+     TOKEN_AUTH_SECS without any subprocess
+   - Logging out revokes the refresh token on every node (see _revoke);
+     an auth token already handed out stays valid until it expires, at
+     most TOKEN_AUTH_SECS, since checking those costs nothing per request
+   - PyJWT is only imported in token mode
 '''
 
 import os
-import ldap
-
-from flask import Blueprint, session, request, escape
+import grp
+import hashlib
+import pwd
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Blueprint, session, request, escape, g, make_response
 from . import constants as cons
+from . import context
+from . import fsio
+from . import ldap_pool
+from . import storage
+from .cache import LRUCache
+from .config import config
 from functools import wraps
-from re import split
-from subprocess import Popen, PIPE
 
 
 auth_page = Blueprint('auth_page', __name__)
 _LDAP_URL = 'ldap://ldap.eecs.tufts.edu'
+_AUTH_COOKIE = 'vg-auth'
+_REFRESH_COOKIE = 'vg-ref'
 
 class NoUserException(Exception):
         def __init__(self, value):
@@ -43,25 +71,31 @@ def login():
                 username = request.args.get('username')
                 password = request.args.get('password')
         user_ldap = 'uid='+username+',ou=People,dc=eecs,dc=tufts,dc=edu'
-        admin = []
-        grading = []
 
-        try:
-                con = ldap.initialize(_LDAP_URL)
+        if not password:
+                # an empty password is an anonymous bind, which always succeeds
+                raise NoAuthException('password empty')
 
-                try:
-                        con.simple_bind_s(user_ldap, password)
-                        admin, grading = _get_admin_grading(username)
-                except ldap.INVALID_CREDENTIALS:
-                        raise NoAuthException('invalid username/password')
-                except:
-                        raise NoAuthException('password empty/LDAP error')
-        except NoAuthException as e:
-                raise e
-        except ldap.LDAP_ERROR:
-                pass
-        finally:
-                con.unbind()
+        try:
+                pool = ldap_pool.get_pool(config.get('ldap_url', _LDAP_URL))
+                valid = pool.check_credentials(user_ldap, password)
+        except ldap_pool.LDAPUnavailableException:
+                raise NoAuthException('LDAP error')
+
+        if not valid:
+                raise NoAuthException('invalid username/password')
+
+        admin, grading = _get_admin_grading(username)
+
+        if _token_mode():
+                response = make_response('login success', 200)
+                _set_cookie(response, _AUTH_COOKIE,
+                            _issue_auth_token(username, admin, grading),
+                            cons.TOKEN_AUTH_SECS)
+                _set_cookie(response, _REFRESH_COOKIE,
+                            _issue_refresh_token(username),
+                            cons.TOKEN_REFRESH_SECS)
+                return response
 
         session['username'] = username
         session['admin'] = admin
@@ -75,7 +109,220 @@ def logout():
         session.pop('admin', None)
         session.pop('grading', None)
 
-        return 'logged out', 200
+        response = make_response('logged out', 200)
+        if _token_mode():
+                token = request.cookies.get(_REFRESH_COOKIE)
+                if token:
+                        try:
+                                _verify(token, 'ref')
+                                _revoke(token)
+                        except (_TokenExpired, NoUserException):
+                                pass
+                response.delete_cookie(_AUTH_COOKIE)
+                response.delete_cookie(_REFRESH_COOKIE)
+        return response
+
+
+'''
+refresh -- token mode: reissues the auth token from the refresh token, with
+           the user's current permissions
+'''
+
+
+@auth_page.route('/refresh', methods=['POST'])
+def refresh():
+        if not _token_mode():
+                return 'not using tokens', 400
+        _refresh_identity()
+        return 'refreshed', 200
+
+
+@auth_page.after_app_request
+def _set_reissued_token(response):
+        token = g.get('vg_reissued_token')
+        if token is not None:
+                _set_cookie(response, _AUTH_COOKIE, token,
+                            cons.TOKEN_AUTH_SECS)
+        return response
+
+
+def _token_mode():
+        return config.get('auth_mode', 'session') == 'token'
+
+
+def _set_cookie(response, name, value, max_age):
+        response.set_cookie(name, value, max_age=max_age, httponly=True,
+                            secure=config.get('cookie_secure', 'true') !=
+                            'false', samesite='Strict')
+
+
+_jwt = None
+
+
+def _get_jwt():
+        global _jwt
+        if _jwt is None:
+                import jwt
+                _jwt = jwt
+        return _jwt
+
+
+def _secret_key():
+        key = config.get('secret_key')
+        if not key:
+                raise NoAuthException('no secret key configured')
+        return key
+
+
+'''
+TOKENS -- HS256 JWTs signed with the secret key
+          auth:    { 'sub' : 'aplume01', 'typ' : 'auth', 'exp' : ...,
+                     'adm' : ['170'], 'grd' : ['15'] }
+                   where adm are the admin courses and grd the courses the
+                   user only grades
+          refresh: { 'sub' : 'aplume01', 'typ' : 'ref', 'exp' : ... }
+'''
+
+
+def _encode(payload):
+        token = _get_jwt().encode(payload, _secret_key(), algorithm='HS256')
+        return token.decode() if isinstance(token, bytes) else token
+
+
+def _issue_auth_token(user, admin, grading):
+        return _encode({'sub': user, 'typ': 'auth',
+                        'exp': int(time.time()) + cons.TOKEN_AUTH_SECS,
+                        'adm': sorted(admin),
+                        'grd': sorted(set(grading).difference(admin))})
+
+
+def _issue_refresh_token(user):
+        return _encode({'sub': user, 'typ': 'ref',
+                        'exp': int(time.time()) + cons.TOKEN_REFRESH_SECS})
+
+
+'''
+_token_cache -- verified tokens -> (expiry, identity), so checking a token
+                that was seen before costs a dictionary lookup instead of an
+                HMAC and a JSON decode
+'''
+
+_token_cache = LRUCache(cons.TOKEN_CACHE_SIZE)
+
+
+class _TokenExpired(Exception):
+        pass
+
+
+'''
+_verify -- the identity (user, admin, grading) a token of the given type
+           stands for, with admin and grading as frozensets
+           raises _TokenExpired if it has expired, NoUserException if it is
+           not a valid token of that type
+'''
+
+
+def _verify(token, typ):
+        cached = _token_cache.get((typ, token))
+        if cached is not None:
+                if cached[0] > time.time():
+                        return cached[1]
+                _token_cache.pop((typ, token))
+                raise _TokenExpired()
+
+        jwt = _get_jwt()
+        try:
+                payload = jwt.decode(token, _secret_key(),
+                                     algorithms=['HS256'])
+        except jwt.ExpiredSignatureError:
+                raise _TokenExpired()
+        except jwt.InvalidTokenError:
+                raise NoUserException('invalid token')
+        if payload.get('typ') != typ or 'exp' not in payload:
+                raise NoUserException('invalid token')
+
+        admin = frozenset(payload.get('adm', ()))
+        identity = (payload['sub'], admin,
+                    admin.union(payload.get('grd', ())))
+        _token_cache.put((typ, token), (payload['exp'], identity))
+        return identity
+
+
+'''
+_revoked_path -- where the revocation of a refresh token is recorded:
+                 STORAGE_PATH/TOKEN_REVOKED_DIR/<sha256 of the token>
+'''
+
+
+def _revoked_path(token):
+        return '%s%s/%s' % (cons.STORAGE_PATH, cons.TOKEN_REVOKED_DIR,
+                            hashlib.sha256(token.encode()).hexdigest())
+
+
+def _is_revoked(token):
+        path = _revoked_path(token)
+        return fsio.call(path, os.path.exists, path)
+
+
+'''
+_revoke -- records a refresh token as revoked, and drops records older than
+           TOKEN_REFRESH_SECS, whose tokens have expired anyway
+'''
+
+
+def _revoke(token):
+        path = _revoked_path(token)
+        fsio.check(path)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        with open(path, 'w'):
+                pass
+        cutoff = time.time() - cons.TOKEN_REFRESH_SECS
+        for entry in os.scandir(directory):
+                try:
+                        if entry.stat().st_mtime < cutoff:
+                                os.remove(entry.path)
+                except OSError:
+                        pass
+
+
+'''
+_refresh_identity -- issues a new auth token from the request's refresh
+                     token; it is set as a cookie on the response
+'''
+
+
+def _refresh_identity():
+        token = request.cookies.get(_REFRESH_COOKIE)
+        if not token:
+                raise NoUserException('not logged in')
+        try:
+                user = _verify(token, 'ref')[0]
+        except _TokenExpired:
+                raise NoUserException('session expired')
+        if _is_revoked(token):
+                raise NoUserException('logged out')
+
+        admin, grading = _get_admin_grading(user)
+        token = _issue_auth_token(user, admin, grading)
+        g.vg_reissued_token = token
+        g.vg_identity = _verify(token, 'auth')
+        return g.vg_identity
+
+
+def _token_identity():
+        token = None
+        header = request.headers.get('Authorization', '')
+        if header.startswith('Bearer '):
+                token = header[7:]
+        else:
+                token = request.cookies.get(_AUTH_COOKIE)
+        if token:
+                try:
+                        return _verify(token, 'auth')
+                except _TokenExpired:
+                        pass
+        return _refresh_identity()
 
 
 '''
@@ -86,15 +333,22 @@ _get_remote_user -- returns the Linux username of the current requester
 
 def _get_remote_user():
 
-        if 'username' in session:
-                user = session['username']
-                admin = session['admin']
-                grading = session['grading']
+        identity = g.get('vg_identity')
+        if identity is not None:
+                return identity
+
+        if _token_mode():
+                identity = _token_identity()
+
+        elif 'username' in session:
+                identity = (session['username'], frozenset(session['admin']),
+                            frozenset(session['grading']))
 
         else:
-                raise NoUserException()
+                raise NoUserException('not logged in')
 
-        return user, admin, grading
+        g.vg_identity = identity
+        return identity
 
 
 def get_user():
@@ -104,40 +358,119 @@ def get_user():
 
 def get_admin_grading():
         user, admin, grading = _get_remote_user()
-        return admin, grading
+        return sorted(admin), sorted(grading)
 
 
 '''
-_map_courses -- mapping function to return the course name without extension
-                e.g. 00.hw4.* -> 00
+_get_courses -- gets all courses in which grades are available for current
+                request user, from the storage backend's grades index
+                e.g. 'aplume01' -> ['00', '15', '20']
 '''
 
 
-def _map_courses(s):
-        return s.split(".")[0]
+def _get_courses():
+        return storage.get_store().read_user_courses(get_user())
 
 
 '''
-_get_courses -- gets all courses in which grades are available for current
-                request user
-                e.g. 'aplume01' -> ['00', '15', '20']
+_is_course_group -- whether a Linux group is a TA (ta<course>) or grader
+                    (grade<course>) group
+                    e.g. 'ta15' -> True, 'grade170' -> True, 'staff' -> False
 '''
 
 
-def _get_courses():
-        user = get_user()
-        course_path = cons.GRADES_PATH + user + "/"
-        entries = []
+def _is_course_group(name):
+        return (name.startswith('ta') and name[2:3].isdigit()) or \
+            (name.startswith('grade') and name[5:6].isdigit())
+
+
+'''
+_user_groups -- the ta* and grade* groups of a user, including their primary
+                group, as listed by groups; one getgrouplist through NSS, so
+                it works without group enumeration (sssd/LDAP with
+                enumerate = false)
+_group_members -- the members of a group, as listed by getent group
+'''
+
+
+def _user_groups(user):
         try:
-                entries = os.listdir(course_path)
-        except OSError as e:
-                # log("problem with listdir")
-                pass
-        except:
-                # log("some other problem")
-                pass
-        courses = list(set(map(_map_courses, entries)))
-        return courses
+                gids = os.getgrouplist(user, pwd.getpwnam(user).pw_gid)
+        except (KeyError, OSError):
+                return []
+        groups = []
+        for gid in gids:
+                try:
+                        name = grp.getgrgid(gid).gr_name
+                except KeyError:
+                        continue
+                if _is_course_group(name) and name not in groups:
+                        groups.append(name)
+        return groups
+
+
+def _group_members(group):
+        try:
+                return list(grp.getgrnam(group).gr_mem)
+        except KeyError:
+                return []
+
+
+'''
+_GroupIndex -- in-process cache of _user_groups and _group_members, resolved
+               through NSS (grp/pwd) instead of forking groups/getent
+               - lookups that miss (unknown users, groups that do not exist)
+                 are cached as well, in an LRUCache of GROUP_CACHE_SIZE
+               - an entry older than GROUP_CACHE_TTL is still served while
+                 it is looked up again in the background, so a request only
+                 waits on NSS the first time it asks for a user or group
+'''
+
+
+class _GroupIndex:
+        def __init__(self):
+                self.entries = LRUCache(cons.GROUP_CACHE_SIZE)
+                self.refreshing = set()
+                self.lock = threading.Lock()
+                self.executor = None
+
+        def _get(self, key, resolve):
+                now = time.monotonic()
+                entry = self.entries.get(key)
+                if entry is not None:
+                        if now - entry[0] > cons.GROUP_CACHE_TTL:
+                                with self.lock:
+                                        self._schedule(key, resolve)
+                        return entry[1]
+                value = resolve(key[1])
+                self.entries.put(key, (now, value))
+                return value
+
+        def _schedule(self, key, resolve):
+                if key in self.refreshing:
+                        return
+                self.refreshing.add(key)
+                if self.executor is None:
+                        self.executor = ThreadPoolExecutor(
+                            max_workers=1, thread_name_prefix='vg-groups')
+                self.executor.submit(self._refresh, key, resolve)
+
+        def _refresh(self, key, resolve):
+                try:
+                        value = resolve(key[1])
+                        self.entries.put(key, (time.monotonic(), value))
+                finally:
+                        with self.lock:
+                                self.refreshing.discard(key)
+
+        def user_groups(self, user):
+                return self._get(('user', user), _user_groups)
+
+        def group_members(self, group):
+                return self._get(('group', group), _group_members)
+
+
+_groups = _GroupIndex()
 
 
 '''
@@ -150,14 +483,10 @@ _get_admin_grading -- returns all TA and grading groups for current request
 
 def _get_admin_grading(remote_user):
 
-        pipe_cmd = ['groups', remote_user]
-        raw_data = Popen(pipe_cmd, stdout=PIPE).stdout.read().strip().decode()
-        groups = raw_data.split(' ')[2:]
+        groups = _groups.user_groups(remote_user)
 
-        admin = [x[2:] for x in groups
-                 if x.startswith('ta') and x[2].isdigit()]
-        grading = [x[5:] for x in groups
-                   if x.startswith('grade') and x[5].isdigit()]
+        admin = [x[2:] for x in groups if x.startswith('ta')]
+        grading = [x[5:] for x in groups if x.startswith('grade')]
 
         grading += admin
         grading = list(set(grading))
@@ -166,29 +495,26 @@ def _get_admin_grading(remote_user):
 
 
 def _get_graders(course):
-        graders = []
-
-        try:
-                pipe_cmd = ['getent', 'group', course]
-                raw_data = Popen(pipe_cmd, stdout=PIPE).stdout.read().strip()
-                csv_graders = split(':', raw_data.decode())[3]
-                graders = split(',', csv_graders)
-                try:
-                        graders.remove('vgrade')
-                        graders.remove('provide')
-                except:
-                        pass
-        except:
-                pass
+        graders = [x for x in _groups.group_members(course)
+                   if x not in ('vgrade', 'provide')]
 
         return graders
 
 
+def _is_admin(course):
+        return course in _get_remote_user()[1]
+
+
+def _is_grader(course):
+        return course in _get_remote_user()[2]
+
+
 def admin(f):
         @wraps(f)
         def dec_func(*args, **kwargs):
-                if kwargs['course'] not in session['admin']:
-                        raise NoAuthException()
+                course = kwargs['course']
+                if not context.lookup(('admin', course), _is_admin, course):
+                        raise NoAuthException('not an admin')
                 return f(*args, **kwargs)
         return dec_func
 
@@ -196,8 +522,10 @@ def admin(f):
 def grader(f):
         @wraps(f)
         def dec_func(*args, **kwargs):
-                if kwargs['course'] not in session['grading']:
-                        raise NoAuthException()
+                course = kwargs['course']
+                if not context.lookup(('grader', course), _is_grader,
+                                      course):
+                        raise NoAuthException('not a grader')
                 return f(*args, **kwargs)
         return dec_func
 
@@ -209,7 +537,7 @@ get_permissions -- gets whether current request user is an admin or a grader
 
 
 def get_permissions(course):
-        admin, grading = get_admin_grading()
-        is_admin = course in admin
-        is_grader = is_admin or course in grading
+        is_admin = context.lookup(('admin', course), _is_admin, course)
+        is_grader = is_admin or \
+            context.lookup(('grader', course), _is_grader, course)
         return is_admin, is_grader
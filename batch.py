@@ -0,0 +1,97 @@
+'''
+batch.py -- bounded, concurrent execution for requests that touch many files
+Notes:
+   - One thread pool per process (BATCH_WORKERS threads) shared by every
+     batch request
+   - Each request keeps at most BATCH_WINDOW calls in flight and results
+     are handed back as they finish, so memory stays flat no matter how
+     many items a request asks for
+'''
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from . import constants
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_END = object()
+
+
+def _get_executor():
+        global _executor
+        with _executor_lock:
+                if _executor is None:
+                        _executor = ThreadPoolExecutor(
+                            max_workers=constants.BATCH_WORKERS,
+                            thread_name_prefix='vg-batch')
+                return _executor
+
+
+'''
+imap_unordered -- calls func on every item of an iterable on the batch pool,
+                  yielding (item, result) pairs in completion order
+                  - items is consumed lazily, at most window items ahead
+                  - exceptions raised by func are re-raised when their result
+                    is reached
+                  - closing the generator early (e.g. the client went away)
+                    cancels everything not yet started
+'''
+
+
+def imap_unordered(func, items, window=None):
+        if window is None:
+                window = constants.BATCH_WINDOW
+        executor = _get_executor()
+        items = iter(items)
+        running = {}
+        try:
+                for item in items:
+                        running[executor.submit(func, item)] = item
+                        if len(running) >= window:
+                                break
+                while running:
+                        done, not_done = wait(running,
+                                              return_when=FIRST_COMPLETED)
+                        for future in done:
+                                item = running.pop(future)
+                                nxt = next(items, _END)
+                                if nxt is not _END:
+                                        running[executor.submit(func, nxt)] = \
+                                            nxt
+                                yield item, future.result()
+        finally:
+                for future in running:
+                        future.cancel()
+
+
+'''
+imap -- like imap_unordered, but yields (item, result) pairs in the order of
+        items; at most window calls are in flight or finished and waiting
+        for the ones before them
+'''
+
+
+def imap(func, items, window=None):
+        if window is None:
+                window = constants.BATCH_WINDOW
+        executor = _get_executor()
+        items = iter(items)
+        running = deque()
+        try:
+                for item in items:
+                        running.append((item, executor.submit(func, item)))
+                        if len(running) >= window:
+                                break
+                while running:
+                        item, future = running.popleft()
+                        result = future.result()
+                        nxt = next(items, _END)
+                        if nxt is not _END:
+                                running.append((nxt, executor.submit(func,
+                                                                     nxt)))
+                        yield item, result
+        finally:
+                for item, future in running:
+                        future.cancel()
@@ -0,0 +1,22 @@
+'''
+bench -- benchmarks for the Virtual Grade hot paths
+Notes:
+   - Each module is runnable on its own, e.g.
+         python -m virtualgrade.bench.groups aplume01
+   - Benchmarks only read from the live system unless noted otherwise
+   - fixtures.py generates a synthetic tree to benchmark against, and
+     endpoints.py runs every endpoint on one, e.g.
+         python -m virtualgrade.bench.endpoints -s 500 -o release.json
+'''
+
+
+'''
+percentile -- the pct-th percentile of a list of numbers, nan if it is empty
+'''
+
+
+def percentile(values, pct):
+        if not values:
+                return float('nan')
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
@@ -0,0 +1,367 @@
+'''
+endpoints.py -- runs every endpoint of the app through the Flask test client
+                on a generated tree and reports latency and file system
+                calls per request
+Notes:
+   - The tree comes from fixtures.py, generated into a temporary directory
+     or reused with --tree (generated there first if it is empty); the run
+     writes to it (claims, leases), never to the live system
+   - LDAP is replaced by a fake that accepts every password; group lookups
+     go through auth's group index as in production, over a fake NSS
+     (grp, pwd, os.getgrouplist) in which the grader g00 is in ta<course>
+     of every course and every grader is in grade<course>
+   - Each endpoint is called once cold ('first'), then -n times; the
+     percentiles are over those -n calls
+   - File system calls are counted per request: open, stat (os.stat,
+     os.lstat, os.fstat), dir (os.listdir, os.scandir) and every other
+     audited os/fcntl/subprocess/socket event; calls made by background
+     threads while the request runs (compaction, prefetch) are included
+   - Endpoints the app has but this does not cover are listed, so a new
+     route cannot go unmeasured
+   - -o saves the results as JSON, -b compares against saved results, so
+     releases can be compared run to run
+
+usage: python -m virtualgrade.bench.endpoints [--tree <dir>] [-n <runs>]
+                                              [-o <out.json>]
+                                              [-b <baseline.json>]
+                                              [fixture options, see
+                                               fixtures.py]
+'''
+
+import os
+import grp
+import pwd
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+from collections import Counter
+from urllib.parse import urlencode
+from . import fixtures
+from . import percentile
+
+
+GRADER = fixtures.grader_names()[0]
+_AUDITED = ('open', 'os.', 'fcntl.', 'subprocess.', 'socket.')
+_STATS = ('stat', 'lstat', 'fstat')
+_SKIPPED_RULES = ('/', '/test', '/static/<path:filename>')
+
+_counts = Counter()
+_counting = [False]
+
+
+def _audit(event, args):
+        if _counting[0] and event.startswith(_AUDITED):
+                _counts[event] += 1
+
+
+@contextlib.contextmanager
+def _counting_stats():
+        def wrap(name, func):
+                def counted(*args, **kwargs):
+                        if _counting[0]:
+                                _counts['os.' + name] += 1
+                        return func(*args, **kwargs)
+                return counted
+
+        originals = [(name, getattr(os, name)) for name in _STATS]
+        try:
+                for name, func in originals:
+                        setattr(os, name, wrap(name, func))
+                yield
+        finally:
+                for name, func in originals:
+                        setattr(os, name, func)
+
+
+class _FakeLDAPPool:
+        def check_credentials(self, dn, password):
+                return True
+
+
+'''
+_FakeNSS -- grp/pwd/getgrouplist of a directory holding the fixture graders
+            and course groups; like sssd or LDAP with enumerate = false, it
+            cannot be enumerated
+'''
+
+
+class _FakeNSS:
+        def __init__(self, courses):
+                graders = fixtures.grader_names()
+                self.users = dict((name, 100) for name in graders)
+                self.groups = {100: grp.struct_group(('users', 'x', 100, []))}
+                self.member_of = dict((name, []) for name in graders)
+                gid = 1000
+                for course in courses:
+                        for name, members in (('ta' + course, graders[:1]),
+                                              ('grade' + course, graders)):
+                                self.groups[gid] = grp.struct_group(
+                                    (name, 'x', gid, list(members)))
+                                for member in members:
+                                        self.member_of[member].append(gid)
+                                gid += 1
+                self.by_name = dict((group.gr_name, group)
+                                    for group in self.groups.values())
+
+        def getpwnam(self, name):
+                if name not in self.users:
+                        raise KeyError(name)
+                return pwd.struct_passwd((name, 'x', 1000, self.users[name],
+                                          name, '/home/' + name,
+                                          '/bin/sh'))
+
+        def getgrouplist(self, user, gid):
+                return [gid] + self.member_of.get(user, [])
+
+        def getgrgid(self, gid):
+                if gid not in self.groups:
+                        raise KeyError(gid)
+                return self.groups[gid]
+
+        def getgrnam(self, name):
+                if name not in self.by_name:
+                        raise KeyError(name)
+                return self.by_name[name]
+
+        def getgrall(self):
+                return []
+
+
+def _install_fakes(courses):
+        from .. import auth
+        from .. import ldap_pool
+        nss = _FakeNSS(courses)
+        ldap_pool.get_pool = lambda url: _FakeLDAPPool()
+        auth.grp = nss
+        auth.pwd = nss
+        os.getgrouplist = nss.getgrouplist
+        auth._groups = auth._GroupIndex()
+
+
+'''
+_Session -- clients and rotating arguments shared by the endpoint calls
+'''
+
+
+class _Session:
+        def __init__(self, app, course, assignment, students):
+                self.client = app.test_client()
+                with self.client.session_transaction() as session:
+                        session['username'] = GRADER
+                        session['admin'] = [course]
+                        session['grading'] = [course]
+                self.anonymous = app.test_client()
+                self.course = course
+                self.assignment = assignment
+                self.students = students
+                self.turn = 0
+                self.claimed = students[0]
+
+        def student(self):
+                self.turn += 1
+                return self.students[self.turn % len(self.students)]
+
+        def query(self, **args):
+                args.setdefault('course', self.course)
+                args.setdefault('assign', self.assignment)
+                return '?' + urlencode(args)
+
+        def get(self, path, **args):
+                return self.client.get(path + self.query(**args))
+
+        def post(self, path, **args):
+                return self.client.post(path + self.query(**args))
+
+        def claim(self):
+                response = self.get('/pdf/getNextStudent', problem='1')
+                doc = json.loads(response.get_data()[6:])
+                self.claimed = doc.get('student', self.claimed)
+                return response
+
+
+'''
+ENDPOINTS -- (name, url rule covered, setup or None, call); setup runs
+             before every call and is neither timed nor counted
+'''
+
+ENDPOINTS = [
+        ('login', '/login', None,
+         lambda s: s.anonymous.post('/login', data={'username': GRADER,
+                                                    'password': 'x'})),
+        ('logout', '/logout', None,
+         lambda s: s.anonymous.post('/logout')),
+        ('getUser', '/getUser', None,
+         lambda s: s.client.get('/getUser')),
+        ('getType', '/getType', None,
+         lambda s: s.get('/getType')),
+        ('getGraders', '/getGraders', None,
+         lambda s: s.get('/getGraders')),
+        ('getGrades', '/getGrades', None,
+         lambda s: s.get('/getGrades', student=s.student())),
+        ('getStudents', '/getStudents', None,
+         lambda s: s.get('/getStudents')),
+        ('exportGrades', '/exportGrades', None,
+         lambda s: s.client.get('/exportGrades?' +
+                                urlencode({'course': s.course}))),
+        ('getProblemForStudent', '/pdf/getProblemForStudent', None,
+         lambda s: s.get('/pdf/getProblemForStudent', student=s.student(),
+                         problem='1')),
+        ('getProblemBatch', '/pdf/getProblemBatch', None,
+         lambda s: s.get('/pdf/getProblemBatch', students='all',
+                         problem='1')),
+        ('getProblemFile', '/pdf/getProblemFile', None,
+         lambda s: s.get('/pdf/getProblemFile', student=s.student(),
+                         problem='1')),
+        ('getNextStudent', '/pdf/getNextStudent', None,
+         lambda s: s.claim()),
+        ('renewStudent', '/pdf/renewStudent', lambda s: s.claim(),
+         lambda s: s.post('/pdf/renewStudent', problem='1',
+                          student=s.claimed)),
+        ('releaseStudent', '/pdf/releaseStudent', lambda s: s.claim(),
+         lambda s: s.post('/pdf/releaseStudent', problem='1',
+                          student=s.claimed)),
+        ('getProgress', '/pdf/getProgress', None,
+         lambda s: s.get('/pdf/getProgress')),
+]
+
+
+def _call(session, setup, call):
+        if setup is not None:
+                setup(session).get_data()
+        _counts.clear()
+        _counting[0] = True
+        start = time.perf_counter()
+        response = call(session)
+        response.get_data()
+        elapsed = time.perf_counter() - start
+        _counting[0] = False
+        response.close()
+        return response.status_code, elapsed, Counter(_counts)
+
+
+def _measure(session, setup, call, runs):
+        status, first, counts = _call(session, setup, call)
+        statuses = set([status])
+        times = []
+        total = Counter()
+        for i in range(runs):
+                status, elapsed, counts = _call(session, setup, call)
+                statuses.add(status)
+                times.append(elapsed)
+                total.update(counts)
+        return {'status': sorted(statuses),
+                'first': first,
+                'p50': percentile(times, 50),
+                'p90': percentile(times, 90),
+                'p99': percentile(times, 99),
+                'mean': sum(times) / len(times) if times else 0,
+                'syscalls': dict((event, float(num) / max(runs, 1))
+                                 for event, num in total.items())}
+
+
+def _columns(syscalls):
+        opens = syscalls.get('open', 0)
+        stats = sum(syscalls.get('os.' + x, 0) for x in _STATS)
+        dirs = syscalls.get('os.listdir', 0) + syscalls.get('os.scandir', 0)
+        other = sum(syscalls.values()) - opens - stats - dirs
+        return opens, stats, dirs, other
+
+
+def _report(results, baseline):
+        print('%-22s %-9s %9s %9s %9s %9s %7s %7s %7s %7s%s' %
+              ('endpoint', 'status', 'first ms', 'p50 ms', 'p90 ms',
+               'p99 ms', 'open', 'stat', 'dir', 'other',
+               '   vs baseline' if baseline else ''))
+        for name, result in results.items():
+                line = '%-22s %-9s %9.2f %9.2f %9.2f %9.2f' % (
+                    name, ','.join(map(str, result['status'])),
+                    result['first'] * 1e3, result['p50'] * 1e3,
+                    result['p90'] * 1e3, result['p99'] * 1e3)
+                line += ' %7.1f %7.1f %7.1f %7.1f' % _columns(
+                    result['syscalls'])
+                old = baseline.get(name) if baseline else None
+                if old is not None:
+                        line += '   p50 x%.2f, %+.1f calls' % (
+                            result['p50'] / old['p50'] if old['p50'] else 0,
+                            sum(result['syscalls'].values()) -
+                            sum(old['syscalls'].values()))
+                print(line)
+
+
+def _uncovered(app):
+        covered = set(rule for name, rule, setup, call in ENDPOINTS)
+        rules = set(rule.rule for rule in app.url_map.iter_rules())
+        from .. import auth
+        if not auth._token_mode():
+                covered.add('/refresh')
+        return sorted(rules.difference(covered, _SKIPPED_RULES))
+
+
+def _prepare_tree(args):
+        base = args.tree
+        if base is None:
+                base = tempfile.mkdtemp(prefix='vg-bench-')
+        if not os.path.isdir(base + '/storage'):
+                start = time.perf_counter()
+                fixtures.generate_from(base, args)
+                print('generated %s in %.1f s' %
+                      (base, time.perf_counter() - start))
+        os.environ['VG_STORAGE_PATH'] = base + '/storage/'
+        os.environ['VG_COMP_PATH'] = base + '/comp/'
+        os.environ.setdefault('SECRET_KEY', 'bench')
+        return base
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+        parser.add_argument('--tree', default=None,
+                            help='reuse (or generate into) this directory')
+        parser.add_argument('-n', '--runs', type=int, default=50)
+        parser.add_argument('-o', '--output', default=None,
+                            help='save the results as JSON')
+        parser.add_argument('-b', '--baseline', default=None,
+                            help='compare with results saved by -o')
+        fixtures.add_arguments(parser)
+        args = parser.parse_args(argv)
+
+        base = _prepare_tree(args)
+        baseline = None
+        if args.baseline is not None:
+                with open(args.baseline, 'r') as f:
+                        baseline = json.loads(f.read())['endpoints']
+
+        from .. import routes
+        courses = sorted(os.listdir(base + '/storage/assignments'))
+        _install_fakes(courses)
+        session = _Session(routes.app, courses[0],
+                           fixtures.assignment_names(1)[0],
+                           sorted(x for x in os.listdir(base +
+                                                        '/storage/grades')))
+
+        sys.addaudithook(_audit)
+        results = {}
+        with _counting_stats():
+                for name, rule, setup, call in ENDPOINTS:
+                        results[name] = _measure(session, setup, call,
+                                                 args.runs)
+
+        print('%s, %d runs per endpoint' % (base, args.runs))
+        _report(results, baseline)
+        missing = _uncovered(routes.app)
+        if missing:
+                print('not benchmarked: ' + ', '.join(missing))
+
+        if args.output is not None:
+                with open(args.output, 'w') as f:
+                        f.write(json.dumps({'tree': base,
+                                            'runs': args.runs,
+                                            'endpoints': results},
+                                           indent=1, sort_keys=True))
+        return 0
+
+
+if __name__ == '__main__':
+        sys.exit(main())
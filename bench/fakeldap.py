@@ -0,0 +1,136 @@
+'''
+fakeldap.py -- in-process stand-in for an LDAP server and the python-ldap
+               calls ldap_pool makes, for the ldap_pool tests and benchmark
+Notes:
+   - A FakeServer is used in place of the ldap module, e.g.
+         server = FakeServer({'uid=a,ou=People': 'pw'}, latency=0.002)
+         ldap_pool._ldap = server
+   - Like python-ldap, initialize does not connect; the first operation on
+     a connection does, paying connect_latency once, and every operation
+     pays latency
+   - drop() is a server restart: every connection open at that point fails
+     with SERVER_DOWN from then on, new ones work; down = True refuses
+     every connection
+   - fail_binds makes the next that many binds time out (TIMEOUT)
+   - connects, binds, unbinds and peak (most operations in flight at once)
+     are counted
+'''
+
+import time
+import threading
+import contextlib
+
+
+class LDAPError(Exception):
+        pass
+
+
+class INVALID_CREDENTIALS(LDAPError):
+        pass
+
+
+class SERVER_DOWN(LDAPError):
+        pass
+
+
+class TIMEOUT(LDAPError):
+        pass
+
+
+OPT_REFERRALS = 8
+OPT_NETWORK_TIMEOUT = 0x5005
+OPT_TIMEOUT = 0x5002
+
+
+class _Connection:
+        def __init__(self, server):
+                self.server = server
+                self.generation = None
+                self.options = {}
+
+        def set_option(self, option, value):
+                self.options[option] = value
+
+        def _op(self):
+                server = self.server
+                if server.down:
+                        raise SERVER_DOWN('connection refused')
+                if self.generation is None:
+                        self.generation = server.generation
+                        server.count('connects')
+                        if server.connect_latency:
+                                time.sleep(server.connect_latency)
+                elif self.generation != server.generation:
+                        raise SERVER_DOWN('connection reset by peer')
+                if server.latency:
+                        time.sleep(server.latency)
+
+        def simple_bind_s(self, dn, password):
+                with self.server.operation():
+                        self._op()
+                        self.server.count('binds')
+                        if self.server.take_failure():
+                                raise TIMEOUT('bind timed out')
+                        if self.server.users.get(dn) != password:
+                                raise INVALID_CREDENTIALS(dn)
+
+        def whoami_s(self):
+                with self.server.operation():
+                        self._op()
+                        return ''
+
+        def unbind_s(self):
+                self.server.count('unbinds')
+
+
+class FakeServer:
+        LDAPError = LDAPError
+        INVALID_CREDENTIALS = INVALID_CREDENTIALS
+        SERVER_DOWN = SERVER_DOWN
+        TIMEOUT = TIMEOUT
+        OPT_REFERRALS = OPT_REFERRALS
+        OPT_NETWORK_TIMEOUT = OPT_NETWORK_TIMEOUT
+        OPT_TIMEOUT = OPT_TIMEOUT
+
+        def __init__(self, users=None, latency=0.0, connect_latency=0.0):
+                self.users = dict(users or {})
+                self.latency = latency
+                self.connect_latency = connect_latency
+                self.down = False
+                self.generation = 0
+                self.fail_binds = 0
+                self.connects = 0
+                self.binds = 0
+                self.unbinds = 0
+                self.active = 0
+                self.peak = 0
+                self._lock = threading.Lock()
+
+        def initialize(self, url):
+                return _Connection(self)
+
+        def drop(self):
+                with self._lock:
+                        self.generation += 1
+
+        def count(self, name):
+                with self._lock:
+                        setattr(self, name, getattr(self, name) + 1)
+
+        def take_failure(self):
+                with self._lock:
+                        if self.fail_binds > 0:
+                                self.fail_binds -= 1
+                                return True
+                        return False
+
+        @contextlib.contextmanager
+        def operation(self):
+                with self._lock:
+                        self.active += 1
+                        self.peak = max(self.peak, self.active)
+                try:
+                        yield
+                finally:
+                        with self._lock:
+                                self.active -= 1
@@ -0,0 +1,181 @@
+'''
+fixtures.py -- generates a synthetic Virtual Grade tree for benchmarks
+Notes:
+   - Layout, under <dir>:
+         storage/assignments/<course>/alist
+         storage/assignments/<course>/<assignment>/completed, inprogress
+         storage/grades/<student>/<course>/<assignment>/score
+         comp/<course>/grading/<assignment>/<student>.<n>/p<k>.svg
+     i.e. storage/ is STORAGE_PATH and comp/ is COMP_PATH
+   - Scaled by courses, assignments per course, students, pages per
+     assignment and submission versions per student; SVGs are about
+     svg_bytes each
+   - completed holds a share of the students for each page, inprogress
+     leases a few more, and every student with a completed page has a
+     score for it, so grading state looks like mid-semester
+   - State is written as JSON files; run virtualgrade.migrate on the
+     result to benchmark the SQLite backend
+   - The same seed gives the same tree
+
+usage: python -m virtualgrade.bench.fixtures <dir> [-c <courses>]
+                                             [-a <assignments>]
+                                             [-s <students>] [-p <pages>]
+                                             [-v <versions>]
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+
+GRADERS = 4
+LEASE_SECS = 600
+
+
+def course_names(num):
+        return ['%02d' % i for i in range(num)]
+
+
+def assignment_names(num):
+        return ['hw%d' % (i + 1) for i in range(num)]
+
+
+def student_names(num):
+        return ['s%05d' % i for i in range(num)]
+
+
+def grader_names(num=GRADERS):
+        return ['g%02d' % i for i in range(num)]
+
+
+def _write_json(path, doc):
+        with open(path, 'w') as f:
+                f.write(json.dumps(doc))
+
+
+def _svg(rnd, size):
+        parts = ['<svg xmlns="http://www.w3.org/2000/svg" '
+                 'width="612" height="792">\n']
+        length = len(parts[0])
+        while length < size:
+                line = '<path d="M%d %d L%d %d L%d %d" stroke="#000"/>\n' % \
+                    tuple(rnd.randrange(800) for i in range(6))
+                parts.append(line)
+                length += len(line)
+        parts.append('</svg>\n')
+        return ''.join(parts)
+
+
+def _make_submissions(comp, course, assignment, students, pages, versions,
+                      rnd, svg_bytes):
+        base = comp + course + '/grading/' + assignment + '/'
+        for student in students:
+                for n in range(1, rnd.randint(1, versions) + 1):
+                        sub = base + '%s.%d/' % (student, n)
+                        os.makedirs(sub)
+                        for k in range(1, pages + 1):
+                                with open(sub + 'p%d.svg' % k, 'w') as f:
+                                        f.write(_svg(rnd, svg_bytes))
+
+
+def _make_state(storage, course, assignment, students, pages, rnd,
+                completed, inprogress):
+        state = storage + 'assignments/' + course + '/' + assignment + '/'
+        os.makedirs(state)
+        graders = grader_names()
+        now = time.time()
+        com = {}
+        inp = {}
+        scores = {}
+        for k in range(1, pages + 1):
+                page = str(k)
+                done = [x for x in students if rnd.random() < completed]
+                com[page] = done
+                for student in done:
+                        scores.setdefault(student, {})[page] = \
+                            rnd.randint(0, 10)
+                leases = {}
+                for student in students:
+                        if student not in done and rnd.random() < inprogress:
+                                leases[student] = {
+                                    'grader': rnd.choice(graders),
+                                    'expires': now + LEASE_SECS}
+                inp[page] = leases
+        _write_json(state + 'completed', com)
+        _write_json(state + 'inprogress', inp)
+
+        for student, score in scores.items():
+                path = storage + 'grades/%s/%s/%s/' % (student, course,
+                                                       assignment)
+                os.makedirs(path)
+                _write_json(path + 'score', score)
+
+
+'''
+generate -- writes a tree under base (which must not exist yet)
+            returns (storage path, comp path)
+'''
+
+
+def generate(base, courses=1, assignments=2, students=100, pages=4,
+             versions=2, svg_bytes=8192, completed=0.5, inprogress=0.1,
+             seed=0):
+        rnd = random.Random(seed)
+        storage = base + '/storage/'
+        comp = base + '/comp/'
+        os.makedirs(storage + 'grades')
+        os.makedirs(comp)
+        names = student_names(students)
+        for course in course_names(courses):
+                os.makedirs(storage + 'assignments/' + course)
+                alist = {}
+                for assignment in assignment_names(assignments):
+                        alist[assignment] = {'type': 'pdf',
+                                             'source': 'provide',
+                                             'pages': str(pages),
+                                             'publish': True,
+                                             'publish_com': True}
+                        _make_submissions(comp, course, assignment, names,
+                                          pages, versions, rnd, svg_bytes)
+                        _make_state(storage, course, assignment, names,
+                                    pages, rnd, completed, inprogress)
+                _write_json(storage + 'assignments/' + course + '/alist',
+                            alist)
+        return storage, comp
+
+
+def add_arguments(parser):
+        parser.add_argument('-c', '--courses', type=int, default=1)
+        parser.add_argument('-a', '--assignments', type=int, default=2)
+        parser.add_argument('-s', '--students', type=int, default=100)
+        parser.add_argument('-p', '--pages', type=int, default=4)
+        parser.add_argument('-v', '--versions', type=int, default=2)
+        parser.add_argument('--svg-bytes', type=int, default=8192)
+        parser.add_argument('--seed', type=int, default=0)
+
+
+def generate_from(base, args):
+        return generate(base, args.courses, args.assignments, args.students,
+                        args.pages, args.versions, args.svg_bytes,
+                        seed=args.seed)
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+        parser.add_argument('dir')
+        add_arguments(parser)
+        args = parser.parse_args(argv)
+
+        start = time.perf_counter()
+        storage, comp = generate_from(args.dir, args)
+        print('generated %s and %s in %.1f s' %
+              (storage, comp, time.perf_counter() - start))
+        print('VG_STORAGE_PATH=%s VG_COMP_PATH=%s' % (storage, comp))
+        return 0
+
+
+if __name__ == '__main__':
+        sys.exit(main())
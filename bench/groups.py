@@ -0,0 +1,82 @@
+'''
+groups.py -- compares in-process group resolution (auth._GroupIndex) to the
+             fork-based groups/getent lookups it replaced
+
+usage: python -m virtualgrade.bench.groups <user> [<group>] [-n <runs>]
+'''
+
+import sys
+import time
+import argparse
+from re import split
+from subprocess import Popen, PIPE
+from .. import auth
+
+
+'''
+_fork_admin_grading / _fork_graders -- the original subprocess-based lookups,
+                                       kept here as the baseline
+'''
+
+
+def _fork_admin_grading(remote_user):
+        pipe_cmd = ['groups', remote_user]
+        raw_data = Popen(pipe_cmd, stdout=PIPE).stdout.read().strip().decode()
+        groups = raw_data.split(' ')[2:]
+
+        admin = [x[2:] for x in groups
+                 if x.startswith('ta') and x[2].isdigit()]
+        grading = [x[5:] for x in groups
+                   if x.startswith('grade') and x[5].isdigit()]
+
+        grading += admin
+        return admin, list(set(grading))
+
+
+def _fork_graders(course):
+        pipe_cmd = ['getent', 'group', course]
+        raw_data = Popen(pipe_cmd, stdout=PIPE).stdout.read().strip()
+        try:
+                graders = split(',', split(':', raw_data.decode())[3])
+        except IndexError:
+                return []
+        return [x for x in graders if x not in ('vgrade', 'provide')]
+
+
+def _time(func, arg, runs):
+        start = time.perf_counter()
+        for i in range(runs):
+                func(arg)
+        return (time.perf_counter() - start) / runs
+
+
+def _report(name, fork, nss):
+        print('%-20s fork: %9.1f us   nss: %9.1f us   speedup: %7.1fx' %
+              (name, fork * 1e6, nss * 1e6, fork / nss if nss else 0))
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+        parser.add_argument('user')
+        parser.add_argument('group', nargs='?', default=None)
+        parser.add_argument('-n', '--runs', type=int, default=200)
+        args = parser.parse_args(argv)
+
+        if sorted(map(sorted, _fork_admin_grading(args.user))) != \
+           sorted(map(sorted, auth._get_admin_grading(args.user))):
+                print('warning: lookups disagree for ' + args.user)
+
+        _report('admin/grading',
+                _time(_fork_admin_grading, args.user, args.runs),
+                _time(auth._get_admin_grading, args.user, args.runs))
+
+        if args.group is not None:
+                _report('graders',
+                        _time(_fork_graders, args.group, args.runs),
+                        _time(auth._get_graders, args.group, args.runs))
+
+        return 0
+
+
+if __name__ == '__main__':
+        sys.exit(main())
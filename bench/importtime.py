@@ -0,0 +1,78 @@
+'''
+importtime.py -- cold-start cost of importing the app, measured with
+                 python -X importtime in fresh interpreters
+
+usage: python -m virtualgrade.bench.importtime [-n <runs>] [-t <top>]
+                                               [-m <module>]
+'''
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+
+'''
+HEAVY -- modules that must not be imported just by loading the app
+'''
+HEAVY = ['ldap', 'pymongo', 'brotli']
+
+
+def _package_parent():
+        here = os.path.dirname(os.path.abspath(__file__))
+        return os.path.dirname(os.path.dirname(here))
+
+
+def _run(module):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = _package_parent() + os.pathsep + \
+            env.get('PYTHONPATH', '')
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                               'import ' + module], env=env,
+                              stderr=subprocess.PIPE, universal_newlines=True)
+        wall = time.perf_counter() - start
+
+        imports = []
+        for line in proc.stderr.splitlines():
+                if not line.startswith('import time:') or 'self [us]' in line:
+                        continue
+                self_us, cumulative, name = line[12:].split('|')
+                imports.append((int(cumulative), int(self_us), name.rstrip()))
+        return proc.returncode, wall, imports
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+        parser.add_argument('-n', '--runs', type=int, default=5)
+        parser.add_argument('-t', '--top', type=int, default=15)
+        parser.add_argument('-m', '--module', default='virtualgrade.routes')
+        args = parser.parse_args(argv)
+
+        walls = []
+        for i in range(args.runs):
+                code, wall, imports = _run(args.module)
+                if code != 0:
+                        print('import of %s failed' % args.module)
+                        return code
+                walls.append(wall)
+
+        print('interpreter + import wall time: median %.1f ms, min %.1f ms' %
+              (statistics.median(walls) * 1e3, min(walls) * 1e3))
+        print('%10s %10s  module' % ('cumul us', 'self us'))
+        for cumulative, self_us, name in sorted(imports, reverse=True)[
+                        :args.top]:
+                print('%10d %10d  %s' % (cumulative, self_us, name))
+
+        names = set(x[2].strip() for x in imports)
+        loaded = [x for x in HEAVY if x in names]
+        if loaded:
+                print('warning: heavy modules imported at startup: ' +
+                      ', '.join(loaded))
+        return 0
+
+
+if __name__ == '__main__':
+        sys.exit(main())
@@ -0,0 +1,141 @@
+'''
+ldappool.py -- login throughput and tail latency through ldap_pool against
+               a connection per login, the way auth.login used to bind
+Notes:
+   - The server is fakeldap.FakeServer in this process, so nothing touches
+     the real directory; -l is its latency per operation and -c the extra
+     cost of a new connection (TCP and TLS setup), in milliseconds
+   - -t threads log in -n times in total; every login is timed, failed
+     logins (pool exhausted, server gone) are counted
+   - -r restarts the server every that many milliseconds during the run, to
+     see what a flapping directory costs the pool
+   - peak is the most binds the server saw at once, which the pool bounds
+     by its size (-s)
+
+usage: python -m virtualgrade.bench.ldappool [-t <threads>] [-n <logins>]
+                                             [-s <pool size>] [-l <ms>]
+                                             [-c <ms>] [-r <ms>]
+'''
+
+import sys
+import time
+import argparse
+import threading
+from .. import ldap_pool
+from . import percentile
+from .fakeldap import FakeServer
+
+
+DN = 'uid=bench,ou=People,dc=eecs,dc=tufts,dc=edu'
+PASSWORD = 'bench'
+
+
+'''
+_unpooled -- one connection per login, as auth.login did before ldap_pool
+'''
+
+
+def _unpooled(server):
+        def check(dn, password):
+                con = server.initialize('ldap://fake')
+                try:
+                        con.simple_bind_s(dn, password)
+                        return True
+                except server.INVALID_CREDENTIALS:
+                        return False
+                except server.LDAPError as e:
+                        raise ldap_pool.LDAPUnavailableException(str(e))
+                finally:
+                        con.unbind_s()
+        return check
+
+
+def _restarts(server, interval, done):
+        while not done.wait(interval):
+                server.drop()
+
+
+def _run(server, check, threads, logins, restart):
+        todo = list(range(logins))
+        todo_lock = threading.Lock()
+        times = []
+        failed = [0]
+
+        def worker():
+                while True:
+                        with todo_lock:
+                                if not todo:
+                                        return
+                                todo.pop()
+                        start = time.perf_counter()
+                        try:
+                                ok = check(DN, PASSWORD)
+                        except ldap_pool.LDAPUnavailableException:
+                                ok = False
+                        elapsed = time.perf_counter() - start
+                        with todo_lock:
+                                if ok:
+                                        times.append(elapsed)
+                                else:
+                                        failed[0] += 1
+
+        done = threading.Event()
+        if restart:
+                threading.Thread(target=_restarts,
+                                 args=(server, restart, done),
+                                 daemon=True).start()
+        pool = [threading.Thread(target=worker) for i in range(threads)]
+        start = time.perf_counter()
+        for thread in pool:
+                thread.start()
+        for thread in pool:
+                thread.join()
+        elapsed = time.perf_counter() - start
+        done.set()
+        return times, failed[0], elapsed
+
+
+def _report(name, server, times, failed, elapsed):
+        print('%-9s %8.0f logins/s   p50 %7.2f ms   p90 %7.2f ms   '
+              'p99 %7.2f ms   max %7.2f ms   failed %5d   connects %6d   '
+              'peak %4d' %
+              (name, len(times) / elapsed if elapsed else 0,
+               percentile(times, 50) * 1e3, percentile(times, 90) * 1e3,
+               percentile(times, 99) * 1e3,
+               (max(times) if times else float('nan')) * 1e3,
+               failed, server.connects, server.peak))
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+        parser.add_argument('-t', '--threads', type=int, default=32)
+        parser.add_argument('-n', '--logins', type=int, default=5000)
+        parser.add_argument('-s', '--size', type=int, default=8)
+        parser.add_argument('-l', '--latency', type=float, default=1.0)
+        parser.add_argument('-c', '--connect', type=float, default=5.0)
+        parser.add_argument('-r', '--restart', type=float, default=0.0)
+        args = parser.parse_args(argv)
+
+        print('%d threads, %d logins, pool of %d, %g ms per operation, '
+              '%g ms per connect%s' %
+              (args.threads, args.logins, args.size, args.latency,
+               args.connect, ', restart every %g ms' % args.restart
+               if args.restart else ''))
+        for name in ('unpooled', 'pooled'):
+                server = FakeServer({DN: PASSWORD}, args.latency / 1e3,
+                                    args.connect / 1e3)
+                if name == 'pooled':
+                        ldap_pool._ldap = server
+                        check = ldap_pool.LDAPPool('ldap://fake',
+                                                   args.size).check_credentials
+                else:
+                        check = _unpooled(server)
+                times, failed, elapsed = _run(server, check, args.threads,
+                                              args.logins,
+                                              args.restart / 1e3)
+                _report(name, server, times, failed, elapsed)
+        return 0
+
+
+if __name__ == '__main__':
+        sys.exit(main())
@@ -0,0 +1,259 @@
+'''
+serving.py -- load test of the ASGI app (asgi.py, under uvicorn) against the
+              WSGI app on a fixed number of worker threads, the way it is
+              deployed now
+Notes:
+   - Both servers run in this process on localhost, one after the other,
+     with the same number of threads (-w): WSGI workers, and ASGI_WORKERS
+     for ASGI
+   - Load is -i slow connections (a request sent only partway, as from a
+     grader on a bad network) plus -c clients sending -n requests in
+     total, each on a new connection
+   - A slow connection holds a WSGI worker until its request arrives;
+     under ASGI it holds no thread at all, which is the difference this
+     measures
+   - -d injects that many seconds into every file system call under
+     STORAGE_PATH and COMP_PATH (see slowfs.py), to look like NFS
+   - A request that gets no answer within TIMEOUT seconds ends the run;
+     it and every request not yet sent count as failed
+   - Requests are made as -u, with -g as their grading courses, through a
+     signed session cookie; the live storage tree is read, nothing is
+     written
+   - uvicorn is only needed for this benchmark, not for the app
+
+usage: python -m virtualgrade.bench.serving [-p <path>] [-u <user>]
+                                            [-g <course> ...] [-c <clients>]
+                                            [-i <slow>] [-n <requests>]
+                                            [-w <workers>] [-d <delay>]
+'''
+
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from .. import constants
+from .. import routes
+from . import percentile
+from .slowfs import stall
+
+
+TIMEOUT = 10
+
+
+class _QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args):
+                pass
+
+
+'''
+_SyncWorkers -- WSGI server handing each connection to one of a fixed number
+                of worker threads for as long as it stays open, like a
+                sync worker
+'''
+
+
+class _SyncWorkers(BaseWSGIServer):
+        def __init__(self, workers, host, port, app):
+                super().__init__(host, port, app, handler=_QuietHandler)
+                self.pool = ThreadPoolExecutor(max_workers=workers)
+
+        def process_request(self, request, client_address):
+                self.pool.submit(self._process, request, client_address)
+
+        def _process(self, request, client_address):
+                try:
+                        self.finish_request(request, client_address)
+                except Exception:
+                        self.handle_error(request, client_address)
+                finally:
+                        self.shutdown_request(request)
+
+
+def _free_port():
+        with contextlib.closing(socket.socket()) as s:
+                s.bind(('127.0.0.1', 0))
+                return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def _serve_wsgi(port, workers):
+        server = _SyncWorkers(workers, '127.0.0.1', port, routes.app)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+                yield
+        finally:
+                server.shutdown()
+                server.pool.shutdown(wait=False)
+
+
+@contextlib.contextmanager
+def _serve_asgi(port, workers):
+        try:
+                import uvicorn
+        except ImportError:
+                raise SystemExit('the ASGI benchmark needs uvicorn '
+                                 '(pip install uvicorn)')
+        constants.ASGI_WORKERS = workers
+        from .. import asgi
+        server = uvicorn.Server(uvicorn.Config(
+            asgi.app, host='127.0.0.1', port=port, log_level='warning',
+            backlog=4096))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+                time.sleep(0.01)
+        try:
+                yield
+        finally:
+                server.should_exit = True
+                thread.join()
+
+
+async def _read_response(reader):
+        head = await reader.readuntil(b'\r\n\r\n')
+        status = int(head.split(b' ', 2)[1])
+        headers = head.lower()
+        if b'content-length:' in headers:
+                length = int(headers.split(b'content-length:')[1]
+                             .split(b'\r\n')[0])
+                await reader.readexactly(length)
+        elif b'chunked' in headers:
+                await reader.readuntil(b'0\r\n\r\n')
+        return status
+
+
+def _request(port, path, cookie):
+        return ('GET %s HTTP/1.1\r\nHost: 127.0.0.1:%d\r\nCookie: %s\r\n'
+                'Connection: close\r\n\r\n' % (path, port, cookie)).encode()
+
+
+async def _slow(port, path, cookie, opened, stop):
+        try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection('127.0.0.1', port), TIMEOUT)
+                writer.write(_request(port, path, cookie)[:-2])
+                await writer.drain()
+        except (OSError, asyncio.TimeoutError):
+                return
+        finally:
+                opened.append(1)
+        await stop.wait()
+        writer.close()
+
+
+async def _client(port, path, cookie, todo, results):
+        while todo and None not in results:
+                todo.pop()
+                start = time.perf_counter()
+                try:
+                        reader, writer = await asyncio.wait_for(
+                            asyncio.open_connection('127.0.0.1', port),
+                            TIMEOUT)
+                        writer.write(_request(port, path, cookie))
+                        status = await asyncio.wait_for(
+                            _read_response(reader), TIMEOUT)
+                        writer.close()
+                except (OSError, asyncio.TimeoutError,
+                        asyncio.IncompleteReadError):
+                        status = None
+                results.append((status, time.perf_counter() - start))
+                if status is None:
+                        results.append(None)
+
+
+async def _load(port, path, cookie, clients, slow, num):
+        stop = asyncio.Event()
+        opened = []
+        slowed = [asyncio.ensure_future(_slow(port, path, cookie, opened,
+                                              stop))
+                  for i in range(slow)]
+        while len(opened) < slow:
+                await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+
+        todo = list(range(num))
+        results = []
+        start = time.perf_counter()
+        await asyncio.gather(*[_client(port, path, cookie, todo, results)
+                               for i in range(clients)])
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        await asyncio.gather(*slowed)
+        results = [x for x in results if x is not None]
+        results.extend((None, 0) for x in range(num - len(results)))
+        return results, elapsed
+
+
+def _report(name, results, elapsed, threads):
+        ok = [t for status, t in results if status == 200]
+        failed = len(results) - len(ok)
+        print('%-5s %6d ok %5d failed %8.1f req/s   p50 %8.1f ms   '
+              'p90 %8.1f ms   p99 %8.1f ms   threads %4d' %
+              (name, len(ok), failed, len(ok) / elapsed if elapsed else 0,
+               percentile(ok, 50) * 1e3, percentile(ok, 90) * 1e3,
+               percentile(ok, 99) * 1e3, threads))
+
+
+def _session_cookie(user, grading):
+        serializer = routes.app.session_interface.get_signing_serializer(
+            routes.app)
+        value = serializer.dumps({'username': user, 'admin': [],
+                                  'grading': grading})
+        return '%s=%s' % (routes.app.config['SESSION_COOKIE_NAME'], value)
+
+
+def _run(name, serve, args, cookie):
+        port = _free_port()
+        peak = [threading.active_count()]
+        done = threading.Event()
+
+        def sample():
+                while not done.wait(0.05):
+                        peak[0] = max(peak[0], threading.active_count())
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        with serve(port, args.workers):
+                sampler.start()
+                results, elapsed = asyncio.run(_load(
+                    port, args.path, cookie, args.clients, args.slow,
+                    args.requests))
+                done.set()
+        _report(name, results, elapsed, peak[0])
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+        parser.add_argument('-p', '--path', default='/getUser')
+        parser.add_argument('-u', '--user', default='aplume01')
+        parser.add_argument('-g', '--grading', action='append', default=[])
+        parser.add_argument('-c', '--clients', type=int, default=32)
+        parser.add_argument('-i', '--slow', type=int, default=200)
+        parser.add_argument('-n', '--requests', type=int, default=2000)
+        parser.add_argument('-w', '--workers', type=int, default=16)
+        parser.add_argument('-d', '--delay', type=float, default=0.0)
+        args = parser.parse_args(argv)
+
+        cookie = _session_cookie(args.user, args.grading)
+        print('%s: %d clients, %d slow connections, %d requests, '
+              '%d threads, %g s per file system call' %
+              (args.path, args.clients, args.slow, args.requests,
+               args.workers, args.delay))
+        with contextlib.ExitStack() as stack:
+                if args.delay > 0:
+                        for root in set([constants.STORAGE_PATH,
+                                         constants.COMP_PATH]):
+                                stack.enter_context(stall(root, args.delay))
+                _run('wsgi', _serve_wsgi, args, cookie)
+                _run('asgi', _serve_asgi, args, cookie)
+        return 0
+
+
+if __name__ == '__main__':
+        sys.exit(main())
@@ -0,0 +1,122 @@
+'''
+slowfs.py -- stalls one mount of a throwaway tree and shows fsio's deadlines
+             and circuit breaker at work, without FUSE or a real NFS server
+Notes:
+   - stall() wraps os.stat/os.lstat/os.scandir/os.listdir and open so that
+     every call under a root sleeps first (or fails with an errno), which is
+     what a stalled NFS mount looks like to this code
+   - main() builds a small storage tree and course tree in a temporary
+     directory, stalls the course tree, and times reads on both: the first
+     FSIO_BREAKER_FAILURES course reads take the deadline, the rest fail
+     at once, and storage reads are unaffected throughout
+
+usage: python -m virtualgrade.bench.slowfs [-d <delay>] [-t <deadline>]
+                                           [-n <reads>]
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import builtins
+import tempfile
+import contextlib
+
+
+_WRAPPED = ((os, 'stat'), (os, 'lstat'), (os, 'scandir'), (os, 'listdir'),
+            (builtins, 'open'))
+
+
+'''
+stall -- context manager making file system calls on paths under root sleep
+         for delay seconds, then fail with OSError(error) if error is given
+         e.g. with stall('/comp/', 10): ...
+              with stall('/comp/', 0, errno.ESTALE): ...
+'''
+
+
+@contextlib.contextmanager
+def stall(root, delay, error=None):
+        def wrap(func):
+                def stalled(path, *args, **kwargs):
+                        if isinstance(path, str) and path.startswith(root):
+                                time.sleep(delay)
+                                if error is not None:
+                                        raise OSError(error,
+                                                      os.strerror(error), path)
+                        return func(path, *args, **kwargs)
+                return stalled
+
+        originals = [(mod, name, getattr(mod, name))
+                     for mod, name in _WRAPPED]
+        try:
+                for mod, name, func in originals:
+                        setattr(mod, name, wrap(func))
+                yield
+        finally:
+                for mod, name, func in originals:
+                        setattr(mod, name, func)
+
+
+def _make_tree(base):
+        storage = base + '/storage/'
+        comp = base + '/comp/'
+        os.makedirs(storage + 'assignments/00/hw1')
+        os.makedirs(storage + 'grades')
+        with open(storage + 'assignments/00/alist', 'w') as f:
+                f.write(json.dumps({'hw1': {'type': 'pdf', 'pages': '1',
+                                            'source': 'provide'}}))
+        os.makedirs(comp + '00/grading/hw1/aplume01.1')
+        with open(comp + '00/grading/hw1/aplume01.1/p1.svg', 'w') as f:
+                f.write('<svg/>')
+        return storage, comp
+
+
+def _timed(func, *args):
+        start = time.perf_counter()
+        try:
+                func(*args)
+                outcome = 'ok'
+        except Exception as e:
+                outcome = type(e).__name__
+        return (time.perf_counter() - start) * 1e3, outcome
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+        parser.add_argument('-d', '--delay', type=float, default=1.0,
+                            help='seconds each stalled call sleeps')
+        parser.add_argument('-t', '--deadline', type=float, default=0.2,
+                            help='FSIO_DEADLINE_SECS for this run')
+        parser.add_argument('-n', '--reads', type=int, default=8)
+        args = parser.parse_args(argv)
+
+        base = tempfile.mkdtemp(prefix='vg-slowfs-')
+        storage, comp = _make_tree(base)
+        os.environ['VG_STORAGE_PATH'] = storage
+        os.environ['VG_COMP_PATH'] = comp
+
+        from .. import constants
+        from .. import file_manager
+        from .. import fsio
+        constants.FSIO_DEADLINE_SECS = args.deadline
+
+        svg = comp + '00/grading/hw1/aplume01.1/p1.svg'
+        print('stalling %s for %gs per call, deadline %gs' %
+              (comp, args.delay, args.deadline))
+        with stall(comp, args.delay):
+                for i in range(args.reads):
+                        c_ms, c_out = _timed(fsio.call, svg, os.stat, svg)
+                        s_ms, s_out = _timed(file_manager.read_alist_signed,
+                                             '00')
+                        print('read %2d  comp: %8.1f ms %-26s '
+                              'storage: %6.2f ms %s' %
+                              (i + 1, c_ms, c_out, s_ms, s_out))
+        for root, status in sorted(fsio.get_status().items()):
+                print('%-40s %s' % (root, status))
+        return 0
+
+
+if __name__ == '__main__':
+        sys.exit(main())
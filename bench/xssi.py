@@ -0,0 +1,97 @@
+'''
+xssi.py -- memory and throughput of the XSSI/compression hook (routes.post_req)
+           against the original get_data/set_data implementation, serving a
+           multi-megabyte problem SVG
+
+usage: python -m virtualgrade.bench.xssi [-m <megabytes>] [-n <runs>]
+'''
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+from flask import Flask, Response, send_file
+from .. import routes
+
+
+def _old_post_req(response):
+        d = response.get_data()
+        d = b")]}',\n" + d
+        response.set_data(d)
+        return response
+
+
+'''
+_make_app -- app serving the SVG either read into memory (the only option
+             with the original hook, which cannot handle send_file) or
+             streamed from disk
+'''
+
+
+def _make_app(hook, path, streamed):
+        app = Flask(__name__)
+        app.after_request(hook)
+
+        @app.route('/problem')
+        def problem():
+                if streamed:
+                        return send_file(path, mimetype='image/svg+xml')
+                with open(path, 'rb') as f:
+                        return Response(f.read(), mimetype='image/svg+xml')
+
+        return app
+
+
+def _run(app, runs, encoding):
+        client = app.test_client()
+        headers = {'Accept-Encoding': encoding} if encoding else {}
+        total = 0
+        tracemalloc.start()
+        start = time.perf_counter()
+        for i in range(runs):
+                resp = client.get('/problem', headers=headers, buffered=False)
+                for chunk in resp.response:
+                        total += len(chunk)
+                resp.close()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return elapsed / runs, peak, total / runs
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+        parser.add_argument('-m', '--megabytes', type=int, default=8)
+        parser.add_argument('-n', '--runs', type=int, default=10)
+        args = parser.parse_args(argv)
+
+        line = b'<path d="M 10 10 L 20 20 L 30 10 Z" stroke="red"/>\n'
+        with tempfile.NamedTemporaryFile(suffix='.svg', delete=False) as f:
+                f.write(b'<svg>\n')
+                f.write(line * (args.megabytes * 2**20 // len(line)))
+                f.write(b'</svg>\n')
+                path = f.name
+
+        try:
+                runs = (('get_data/set_data', _old_post_req, False, None),
+                        ('post_req buffered', routes.post_req, False, None),
+                        ('post_req send_file', routes.post_req, True, None),
+                        ('post_req send_file', routes.post_req, True, 'gzip'))
+                for name, hook, streamed, encoding in runs:
+                        app = _make_app(hook, path, streamed)
+                        secs, peak, size = _run(app, args.runs, encoding)
+                        print('%-20s %-5s %8.1f ms  %8.1f MB/s  '
+                              'peak %8.2f MB  body %8.2f MB' %
+                              (name, encoding or '-', secs * 1e3,
+                               args.megabytes / secs, peak / 2**20,
+                               size / 2**20))
+        finally:
+                os.unlink(path)
+
+        return 0
+
+
+if __name__ == '__main__':
+        sys.exit(main())
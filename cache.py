@@ -0,0 +1,108 @@
+'''
+cache.py -- small, thread-safe caches shared by the Virtual Grade modules
+Notes:
+   - Caches here never touch the file system; validation of cached entries
+     (e.g. comparing stat results) is up to the caller
+   - Every cache keeps hit/miss counters so that we can tell from the
+     outside whether it is doing its job
+'''
+
+import threading
+from collections import OrderedDict
+
+
+'''
+LRUCache -- bounded least-recently-used mapping
+            - maxsize: maximum number of entries kept
+            - maxbytes/sizeof: optionally, a bound on the total size of the
+                               entries, as measured by sizeof(value)
+            - get() returns the default and counts a miss if the key is
+              missing, otherwise moves the entry to the front and counts a hit
+            - get(key, check=f) also treats an entry as missing unless
+              f(value) is true, so an entry found stale counts as a miss;
+              f runs outside the cache's lock and may touch the file system
+'''
+
+_MISSING = object()
+
+
+class LRUCache:
+        def __init__(self, maxsize=128, maxbytes=None, sizeof=None):
+                self.maxsize = maxsize
+                self.maxbytes = maxbytes
+                self.sizeof = sizeof
+                self.bytes = 0
+                self.hits = 0
+                self.misses = 0
+                self.evictions = 0
+                self._data = OrderedDict()
+                self._lock = threading.Lock()
+
+        def _size(self, value):
+                return self.sizeof(value) if self.sizeof is not None else 0
+
+        def _over(self):
+                return len(self._data) > self.maxsize or \
+                    (self.maxbytes is not None and self.bytes > self.maxbytes)
+
+        def get(self, key, default=None, check=None):
+                with self._lock:
+                        value = self._data.get(key, _MISSING)
+                        if value is _MISSING:
+                                self.misses += 1
+                                return default
+                        if check is None:
+                                self._data.move_to_end(key)
+                                self.hits += 1
+                                return value
+                valid = check(value)
+                with self._lock:
+                        if not valid:
+                                self.misses += 1
+                                return default
+                        if key in self._data:
+                                self._data.move_to_end(key)
+                        self.hits += 1
+                        return value
+
+        def put(self, key, value):
+                with self._lock:
+                        if key in self._data:
+                                self.bytes -= self._size(self._data[key])
+                        self._data[key] = value
+                        self._data.move_to_end(key)
+                        self.bytes += self._size(value)
+                        while self._data and self._over():
+                                key, old = self._data.popitem(last=False)
+                                self.bytes -= self._size(old)
+                                self.evictions += 1
+
+        def pop(self, key, default=None):
+                with self._lock:
+                        if key not in self._data:
+                                return default
+                        value = self._data.pop(key)
+                        self.bytes -= self._size(value)
+                        return value
+
+        def clear(self):
+                with self._lock:
+                        self._data.clear()
+                        self.bytes = 0
+
+        def stats(self):
+                with self._lock:
+                        stats = {'hits': self.hits, 'misses': self.misses,
+                                 'evictions': self.evictions,
+                                 'size': len(self._data),
+                                 'maxsize': self.maxsize}
+                        if self.maxbytes is not None:
+                                stats['bytes'] = self.bytes
+                                stats['maxbytes'] = self.maxbytes
+                        return stats
+
+        def __len__(self):
+                return len(self._data)
+
+        def __contains__(self, key):
+                return key in self._data
@@ -0,0 +1,68 @@
+'''
+config.py -- lazily resolved deployment configuration
+Notes:
+   - Nothing is read at import time; every setting is resolved the first
+     time it is asked for and then remembered
+   - Settings come from the environment first, then from an optional JSON
+     config file named by VG_CONFIG, then from the default given by the
+     caller
+   - SETTINGS maps each setting to its environment variable; any other
+     setting 'name' is read from VG_<NAME>
+'''
+
+import os
+import json
+import threading
+
+
+SETTINGS = {
+        'storage_path': 'VG_STORAGE_PATH',
+        'comp_path': 'VG_COMP_PATH',
+        'lib_path': 'VG_LIB_PATH',
+        'secret_key': 'SECRET_KEY',
+        'ldap_url': 'VG_LDAP_URL',
+        'mongo_url': 'VG_MONGO_URL',
+}
+CONFIG_ENV = 'VG_CONFIG'
+
+
+'''
+Config -- the settings for this process
+          e.g. config.get('storage_path', '/r/virtualgrade/')
+'''
+
+
+class Config:
+        def __init__(self):
+                self._file = None
+                self._values = {}
+                self._lock = threading.Lock()
+
+        def _read_file(self):
+                if self._file is None:
+                        self._file = {}
+                        path = os.environ.get(CONFIG_ENV)
+                        if path:
+                                with open(path, 'r') as f:
+                                        self._file = json.loads(f.read())
+                return self._file
+
+        def get(self, name, default=None):
+                with self._lock:
+                        if name not in self._values:
+                                env = SETTINGS.get(name, 'VG_' + name.upper())
+                                if env in os.environ:
+                                        value = os.environ[env]
+                                else:
+                                        value = self._read_file().get(name)
+                                self._values[name] = value
+                        value = self._values[name]
+                return default if value is None else value
+
+        def reset(self):
+                with self._lock:
+                        self._file = None
+                        self._values = {}
+
+
+config = Config()
@@ -8,10 +8,14 @@ Date created: Nov 8, 2016
 import os
 import pwd
 import getpass  # to get home directory
+from .config import config
 
 
 def _storage_owner(path):
-    owner = pwd.getpwuid(os.stat(path).st_uid)[0]
+    try:
+        owner = pwd.getpwuid(os.stat(path).st_uid)[0]
+    except (OSError, KeyError):
+        return False
     return owner == getpass.getuser()
 
 '''
@@ -26,29 +30,205 @@ FILE PATHS:
              an assignment
 - inprogress: list of currently-grading students
               for an assignment
+- progress: per-page counts of completed and
+            currently-grading students, and of
+            submissions, for an assignment
+- lock: lock file guarding writes to an
+        assignment's state files
 - lib: path to this module, in case subprocess
        needs to run local scripts (e.g. groups)
+
+root, storage, grades, comp, assign and lib are
+resolved lazily (see _LAZY_PATHS below) from the
+configuration, so importing this module touches
+no file system
 '''
 
 
-ROOT_PATH = os.path.expanduser('~') + '/'
-_owner = _storage_owner('/r/virtualgrade/grades/')
-STORAGE_PATH = '/r/virtualgrade/' if _owner else ROOT_PATH
-GRADES_PATH = STORAGE_PATH + 'grades/'
-COMP_PATH = '/comp/'
 GRADING_PATH = '/grading/'
-ASSIGN_PATH = STORAGE_PATH + 'assignments/'
 ALIST_PATH = '/alist'
-LIB_PATH = ROOT_PATH + 'vgrade/'
 COMPLETED_FILE = 'completed'
 INPROGRESS_FILE = 'inprogress'
+PROGRESS_FILE = 'progress'
+LOCK_FILE = '.lock'
 PROVIDE_SRC = 'provide'
 CUR_SEMESTER = '2016f'
 
+'''
+CACHES:
+- alist: maximum number of parsed alist documents (one per course) kept in
+         memory by file_manager
+- state: maximum number of parsed assignment state files (completed,
+         inprogress) kept in memory by file_manager
+- user: maximum number of assembled /getUser responses kept in memory by
+        library
+'''
+ALIST_CACHE_SIZE = 64
+STATE_CACHE_SIZE = 256
+USER_CACHE_SIZE = 1024
+
+'''
+STATE STORAGE (see storage.py):
+- backend: where completed/inprogress/score documents live unless the
+           'state_backend' setting says otherwise: 'json' (one file per
+           document) or 'sqlite' (the 'state_db' database)
+- db: the SQLite database unless the 'state_db' setting (VG_STATE_DB) says
+      otherwise; it must be on a local disk, since WAL needs memory shared
+      by every process using the database, which network file systems
+      (NETWORK_FILE_SYSTEMS) cannot provide; storage refuses to open it on
+      one. So the sqlite backend serves the workers of a single machine
+- busy timeout: seconds an SQLite writer waits for another one to commit
+- journal: suffix of the append-only journal kept next to a JSON state
+           document, and the size past which it is compacted into the
+           document in the background
+'''
+STATE_BACKEND = 'json'
+STATE_DB = '/var/lib/virtualgrade/state.db'
+NETWORK_FILE_SYSTEMS = ('nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'afs',
+                        'ceph', 'glusterfs', 'lustre', '9p', 'fuse.sshfs')
+SQLITE_BUSY_TIMEOUT = 10
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_COMPACT_BYTES = 256 * 2**10
+
+'''
+GRADES INDEX (see grades_index.py):
+- file: where the user <-> course index of the grades tree is saved, under
+        STORAGE_PATH
+'''
+GRADES_INDEX_FILE = 'grades.index'
+
+'''
+SUBMISSION INDEX:
+- recheck: seconds between mtime checks of a provide assignment directory
+           that has a live inotify watch; inotify does not see changes made
+           by other NFS clients, so this bounds how stale the index can get
+'''
+SUBMISSION_RECHECK_SECS = 30
+
+'''
+WORK QUEUE:
+- lease: seconds a grader holds a student handed out by getNextStudent
+         before the student goes back into the queue
+'''
+LEASE_SECS = 600
+
+'''
+PROBLEM FILES:
+- latest: Cache-Control for a raw problem file from the latest submission,
+          which changes when the student resubmits (revalidated by ETag)
+- immutable: Cache-Control for a raw problem file from a specific
+             submission version, which never changes
+- csp: Content-Security-Policy for a raw problem file; the SVG comes from
+       a student, so it must not run scripts or load anything when opened
+       directly (stored XSS), only its inline styles apply
+- cache: problem sources are cached in memory up to a total of
+         PROBLEM_CACHE_BYTES (raw plus compressed), files larger than
+         PROBLEM_CACHE_MAX_ITEM are never cached; PROBLEM_CACHE_DIR is an
+         optional local directory used as a second tier, kept under
+         PROBLEM_CACHE_DIR_BYTES
+- stream: an uncached problem file is sent in PROBLEM_STREAM_CHUNK byte
+          reads, each on the COMP_PATH pool
+- compression: gzip level and brotli quality; a source is compressed in
+               the request that first asks for an encoding, so these are
+               kept at levels that take a few milliseconds per megabyte
+'''
+PROBLEM_CACHE_CONTROL = 'private, no-cache'
+PROBLEM_IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+PROBLEM_CSP = "default-src 'none'; style-src 'unsafe-inline'; sandbox"
+PROBLEM_CACHE_BYTES = 256 * 2**20
+PROBLEM_CACHE_MAX_ITEM = 16 * 2**20
+PROBLEM_STREAM_CHUNK = 2**16
+PROBLEM_CACHE_DIR = None
+PROBLEM_CACHE_DIR_BYTES = 2**30
+PROBLEM_INDEX_SIZE = 16384
+PROBLEM_GZIP_LEVEL = 6
+PROBLEM_BROTLI_QUALITY = 5
+
+'''
+PREFETCH:
+- workers: threads per process warming the problem cache
+- default: how many upcoming students getNextStudent warms, unless the
+           assignment sets 'prefetch' in its alist entry
+'''
+PREFETCH_WORKERS = 4
+PREFETCH_DEFAULT = 3
+
+'''
+FILE SYSTEM (see fsio.py):
+- workers: threads per mount (storage, comp) for reads
+- deadline: seconds a read may take before the request gives up on it
+- max pending: reads in flight per mount past which new ones are refused
+- breaker: failures within the window (seconds) that mark a mount
+           unavailable, and seconds until it is tried again
+'''
+FSIO_WORKERS = 8
+FSIO_DEADLINE_SECS = 5
+FSIO_MAX_PENDING = 64
+FSIO_BREAKER_FAILURES = 3
+FSIO_BREAKER_WINDOW_SECS = 30
+FSIO_BREAKER_RESET_SECS = 30
+
+'''
+ASGI (see asgi.py):
+- workers: threads per process running request handlers
+- max body: largest request body accepted, in bytes
+'''
+ASGI_WORKERS = 32
+ASGI_MAX_BODY = 2**20
+
+'''
+BATCH:
+- workers: threads per process shared by batch requests
+- window: maximum reads one batch request keeps in flight
+'''
+BATCH_WORKERS = 8
+BATCH_WINDOW = 16
+
+'''
+GROUPS:
+- ttl: seconds before a user's ta*/grade* groups, or a group's members,
+       are looked up again in NSS; until that lookup (in the background)
+       finishes, the old answer is served
+- size: maximum number of users and groups kept; the least recently used
+        are dropped, so course names from requests cannot grow it
+'''
+GROUP_CACHE_TTL = 300
+GROUP_CACHE_SIZE = 4096
+
+'''
+TOKENS (auth_mode 'token', see auth.py):
+- auth: seconds an auth token is valid; permission changes take effect
+        when it is reissued
+- refresh: seconds a refresh token (i.e. a login) is valid, unless it is
+           revoked by logging out
+- cache: maximum number of verified tokens kept per process
+- revoked: directory under STORAGE_PATH where logouts record the refresh
+           tokens they revoke, shared by every app node
+'''
+TOKEN_AUTH_SECS = 900
+TOKEN_REFRESH_SECS = 3 * 24 * 3600
+TOKEN_CACHE_SIZE = 4096
+TOKEN_REVOKED_DIR = 'revoked'
+
+'''
+LDAP:
+- pool size: maximum number of open connections per worker process
+- connect/op timeouts: seconds before a connection attempt or a bind gives up
+- acquire timeout: seconds a login waits for a free pooled connection
+- health check: idle seconds after which a pooled connection is checked
+                before it is reused
+'''
+LDAP_POOL_SIZE = 8
+LDAP_CONNECT_TIMEOUT = 3
+LDAP_OP_TIMEOUT = 5
+LDAP_ACQUIRE_TIMEOUT = 5
+LDAP_HEALTH_CHECK_SECS = 60
+
 '''
 VALID MODULES:
 - pdf
 - scorecard
+  (registered at startup, see registry.py)
 '''
 VALID_MODULES = ['pdf', 'scorecard']
 
@@ -58,7 +238,7 @@ get_course_grading_path -- returns the absolute path for a course's grading dir
 
 
 def get_course_grading_path(course):
-        return COMP_PATH + course + GRADING_PATH
+        return _path('COMP_PATH') + course + GRADING_PATH
 
 
 '''
@@ -68,3 +248,46 @@ MESSAGES:
 '''
 ERROR_MODULE_MSG = "cannot find method"
 NO_MODULE_FOUND_MSG = "unknown method/type"
+
+
+'''
+_LAZY_PATHS -- file paths resolved on first access
+               - storage is /r/virtualgrade/ if it belongs to the current
+                 user (the production host), otherwise the home directory,
+                 unless 'storage_path' is configured
+'''
+
+
+def _root_path():
+        return os.path.expanduser('~') + '/'
+
+
+def _storage_path():
+        path = config.get('storage_path')
+        if path is not None:
+                return path
+        owner = _storage_owner('/r/virtualgrade/grades/')
+        return '/r/virtualgrade/' if owner else _path('ROOT_PATH')
+
+
+_LAZY_PATHS = {
+        'ROOT_PATH': _root_path,
+        'STORAGE_PATH': _storage_path,
+        'GRADES_PATH': lambda: _path('STORAGE_PATH') + 'grades/',
+        'ASSIGN_PATH': lambda: _path('STORAGE_PATH') + 'assignments/',
+        'COMP_PATH': lambda: config.get('comp_path', '/comp/'),
+        'LIB_PATH': lambda: config.get('lib_path',
+                                       _path('ROOT_PATH') + 'vgrade/'),
+}
+
+
+def _path(name):
+        if name not in globals():
+                globals()[name] = _LAZY_PATHS[name]()
+        return globals()[name]
+
+
+def __getattr__(name):
+        if name not in _LAZY_PATHS:
+                raise AttributeError(name)
+        return _path(name)
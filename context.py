@@ -0,0 +1,62 @@
+'''
+context.py -- per-request memo of the lookups a request would otherwise repeat
+Notes:
+   - A route typically goes through several layers that each check
+     permissions and resolve the same course, e.g. /pdf/getProblemForStudent
+     passes three @auth.grader checks and asks for the assignment's source
+     and alist twice; with this memo each of those is looked up once per
+     request
+   - Values live on flask.g, so they are dropped with the request; outside
+     a request (CLIs, batch pool threads) nothing is memoized and every
+     lookup goes straight through
+   - KEYS in use:
+       ('alist', course)                             file_manager
+       ('adetails', course, assignment)              library
+       ('source', course, assignment)                file_manager
+       ('admin', course), ('grader', course)         auth
+       ('submission', course, assignment, student,   provide
+        version)
+   - Only things that do not change while a request runs belong here;
+     grading state (completed, inprogress, scores) is never memoized
+'''
+
+from flask import g, has_app_context
+
+
+def _get_memo():
+        if not has_app_context():
+                return None
+        memo = g.get('vg_context')
+        if memo is None:
+                memo = g.vg_context = {}
+        return memo
+
+
+'''
+lookup -- the value of key for this request, computed as func(*args) the
+          first time it is asked for
+          e.g. lookup(('source', '15', 'hw1'), _get_source, '15', 'hw1')
+'''
+
+
+def lookup(key, func, *args):
+        memo = _get_memo()
+        if memo is None:
+                return func(*args)
+        try:
+                return memo[key]
+        except KeyError:
+                pass
+        value = memo[key] = func(*args)
+        return value
+
+
+'''
+resolved -- the keys looked up so far in this request, in the order they
+            were first resolved; [] outside a request
+'''
+
+
+def resolved():
+        memo = _get_memo()
+        return list(memo) if memo is not None else []
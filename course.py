@@ -4,12 +4,11 @@ Created by: Adam Plumer
 Date created: Dec 27, 2016
 '''
 
-import os
 from . import library
 from . import constants as cons
 from . import auth
 from . import file_manager
-from importlib import import_module
+from . import registry
 
 
 class Course:
@@ -21,6 +20,7 @@ class Course:
                 self.course = course
                 self.assign = assign
                 self.student = student
+                self.problem = problem
                 self.atype = None
                 self.mod = None
                 
@@ -29,15 +29,7 @@ class Course:
         def _init_data(self):
                 if self.assign is not None:
                         self.atype = library._get_type(self.course, self.assign)
-                        try:
-                                os.chdir(cons.LIB_PATH)
-                                if self.atype in cons.VALID_MODULES:
-                                        mod = '.' + self.atype
-                                        self.mod = import_module(mod, 
-                                                                 'virtualgrade')
-
-                        except:
-                                pass
+                        self.mod = registry.get_module(self.atype)
 
 
         def get_graders(self):
@@ -51,24 +43,26 @@ class Course:
                 return [x for x in pages]
 
         def get_grades(self):
-                if self.mod is None or self.assign is None:
+                get_grades = getattr(self.mod, 'get_grades', None)
+                if get_grades is None or self.assign is None:
                         return {}
 
-                return self.mod.get_grades(self.student, self.course, 
-                                           self.assign)
+                return get_grades(user=self.student, course=self.course,
+                                  assignment=self.assign)
 
         def get_students(self):
-                if self.mod is None or self.assign is None:
+                get_students = getattr(self.mod, 'get_students_for_grading',
+                                       None)
+                if get_students is None or self.assign is None:
                         return {}
 
-                return self.mod.get_students_for_grading(self.course, 
-                                                         self.assign)
+                return get_students(course=self.course,
+                                    assignment=self.assign)
 
         def get_adetails(self):
                 if self.assign is None:
                         return {}
-                pages = file_manager.read_alist(self.course)
-                return pages[self.assign] if self.assign in pages else {}
+                return library.get_adetails(self.course, self.assign)
 
         def get_type(self):
                 return self.atype
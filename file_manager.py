@@ -11,6 +11,11 @@ Notes:
    - All modules should have a detailed description
      of which files should contain certain information
      and be able to plan accordingly
+   - Grading state (completed, inprogress, scores) is kept by the
+     storage backend (see storage.py), JSON files by default
+   - Reads go through fsio with a deadline, and writes are refused while
+     the storage mount is marked unavailable (see fsio.py); either raises
+     fsio.MountUnavailableException
    - Any feature requests should go to the current
      project manager for Virtual Grade
 '''
@@ -20,7 +25,13 @@ import os
 import json
 from . import auth
 from . import constants
+from . import context
+from . import fsio
 from . import provide
+from . import paths
+from . import progress
+from . import storage
+from .cache import LRUCache
 
 
 '''
@@ -29,14 +40,7 @@ _check_course -- makes sure that a course is available for reading/writing
 
 
 def _check_course(course):
-        courses = []
-        try:
-                courses = os.listdir(constants.ASSIGN_PATH)
-        except OSError as e:
-                pass
-        except:
-                pass
-        return course in courses
+        return paths.is_dir(paths.resolve(constants.ASSIGN_PATH, course))
 
 
 '''
@@ -58,29 +62,117 @@ def _read_file(filename):
                 return {}
 
 
+'''
+_alist_cache -- parsed alist documents shared by the whole process, keyed by
+                course and validated against the alist file's inode, mtime
+                and size on every read
+'''
+
+_alist_cache = LRUCache(constants.ALIST_CACHE_SIZE)
+
+
+def _stat_signature(st):
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
 '''
 read_alist -- gets the parameters file for a particular course
               - parameters file contains list of all assignments, types, and
                 any extraneous information a module decides to store
+              - the parsed document is shared through _alist_cache, so callers
+                must treat it as read-only
 '''
 
 
 def read_alist(course):
-        if not _check_course(course):
-                return []
-        else:
-                assign = constants.ASSIGN_PATH
-                alist = constants.ALIST_PATH
-                full_path = assign + course + alist
-                return _read_file(full_path)
+        return read_alist_signed(course)[1]
+
+
+'''
+read_alist_signed -- like read_alist, but returns (signature, alist), where
+                     signature is the alist file's (inode, mtime, size) as
+                     it was read, None if there is no alist file; compare it
+                     to alist_signature(course) to tell whether anything
+                     built from the alist is still current
+                     - resolved once per request (see context.py)
+'''
+
+
+def read_alist_signed(course):
+        return context.lookup(('alist', course), fsio.call,
+                              constants.ASSIGN_PATH, _read_alist_signed,
+                              course)
+
+
+def _read_alist_signed(course):
+        if not paths.valid_name(course):
+                return None, []
+
+        full_path = constants.ASSIGN_PATH + course + constants.ALIST_PATH
+        try:
+                sig = _stat_signature(os.stat(full_path))
+        except OSError:
+                _alist_cache.pop(course)
+                return None, {} if _check_course(course) else []
+
+        cached = _alist_cache.get(course, check=lambda x: x[0] == sig)
+        if cached is not None:
+                return cached
+
+        alist = _read_file(full_path)
+        _alist_cache.put(course, (sig, alist))
+        return sig, alist
+
+
+def alist_signature(course):
+        if not paths.valid_name(course):
+                return None
+        full_path = constants.ASSIGN_PATH + course + constants.ALIST_PATH
+        try:
+                return _stat_signature(fsio.call(full_path, os.stat,
+                                                 full_path))
+        except OSError:
+                return None
+
+
+'''
+grades_signature -- (inode, mtime) of a user's grades directory, which
+                    changes whenever a course is added to or removed from it;
+                    None if there is none
+'''
+
+
+def grades_signature(user):
+        full_path = paths.resolve(constants.GRADES_PATH, user)
+        if full_path is None:
+                return None
+        try:
+                st = fsio.call(full_path, os.stat, full_path)
+        except OSError:
+                return None
+        return (st.st_ino, st.st_mtime_ns)
+
+
+'''
+get_alist_cache_stats -- hit/miss/eviction counters for the alist cache
+'''
+
+
+def get_alist_cache_stats():
+        return _alist_cache.stats()
 
 
 '''
-_get_source -- gets the file repository for an assignment in a specific course
+_get_source -- gets the file repository for an assignment in a specific
+               course, resolved once per request
 '''
 
 def _get_source(course, assignment):
+        return context.lookup(('source', course, assignment),
+                              _read_source, course, assignment)
+
 
+def _read_source(course, assignment):
         alist = read_alist(course)
         if (not alist == []) and (assignment in alist):
                 adetails = alist[assignment]
@@ -113,6 +205,48 @@ def get_problem(course='', assignment='', student='', src=''):
         return ''
 
 
+'''
+get_problem_batch -- like get_problem, for many students at once: the source
+                     is resolved once and the files are read concurrently
+                     returns an iterable of (student, source) pairs in the
+                     order the reads finish
+'''
+
+@auth.grader
+def get_problem_batch(course='', assignment='', students=None, src=''):
+        if _get_source(course, assignment) == constants.PROVIDE_SRC:
+                return provide.get_problem_batch(course=course, assignment=assignment, students=students,
+                                                 src=src)
+        return []
+
+
+'''
+get_problem_path -- like get_problem, but only resolves where the file source
+                    is, without touching it; None if it cannot be resolved
+'''
+
+@auth.grader
+def get_problem_path(course='', assignment='', student='', src=''):
+        if _get_source(course, assignment) == constants.PROVIDE_SRC:
+                return provide.get_problem_path(course=course, assignment=assignment, student=student, src=src)
+        return None
+
+
+'''
+get_problem_file -- like get_problem, but resolves the file source for raw
+                    serving instead of reading it
+                    returns (path, stat) or None
+'''
+
+@auth.grader
+def get_problem_file(course='', assignment='', student='', src='',
+                     version=None):
+        if _get_source(course, assignment) == constants.PROVIDE_SRC:
+                return provide.get_problem_file(course=course, assignment=assignment, student=student, src=src,
+                                                version=version)
+        return None
+
+
 '''
 read_completed -- reads in the file containing all info about 'completed'
                   students
@@ -126,35 +260,37 @@ read_completed -- reads in the file containing all info about 'completed'
 
 @auth.grader
 def read_completed(course='', assignment=''):
-        if not _check_course(course):
-                return []
-        else:
-                completed_path = constants.ASSIGN_PATH + course + "/"
-                assigns = []
-                try:
-                        assigns = os.listdir(completed_path)
-                except OSError as e:
-                        pass
-                except:
-                        pass
-                if assignment not in assigns:
-                        return []
-                else:
-                        completed_path += assignment
-                        files = []
-                        try:
-                                files = os.listdir(completed_path)
-                        except OSError as e:
-                                pass
-                        except:
-                                pass
+        return fsio.call(constants.ASSIGN_PATH, storage.get_store().read_state,
+                         course, assignment, constants.COMPLETED_FILE)
 
-                        if constants.COMPLETED_FILE in files:
-                                comp_file = constants.COMPLETED_FILE
-                                completed_path += "/" + comp_file
-                                return _read_file(completed_path)
-                        else:
-                                return {}
+
+'''
+update_completed -- read-modify-write of the 'completed' document, atomic
+                    across graders and workers; see update_inprogress
+'''
+
+@auth.grader
+def update_completed(course='', assignment='', update=None):
+        fsio.check(constants.ASSIGN_PATH)
+        return storage.get_store().update_state(course, assignment,
+                                                constants.COMPLETED_FILE,
+                                                update)
+
+
+'''
+append_completed -- applies small changes to the 'completed' document
+                    without reading it, e.g.
+                    [['add', '1', 'aplume01', None]] marks aplume01 done with
+                    page 1 (see storage.RECORDS for the rest)
+                    returns False if the assignment does not exist
+'''
+
+@auth.grader
+def append_completed(course='', assignment='', records=None):
+        fsio.check(constants.ASSIGN_PATH)
+        return storage.get_store().append_state(course, assignment,
+                                                constants.COMPLETED_FILE,
+                                                records)
 
 
 '''
@@ -170,74 +306,67 @@ read_inprogress -- reads in the file containing all info about inprogress'
 
 @auth.grader
 def read_inprogress(course='', assignment=''):
+        return fsio.call(constants.ASSIGN_PATH, storage.get_store().read_state,
+                         course, assignment, constants.INPROGRESS_FILE)
 
-        if not _check_course(course):
-                return []
-        else:
-                completed_path = constants.ASSIGN_PATH + course + "/"
-                assigns = []
-                try:
-                        assigns = os.listdir(completed_path)
-                except OSError as e:
-                        pass
-                except:
-                        pass
-                if assignment not in assigns:
-                        return []
-                else:
-                        completed_path += assignment
-                        files = []
-                        try:
-                                files = os.listdir(completed_path)
-                        except OSError as e:
-                                pass
-                        except:
-                                pass
 
-                        if constants.INPROGRESS_FILE in files:
-                                inp_file = constants.INPROGRESS_FILE
-                                completed_path += "/" + inp_file
-                                return _read_file(completed_path)
-                        else:
-                                return {}
+'''
+update_inprogress -- read-modify-write of the 'inprogress' document, atomic
+                     across graders and workers; only the changes are
+                     written
+                     - update is called with the current document (a dict,
+                       {} if there is none yet) and may modify it in place;
+                       its return value is returned
+                     - returns None if the assignment does not exist
+'''
+
+@auth.grader
+def update_inprogress(course='', assignment='', update=None):
+        fsio.check(constants.ASSIGN_PATH)
+        return storage.get_store().update_state(course, assignment,
+                                                constants.INPROGRESS_FILE,
+                                                update)
+
+
+'''
+read_progress -- per-page counts of completed and in-progress students, and
+                 the number of students with a submission, for an assignment
+                 (see progress.py); [] if it does not exist
+'''
+
+@auth.grader
+def read_progress(course='', assignment=''):
+        return progress.get_progress(course, assignment)
+
+
+'''
+read_score -- reads in the score file for a user's assignment, returns {} if
+              the user, course, assignment or score file does not exist
+'''
 
 
 def read_score(user, course, assignment):
-        completed_path = constants.GRADES_PATH
-        users = []
-        try:
-                users = os.listdir(completed_path)
-        except OSError as e:
-                pass
-        except:
-                pass
+        return fsio.call(constants.GRADES_PATH, storage.get_store().read_score,
+                         user, course, assignment)
 
-        if user not in users:
-                return {}
 
-        completed_path += user + '/'
-        courses = []
-        try:
-                courses = os.listdir(completed_path)
-        except OSError as e:
-                pass
-        except:
-                pass
+'''
+read_scores -- the score documents of every scored student of an assignment,
+               as {student: score}
+'''
 
-        if course not in courses:
-                return {}
+@auth.grader
+def read_scores(course='', assignment=''):
+        return fsio.call(constants.GRADES_PATH,
+                         storage.get_store().read_scores, course, assignment)
 
-        completed_path += course + '/'
-        assigns = []
-        try:
-                assigns = os.listdir(completed_path)
-        except OSError as e:
-                pass
-        except:
-                pass
 
-        if assignment not in assigns:
-                return {}
+'''
+get_score_for_problem -- gets a student's score for a single problem of an
+                         assignment, None if it has not been scored
+'''
+
 
-        completed_path += assignment + '/score'
-        return _read_file(completed_path)
+def get_score_for_problem(course, assignment, student, problem):
+        score = read_score(student, course, assignment)
+        return score[problem] if problem in score else None
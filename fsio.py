@@ -0,0 +1,251 @@
+'''
+fsio.py -- file system calls with deadlines and a circuit breaker per mount
+Notes:
+   - MOUNTS are the storage tree (STORAGE_PATH) and the course tree
+     (COMP_PATH), both NFS in production; paths outside them are not
+     guarded
+   - Reads (call) run on their mount's own thread pool (FSIO_WORKERS
+     threads) and are waited for at most FSIO_DEADLINE_SECS; a stalled
+     mount raises MountUnavailableException in the request instead of
+     hanging the worker, and since pools are per mount it cannot take the
+     threads that serve the other one
+   - A thread stuck in NFS cannot be interrupted: it keeps its slot until
+     the call returns; past FSIO_MAX_PENDING calls in flight a mount takes
+     no more
+   - Each mount has a circuit breaker: FSIO_BREAKER_FAILURES failures
+     (missed deadlines, EIO/ESTALE/ETIMEDOUT) within FSIO_BREAKER_WINDOW_SECS
+     open it, and calls then fail at once for FSIO_BREAKER_RESET_SECS; after
+     that one call is let through as a probe, and its outcome closes or
+     reopens the breaker
+   - Successes in between do not reset the count: calls answered from
+     memory (e.g. the submissions index) succeed on a stalled mount too
+   - Writes hold locks and change in-memory state (e.g. the work queue),
+     so they are never abandoned halfway: they run in the calling thread
+     and are only refused up front while the breaker is open (check)
+   - A call made from a pool thread runs inline only if it is for that
+     same mount; one for the other mount goes to that mount's pool, with
+     its own deadline and breaker
+   - Work a read finds necessary but that writes or calls out (submission
+     listeners, counting an old progress document) is handed to defer,
+     and runs in the calling thread once the read has returned; it is
+     dropped with the read if that misses its deadline
+   - Other errors (ENOENT, EACCES, ...) are raised to the caller as usual
+     and say nothing about the mount's health
+'''
+
+import time
+import errno
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from . import constants
+
+
+class MountUnavailableException(Exception):
+        def __init__(self, value):
+                self.value = value
+
+        def __str__(self):
+                return repr(self.value)
+
+
+_MOUNT_ERRNOS = frozenset([errno.EIO, errno.ESTALE, errno.ETIMEDOUT])
+_local = threading.local()
+
+
+'''
+_Mount -- the pool and breaker of one mount
+          - pending: calls submitted and not yet returned
+          - failures: times of the failures in the last
+                      FSIO_BREAKER_WINDOW_SECS
+          - opened: monotonic time the breaker opened, None while closed
+          - probing: whether the probe call of an open breaker is out
+'''
+
+
+class _Mount:
+        def __init__(self, root):
+                self.root = root
+                self.executor = ThreadPoolExecutor(
+                    max_workers=constants.FSIO_WORKERS,
+                    thread_name_prefix='vg-fsio')
+                self.lock = threading.Lock()
+                self.pending = 0
+                self.failures = deque()
+                self.opened = None
+                self.probing = False
+
+        def _unavailable(self, why):
+                return MountUnavailableException('%s %s' % (self.root, why))
+
+        def _refuse(self):
+                if time.monotonic() - self.opened < \
+                        constants.FSIO_BREAKER_RESET_SECS or self.probing:
+                        raise self._unavailable('is unavailable')
+
+        def check(self):
+                with self.lock:
+                        if self.opened is not None:
+                                self._refuse()
+
+        def _admit(self):
+                with self.lock:
+                        probe = False
+                        if self.opened is not None:
+                                self._refuse()
+                                probe = True
+                        if self.pending >= constants.FSIO_MAX_PENDING:
+                                raise self._unavailable('is overloaded')
+                        if probe:
+                                self.probing = True
+                        self.pending += 1
+                        return probe
+
+        def _done(self, future):
+                with self.lock:
+                        self.pending -= 1
+
+        def _expire(self, now):
+                while self.failures and now - self.failures[0] > \
+                        constants.FSIO_BREAKER_WINDOW_SECS:
+                        self.failures.popleft()
+
+        def _record(self, ok, probe):
+                with self.lock:
+                        if not probe:
+                                if not ok:
+                                        now = time.monotonic()
+                                        self._expire(now)
+                                        self.failures.append(now)
+                                        if len(self.failures) >= \
+                                           constants.FSIO_BREAKER_FAILURES:
+                                                self.opened = now
+                                return
+                        self.probing = False
+                        if ok:
+                                self.failures.clear()
+                                self.opened = None
+                        else:
+                                self.opened = time.monotonic()
+
+        def call(self, func, args):
+                probe = self._admit()
+                future = self.executor.submit(_run, self, func, args)
+                future.add_done_callback(self._done)
+                try:
+                        result = future.result(
+                            timeout=constants.FSIO_DEADLINE_SECS)
+                except TimeoutError:
+                        future.cancel()
+                        self._record(False, probe)
+                        raise self._unavailable(
+                            'did not answer within %gs' %
+                            constants.FSIO_DEADLINE_SECS)
+                except OSError as e:
+                        self._record(e.errno not in _MOUNT_ERRNOS, probe)
+                        raise
+                except BaseException:
+                        self._record(True, probe)
+                        raise
+                self._record(True, probe)
+                return result
+
+        def status(self):
+                with self.lock:
+                        self._expire(time.monotonic())
+                        return {'open': self.opened is not None,
+                                'failures': len(self.failures),
+                                'pending': self.pending}
+
+
+'''
+_run -- func(*args) on a pool thread of mount, as (result, deferred work)
+'''
+
+
+def _run(mount, func, args):
+        _local.mount = mount
+        _local.deferred = []
+        try:
+                return func(*args), _local.deferred
+        finally:
+                _local.mount = None
+                _local.deferred = None
+
+
+_mounts = None
+_mounts_lock = threading.Lock()
+
+
+def _get_mounts():
+        global _mounts
+        with _mounts_lock:
+                if _mounts is None:
+                        roots = [constants.STORAGE_PATH, constants.COMP_PATH]
+                        _mounts = [_Mount(root) for root in
+                                   sorted(set(roots), key=len, reverse=True)]
+                return _mounts
+
+
+def _get_mount(path):
+        for mount in _get_mounts():
+                if path.startswith(mount.root):
+                        return mount
+        return None
+
+
+'''
+call -- func(*args), run on the pool of the mount path is on and given at
+        most FSIO_DEADLINE_SECS
+        raises MountUnavailableException if the mount's breaker is open or
+        the call missed its deadline
+        e.g. call(full_path, os.stat, full_path)
+'''
+
+
+def call(path, func, *args):
+        mount = _get_mount(path)
+        if mount is None or getattr(_local, 'mount', None) is mount:
+                return func(*args)
+        result, deferred = mount.call(func, args)
+        for work, work_args in deferred:
+                defer(work, *work_args)
+        return result
+
+
+'''
+defer -- func(*args) in the thread that made the current call, after the
+         call has returned; right away outside a call
+         e.g. defer(listener, course, assignment, num_students)
+'''
+
+
+def defer(func, *args):
+        deferred = getattr(_local, 'deferred', None)
+        if deferred is None:
+                func(*args)
+        else:
+                deferred.append((func, args))
+
+
+'''
+check -- raises MountUnavailableException if the breaker of the mount path
+         is on is open; for writes, which run in the calling thread
+'''
+
+
+def check(path):
+        mount = _get_mount(path)
+        if mount is not None:
+                mount.check()
+
+
+'''
+get_status -- breaker state per mount, e.g.
+              { '/comp/' : { 'open' : False, 'failures' : 0,
+                             'pending' : 2 }, ... }
+'''
+
+
+def get_status():
+        return dict((mount.root, mount.status()) for mount in _get_mounts())
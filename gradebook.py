@@ -0,0 +1,171 @@
+'''
+gradebook.py -- streaming export of every score of a course
+Notes:
+   - Students are read in name order through the storage backend; with the
+     JSON files, each student's GRADES_PATH/<user>/<course>/ is scanned
+     and read on the batch pool (see batch.imap), so many students are
+     being read at once while rows still come out in order
+   - Output is produced one student at a time, so memory stays flat for
+     any number of score files
+   - Because rows come out in name order, an interrupted export can be
+     resumed from the last student written ('after')
+   - FORMATS:
+       csv:   student,assignment,problem,score -- one row per problem
+       jsonl: {"student": ..., "assignment": ..., "score": {...}} -- one
+              line per scored assignment
+
+usage: python -m virtualgrade.gradebook <course> [-f csv|jsonl]
+                                        [-a <assignment> ...] [-o <file>]
+                                        [--resume]
+'''
+
+import io
+import os
+import csv
+import sys
+import json
+import argparse
+from . import storage
+
+
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+CSV_HEADER = ['student', 'assignment', 'problem', 'score']
+CHECKPOINT_SUFFIX = '.checkpoint'
+CHECKPOINT_EVERY = 200
+
+
+def _csv_value(value):
+        return value if isinstance(value, (str, int, float)) \
+            else json.dumps(value)
+
+
+def _format_csv(student, scores):
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator='\n')
+        for assignment, score in scores:
+                items = score.items() if isinstance(score, dict) \
+                    else [('', score)]
+                for problem, value in items:
+                        writer.writerow([student, assignment, problem,
+                                         _csv_value(value)])
+        return out.getvalue()
+
+
+def _format_jsonl(student, scores):
+        return ''.join(json.dumps({'student': student,
+                                   'assignment': assignment,
+                                   'score': score}) + '\n'
+                       for assignment, score in scores)
+
+
+_FORMATTERS = {'csv': _format_csv, 'jsonl': _format_jsonl}
+
+
+'''
+export -- the gradebook of a course as text chunks, one per student, paired
+          with the student they are for: (student, chunk)
+          the CSV header comes first, as (None, header), unless resuming
+'''
+
+
+def export(course, fmt='csv', assignments=None, after=None):
+        if fmt not in FORMATS:
+                raise ValueError('unknown gradebook format: %s' % fmt)
+        if fmt == 'csv' and after is None:
+                yield None, ','.join(CSV_HEADER) + '\n'
+        formatter = _FORMATTERS[fmt]
+        store = storage.get_store()
+        for student, scores in store.iter_course_scores(course, assignments,
+                                                        after):
+                yield student, formatter(student, scores)
+
+
+'''
+_read_checkpoint -- {'after': student, 'offset': bytes written} for an
+                    output file, None if there is none
+'''
+
+
+def _read_checkpoint(out_path):
+        try:
+                with open(out_path + CHECKPOINT_SUFFIX, 'r') as f:
+                        return json.loads(f.read())
+        except (OSError, ValueError):
+                return None
+
+
+def _write_checkpoint(out_path, after, offset):
+        tmp = out_path + CHECKPOINT_SUFFIX + '.tmp'
+        with open(tmp, 'w') as f:
+                f.write(json.dumps({'after': after, 'offset': offset}))
+        os.replace(tmp, out_path + CHECKPOINT_SUFFIX)
+
+
+'''
+write -- writes the gradebook of a course to a file, checkpointing every
+         CHECKPOINT_EVERY students so that resume=True picks up after the
+         last checkpoint instead of starting over
+         returns the number of students written
+'''
+
+
+def write(course, out_path, fmt='csv', assignments=None, resume=False):
+        checkpoint = _read_checkpoint(out_path) if resume else None
+        if checkpoint is not None:
+                f = open(out_path, 'r+b')
+                f.truncate(checkpoint['offset'])
+                f.seek(checkpoint['offset'])
+                after = checkpoint['after']
+        else:
+                f = open(out_path, 'wb')
+                after = None
+
+        num = 0
+        with f:
+                for student, chunk in export(course, fmt, assignments, after):
+                        f.write(chunk.encode())
+                        if student is None:
+                                continue
+                        num += 1
+                        if num % CHECKPOINT_EVERY == 0:
+                                f.flush()
+                                _write_checkpoint(out_path, student, f.tell())
+        try:
+                os.remove(out_path + CHECKPOINT_SUFFIX)
+        except OSError:
+                pass
+        return num
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+        parser.add_argument('course')
+        parser.add_argument('-f', '--format', default='csv',
+                            choices=sorted(FORMATS))
+        parser.add_argument('-a', '--assignment', action='append',
+                            dest='assignments',
+                            help='only export this assignment (repeatable)')
+        parser.add_argument('-o', '--output', default=None,
+                            help='file to write (default: stdout)')
+        parser.add_argument('--resume', action='store_true',
+                            help='continue an interrupted export to -o')
+        args = parser.parse_args(argv)
+
+        assignments = set(args.assignments) if args.assignments else None
+        if args.output is None:
+                if args.resume:
+                        parser.error('--resume needs -o')
+                for student, chunk in export(args.course, args.format,
+                                             assignments):
+                        sys.stdout.write(chunk)
+                return 0
+
+        num = write(args.course, args.output, args.format, assignments,
+                    args.resume)
+        print('wrote %d students to %s' % (num, args.output),
+              file=sys.stderr)
+        return 0
+
+
+if __name__ == '__main__':
+        sys.exit(main())
@@ -0,0 +1,230 @@
+'''
+grades_index.py -- two-way index of the grades tree: which courses each user
+                   has grades in, and which users have grades in each course
+Notes:
+   - Layout being indexed:
+         GRADES_PATH/<user>/<course>/...
+     entries like <course>.<anything> count for <course>, as they always
+     have for /getUser
+   - Each user is recorded with their grades directory's mtime; a user's
+     courses are re-listed only when that mtime changes, so keeping the
+     index current costs one stat per user rather than one listdir
+   - user -> courses (/getUser) is checked against that user's directory
+     on every lookup, one stat, and never scans anyone else's
+   - course -> users (score exports, read_scores) is brought up to date on
+     every lookup, one stat per user, so scores written by other workers,
+     by hand or by a grading module are never missed; that is cheap next to
+     the score reads that follow it
+   - File system calls are made outside the index lock; the lock only
+     guards the in-memory maps, so a slow NFS stat holds up nobody else
+   - A score written by this process re-lists its user at once (see
+     update)
+   - The index is saved to GRADES_INDEX_FILE after a full check that found
+     changes, so a restarted worker starts warm and only re-lists the users
+     that changed while it was down
+'''
+
+import os
+import json
+import threading
+from . import constants
+from . import paths
+
+
+'''
+_map_courses -- mapping function to return the course name without extension
+                e.g. 00.hw4.* -> 00
+'''
+
+
+def _map_courses(s):
+        return s.split(".")[0]
+
+
+'''
+_GradesIndex -- the index itself
+                - users: user -> (mtime of their grades directory, courses)
+                - courses: course -> users
+'''
+
+
+class _GradesIndex:
+        def __init__(self):
+                self.users = {}
+                self.courses = {}
+                self.loaded = False
+                self.dirty = False
+                self.lock = threading.Lock()
+                self.refresh_lock = threading.Lock()
+
+        def _set(self, user, entry):
+                old = self.users.get(user)
+                if old is not None:
+                        for course in old[1]:
+                                users = self.courses.get(course)
+                                if users is not None:
+                                        users.discard(user)
+                                        if not users:
+                                                del self.courses[course]
+                if entry is None:
+                        self.users.pop(user, None)
+                else:
+                        self.users[user] = entry
+                        for course in entry[1]:
+                                self.courses.setdefault(course, set()).add(
+                                    user)
+                self.dirty = True
+
+        def _scan_user(self, user, mtime=None):
+                user_path = constants.GRADES_PATH + user
+                try:
+                        if mtime is None:
+                                mtime = os.stat(user_path).st_mtime_ns
+                        entries = os.listdir(user_path)
+                except OSError:
+                        return None
+                return (mtime, frozenset(map(_map_courses, entries)))
+
+        def _load(self):
+                try:
+                        with open(constants.STORAGE_PATH +
+                                  constants.GRADES_INDEX_FILE, 'r') as f:
+                                saved = json.loads(f.read())
+                except (OSError, ValueError):
+                        return
+                for user, (mtime, courses) in saved.items():
+                        self._set(user, (mtime, frozenset(courses)))
+                self.dirty = False
+
+        def _ensure_loaded(self):
+                if not self.loaded:
+                        self._load()
+                        self.loaded = True
+
+        def _save(self, saved):
+                path = constants.STORAGE_PATH + constants.GRADES_INDEX_FILE
+                tmp = '%s.%d.%d.tmp' % (path, os.getpid(),
+                                        threading.get_ident())
+                try:
+                        with open(tmp, 'w') as f:
+                                f.write(json.dumps(saved))
+                        os.replace(tmp, path)
+                except OSError:
+                        pass
+
+        def _apply(self, scanned, known):
+                with self.lock:
+                        for user, entry in scanned:
+                                if self.users.get(user) == known.get(user):
+                                        self._set(user, entry)
+
+        '''
+        _refresh -- brings every user up to date: one scandir of GRADES_PATH
+                    and one stat per user, re-listing only users whose
+                    directory changed; runs outside the index lock, one
+                    refresh at a time
+        '''
+
+        def _refresh(self):
+                with self.refresh_lock:
+                        found = {}
+                        try:
+                                entries = list(os.scandir(
+                                    constants.GRADES_PATH))
+                        except OSError:
+                                entries = []
+                        for entry in entries:
+                                if not paths.valid_name(entry.name):
+                                        continue
+                                try:
+                                        if not entry.is_dir():
+                                                continue
+                                        found[entry.name] = \
+                                            entry.stat().st_mtime_ns
+                                except OSError:
+                                        continue
+                        with self.lock:
+                                self._ensure_loaded()
+                                known = dict(self.users)
+                        scanned = [(user, self._scan_user(user, mtime))
+                                   for user, mtime in found.items()
+                                   if known.get(user) is None or
+                                   known[user][0] != mtime]
+                        scanned.extend((user, None) for user in known
+                                       if user not in found)
+                        self._apply(scanned, known)
+                        with self.lock:
+                                saved = None
+                                if self.dirty:
+                                        saved = dict(
+                                            (user, [mtime, sorted(courses)])
+                                            for user, (mtime, courses)
+                                            in self.users.items())
+                                        self.dirty = False
+                        if saved is not None:
+                                self._save(saved)
+
+        def user_courses(self, user):
+                if not paths.valid_name(user):
+                        return []
+                try:
+                        mtime = os.stat(constants.GRADES_PATH +
+                                        user).st_mtime_ns
+                except OSError:
+                        mtime = None
+                with self.lock:
+                        self._ensure_loaded()
+                        old = self.users.get(user)
+                        if mtime is None:
+                                if old is not None:
+                                        self._set(user, None)
+                                return []
+                        if old is not None and old[0] == mtime:
+                                return sorted(old[1])
+                entry = self._scan_user(user, mtime)
+                self._apply([(user, entry)], {user: old})
+                return sorted(entry[1]) if entry is not None else []
+
+        def course_users(self, course):
+                self._refresh()
+                with self.lock:
+                        return sorted(self.courses.get(course, ()))
+
+        def update(self, user):
+                entry = self._scan_user(user)
+                with self.lock:
+                        self._ensure_loaded()
+                        self._set(user, entry)
+
+
+_index = _GradesIndex()
+
+
+'''
+get_courses -- the courses a user has grades in
+               e.g. 'aplume01' -> ['00', '15', '20']
+'''
+
+
+def get_courses(user):
+        return _index.user_courses(user)
+
+
+'''
+get_users -- the users that have grades in a course, in name order
+             e.g. '15' -> ['aplume01', 'molay', ...]
+'''
+
+
+def get_users(course):
+        return _index.course_users(course)
+
+
+'''
+update -- re-lists a user's grades directory, right after a score was
+          written for them
+'''
+
+
+def update(user):
+        _index.update(user)
@@ -0,0 +1,196 @@
+'''
+ldap_pool.py -- bounded pool of LDAP connections for credential checks
+Notes:
+   - At most LDAP_POOL_SIZE connections are open at a time; a login that
+     cannot get one within LDAP_ACQUIRE_TIMEOUT seconds fails instead of
+     queueing forever, and waiting logins get connections first come,
+     first served
+   - Every connection has a connect (network) timeout and an operation
+     timeout, so a slow directory server can no longer hold a worker
+     indefinitely
+   - Idle connections are health-checked (whoami) before reuse if they sat
+     for more than LDAP_HEALTH_CHECK_SECS; connections that fail with
+     anything other than bad credentials are thrown away
+   - A bind that finds the server gone (SERVER_DOWN, e.g. the server
+     restarted under an idle pooled connection) throws away every idle
+     connection and is retried once on a new one, so the first login after
+     a restart does not fail
+   - python-ldap is only imported when the first connection is made
+'''
+
+import time
+import threading
+from collections import deque
+from . import constants as cons
+
+
+_ldap = None
+
+
+def _get_ldap():
+        global _ldap
+        if _ldap is None:
+                import ldap
+                _ldap = ldap
+        return _ldap
+
+
+class LDAPUnavailableException(Exception):
+        def __init__(self, value):
+                self.value = value
+
+        def __str__(self):
+                return repr(self.value)
+
+
+'''
+LDAPPool -- the pool itself; one per LDAP server URL
+            - check_credentials(dn, password) binds as the given DN on a
+              pooled connection and returns True for a successful bind,
+              False for invalid credentials; raises LDAPUnavailableException
+              if the server could not answer
+'''
+
+
+class LDAPPool:
+        def __init__(self, url, size=None):
+                self.url = url
+                self.size = size if size is not None else cons.LDAP_POOL_SIZE
+                self._idle = deque()
+                self._free = self.size
+                self._waiters = deque()
+                self._lock = threading.Lock()
+
+        '''
+        _take_slot / _give_slot -- a connection slot, handed to waiting
+                                   logins in the order they asked for one
+                                   (a semaphore lets a releasing thread take
+                                   the slot straight back, which starves
+                                   waiters and shows up as p99 latency)
+        '''
+
+        def _take_slot(self):
+                with self._lock:
+                        if self._free > 0 and not self._waiters:
+                                self._free -= 1
+                                return True
+                        waiter = threading.Event()
+                        self._waiters.append(waiter)
+                if waiter.wait(cons.LDAP_ACQUIRE_TIMEOUT):
+                        return True
+                with self._lock:
+                        if waiter.is_set():
+                                return True
+                        self._waiters.remove(waiter)
+                        return False
+
+        def _give_slot(self):
+                with self._lock:
+                        if self._waiters:
+                                self._waiters.popleft().set()
+                        else:
+                                self._free += 1
+
+        def _connect(self):
+                ldap = _get_ldap()
+                con = ldap.initialize(self.url)
+                con.set_option(ldap.OPT_REFERRALS, 0)
+                con.set_option(ldap.OPT_NETWORK_TIMEOUT,
+                               cons.LDAP_CONNECT_TIMEOUT)
+                con.set_option(ldap.OPT_TIMEOUT, cons.LDAP_OP_TIMEOUT)
+                return con
+
+        def _discard(self, con):
+                try:
+                        con.unbind_s()
+                except:
+                        pass
+
+        def _healthy(self, con, last_used):
+                if time.monotonic() - last_used < cons.LDAP_HEALTH_CHECK_SECS:
+                        return True
+                ldap = _get_ldap()
+                try:
+                        con.whoami_s()
+                        return True
+                except ldap.LDAPError:
+                        return False
+
+        def acquire(self):
+                if not self._take_slot():
+                        raise LDAPUnavailableException('LDAP pool exhausted')
+                ldap = _get_ldap()
+                try:
+                        while True:
+                                with self._lock:
+                                        entry = self._idle.pop() \
+                                            if self._idle else None
+                                if entry is None:
+                                        return self._connect()
+                                con, last_used = entry
+                                if self._healthy(con, last_used):
+                                        return con
+                                self._discard(con)
+                except ldap.LDAPError as e:
+                        self._give_slot()
+                        raise LDAPUnavailableException(str(e))
+                except:
+                        self._give_slot()
+                        raise
+
+        def release(self, con, broken=False):
+                if broken:
+                        self._discard(con)
+                else:
+                        with self._lock:
+                                self._idle.append((con, time.monotonic()))
+                self._give_slot()
+
+        def _discard_idle(self):
+                with self._lock:
+                        idle = list(self._idle)
+                        self._idle.clear()
+                for con, last_used in idle:
+                        self._discard(con)
+
+        def check_credentials(self, dn, password):
+                ldap = _get_ldap()
+                for retry in (True, False):
+                        con = self.acquire()
+                        broken = False
+                        try:
+                                con.simple_bind_s(dn, password)
+                                return True
+                        except ldap.INVALID_CREDENTIALS:
+                                return False
+                        except ldap.SERVER_DOWN as e:
+                                broken = True
+                                if not retry:
+                                        raise LDAPUnavailableException(str(e))
+                        except ldap.LDAPError as e:
+                                broken = True
+                                raise LDAPUnavailableException(str(e))
+                        finally:
+                                self.release(con, broken)
+                        self._discard_idle()
+
+        def stats(self):
+                with self._lock:
+                        idle = len(self._idle)
+                return {'size': self.size, 'idle': idle}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+'''
+get_pool -- the process-wide pool for an LDAP server URL
+'''
+
+
+def get_pool(url):
+        with _pools_lock:
+                if url not in _pools:
+                        _pools[url] = LDAPPool(url)
+                return _pools[url]
@@ -4,9 +4,16 @@ Created by: Adam Plumer
 Date created: Nov 8, 2016
 '''
 
-from flask import Blueprint, session, request
+from flask import Blueprint, request, Response
 from . import file_manager
 from . import auth
+from . import batch
+from . import constants
+from . import context
+from . import gradebook
+from . import paths
+from . import stream
+from .cache import LRUCache
 from .course import Course
 import json
 
@@ -23,7 +30,7 @@ def _get_course():
         c = request.args.get('course')
         a = request.args.get('assign')
         se = request.args.get('semester')
-        st = request.args.get('student') or session['username']
+        st = request.args.get('student') or auth.get_user()
         p = request.args.get('problem')
 
         course = Course(c, se, a, st, p)
@@ -63,8 +70,12 @@ def get_graders():
 @library_page.route('/getGrades', methods=['GET'])
 def get_grades():
         course = _get_course()
-        
-        response = course.get_graders()
+        if course.get_student() != auth.get_user():
+                is_admin, is_grader = auth.get_permissions(course.get_course())
+                if not is_grader:
+                        raise auth.NoAuthException('not a grader')
+
+        response = course.get_grades()
         response['type'] = course.get_type()
 
         return json.dumps(response)
@@ -80,10 +91,45 @@ def get_students():
         return json.dumps(response)
 
 
-def _get_all_pages(course_list, check_published):
+'''
+export_grades -- streams the gradebook of a course as a file download
+                 - format: csv (default) or jsonl
+                 - assign: comma-separated assignments, all by default
+                 - after: resume after this student (the last one received)
+'''
+
+
+@library_page.route('/exportGrades', methods=['GET'])
+def export_grades():
+        course = request.args.get('course')
+        fmt = request.args.get('format') or 'csv'
+        assign = request.args.get('assign')
+        after = request.args.get('after')
+
+        check_args({'course': course})
+        if fmt not in gradebook.FORMATS:
+                raise BadArgsException('unknown format: ' + fmt)
+        if after is not None and not paths.valid_name(after):
+                raise BadArgsException('not a student: ' + after)
+        assignments = set(x for x in assign.split(',') if x != '') \
+            if assign else None
+
+        @auth.admin
+        def export(course=''):
+                chunks = (chunk for student, chunk in
+                          gradebook.export(course, fmt, assignments, after))
+                response = Response(chunks, mimetype=gradebook.FORMATS[fmt])
+                response.headers['Content-Disposition'] = \
+                    'attachment; filename="%s-grades.%s"' % (course, fmt)
+                return stream.exempt(response)
+
+        return export(course=course)
+
+
+def _get_all_pages(course_list, check_published, alists):
         pages = []
         for course in course_list:
-                alist = file_manager.read_alist(course)
+                alist = alists[course]
                 course_obj = {}
                 course_obj['name'] = course
                 if check_published:
@@ -96,10 +142,36 @@ def _get_all_pages(course_list, check_published):
         return pages
 
 
+'''
+_read_alists -- the alists of a set of courses, each read once, concurrently
+                on the batch pool
+                returns ({course: alist}, {course: alist signature})
+'''
+
+
+def _read_alists(courses):
+        alists = {}
+        sigs = {}
+        for course, (sig, alist) in batch.imap_unordered(
+                        file_manager.read_alist_signed, courses):
+                alists[course] = alist
+                sigs[course] = sig
+        return alists, sigs
+
+
+'''
+_user_cache -- assembled _get_user results, keyed by user and permissions
+               and valid while the user's grades directory and every alist
+               they were built from are unchanged
+'''
+
+_user_cache = LRUCache(constants.USER_CACHE_SIZE)
+
+
 '''
 _get_user -- gets the user's Linux login, grading groups, and admin groups
            args: none
-           helper functions: _get_courses and _valid_course
+           helper functions: _get_courses and _read_alists
            returns: four-tuple (remote_user, admin, grading, courses)
            notes:
                  - Here's the general thinking on the virtualgrade permissions
@@ -110,19 +182,38 @@ _get_user -- gets the user's Linux login, grading groups, and admin groups
                                     course for any assignment
                          - Neither: students! they get a list of courses for
                                     which grades are available
+                 - each distinct course's alist is read once, and the result
+                   is cached until the user's grades directory or one of
+                   those alists changes
 '''
 
 
 def _get_user():
         remote_user = auth.get_user()
         admin, grading = auth.get_admin_grading()
+
+        key = (remote_user, tuple(admin), tuple(grading))
+        grades_sig = file_manager.grades_signature(remote_user)
+
+        def current(cached):
+                return cached[0] == grades_sig and \
+                    all(file_manager.alist_signature(course) == sig
+                        for course, sig in cached[1].items())
+
+        cached = _user_cache.get(key, check=current)
+        if cached is not None:
+                return cached[2]
+
         courses = auth._get_courses()
+        alists, sigs = _read_alists(set(courses) | set(admin) | set(grading))
 
-        courses_full = _get_all_pages(courses, True)
-        admin_full = _get_all_pages(admin, False)
-        grading_full = _get_all_pages(grading, False)
+        courses_full = _get_all_pages(courses, True, alists)
+        admin_full = _get_all_pages(admin, False, alists)
+        grading_full = _get_all_pages(grading, False, alists)
 
-        return (remote_user, admin_full, grading_full, courses_full)
+        user = (remote_user, admin_full, grading_full, courses_full)
+        _user_cache.put(key, (grades_sig, sigs, user))
+        return user
 
 
 '''
@@ -143,10 +234,16 @@ def check_args(args):
 get_adetails -- gets the assignment details for a given assignment in a given
                 course
              e.g. ('00', 'hw4') -> {'type' : 'pdf', 'pages' : '6', ...}
+             resolved once per request; shared, so read-only to callers
 '''
 
 
 def get_adetails(course, assignment):
+        return context.lookup(('adetails', course, assignment),
+                              _read_adetails, course, assignment)
+
+
+def _read_adetails(course, assignment):
         page_list = file_manager.read_alist(course)
         return page_list[assignment] if assignment in page_list else {}
 
@@ -0,0 +1,81 @@
+'''
+migrate.py -- copies grading state (completed, inprogress and score
+              documents) from one storage backend to another
+Notes:
+   - Stop the graders (or at least getNextStudent) first: documents written
+     during a migration may or may not make it across
+   - Documents are copied whole and replace what the destination has;
+     running it twice is harmless
+   - Switch over by setting 'state_backend' once it has finished
+
+usage: python -m virtualgrade.migrate <from> <to> [--db <path>]
+                                      [--course <course> ...] [--dry-run]
+       e.g. python -m virtualgrade.migrate json sqlite
+'''
+
+import sys
+import argparse
+from . import storage
+
+
+'''
+migrate -- copies every document from src to dst, returns the number of
+           state and score documents copied
+           - courses: only copy these courses, all of them if None
+'''
+
+
+def migrate(src, dst, courses=None, dry_run=False):
+        num_state = num_scores = 0
+
+        for course, assignment, name, doc in src.iter_state():
+                if courses is not None and course not in courses:
+                        continue
+                if not isinstance(doc, dict):
+                        print('skipping %s/%s/%s: not a JSON object' %
+                              (course, assignment, name), file=sys.stderr)
+                        continue
+                if not dry_run:
+                        dst.put_state(course, assignment, name, doc)
+                num_state += 1
+
+        for user, course, assignment, doc in src.iter_scores():
+                if courses is not None and course not in courses:
+                        continue
+                if not isinstance(doc, dict):
+                        print('skipping score of %s for %s/%s: not a JSON '
+                              'object' % (user, course, assignment),
+                              file=sys.stderr)
+                        continue
+                if not dry_run:
+                        dst.put_score(user, course, assignment, doc)
+                num_scores += 1
+
+        return num_state, num_scores
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+        parser.add_argument('src', choices=['json', 'sqlite'])
+        parser.add_argument('dst', choices=['json', 'sqlite'])
+        parser.add_argument('--db', default=None,
+                            help='SQLite database (default: state_db)')
+        parser.add_argument('--course', action='append', dest='courses',
+                            help='only migrate this course (repeatable)')
+        parser.add_argument('--dry-run', action='store_true')
+        args = parser.parse_args(argv)
+
+        if args.src == args.dst:
+                parser.error('source and destination are the same backend')
+
+        src = storage.open_store(args.src, args.db)
+        dst = storage.open_store(args.dst, args.db)
+        num_state, num_scores = migrate(src, dst, args.courses, args.dry_run)
+        print('%s %d state and %d score documents from %s to %s' %
+              ('would copy' if args.dry_run else 'copied', num_state,
+               num_scores, args.src, args.dst))
+        return 0
+
+
+if __name__ == '__main__':
+        sys.exit(main())
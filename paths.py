@@ -0,0 +1,51 @@
+'''
+paths.py -- central path resolution for the Virtual Grade storage trees
+Notes:
+   - Paths are resolved by joining validated names onto a known root and
+     opening/stat-ing the target directly; a missing component shows up as
+     ENOENT instead of being looked up in an os.listdir of every parent
+   - Names coming from request arguments are never allowed to contain a
+     path separator or to be '.'/'..', so a resolved path can never leave
+     its root (this used to be guaranteed by the listdir membership checks)
+'''
+
+import os
+
+
+'''
+valid_name -- determines whether a request-supplied name can safely be used
+              as a single path component
+'''
+
+
+def valid_name(name):
+        if not isinstance(name, str):
+                return False
+        return name not in ('', '.', '..') and '/' not in name and \
+            '\0' not in name
+
+
+'''
+resolve -- joins a root directory (ending in '/') and a series of names into
+           a single path
+           returns None if any of the names is not a valid path component
+           e.g. ('/r/virtualgrade/grades/', 'aplume01', '15') ->
+                '/r/virtualgrade/grades/aplume01/15'
+'''
+
+
+def resolve(root, *names):
+        for name in names:
+                if not valid_name(name):
+                        return None
+        return root + '/'.join(names)
+
+
+'''
+is_dir -- single stat to determine whether a resolved path is a directory,
+          treating any error (ENOENT, EACCES, ...) as missing
+'''
+
+
+def is_dir(path):
+        return path is not None and os.path.isdir(path)
@@ -26,30 +26,51 @@ to resolve this is in the works...
 
 from . import constants
 from . import file_manager
+from . import fsio
 from . import library
 from . import auth
-from flask import Blueprint, session, request, make_response
+from . import workqueue
+from . import stream
+from . import problem_cache
+from . import prefetch
+from . import progress
+from flask import Blueprint, session, request, make_response, Response
 import json
+from array import array
 
 pdf_page = Blueprint('pdf_page', __name__)
 
 
-def _get_names_by_page(course, assignment, page, com):
-
-        names = file_manager.get_students_for_assignment(course=course, assignment=assignment)
-
-        num_names = len(names)
-        num_names = num_names if num_names != 0 else 1
+'''
+_get_page_progress -- per-page completion from one student list and the
+                      assignment's materialized progress counts
+                      returns (names, num_names, counts, com) where
+                      counts[i] is the number of completed students for
+                      page i+1 and com is the completed document
 
-        '''
         COMPLETED FILE:
                 stores as:
                 { '1' : ['aplume01','molay'], '2' : ['cgregg','hescott'], ... }
-        '''
+'''
 
-        num_com = len(com) if com != [] else 0
 
-        return names, num_names, num_com
+def _get_page_progress(course, assignment):
+        num_pages = int(library.get_adetails(course, assignment)['pages'])
+
+        names = file_manager.get_students_for_assignment(course=course, assignment=assignment)
+        com = file_manager.read_completed(course=course, assignment=assignment)
+        if com == []:
+                com = {}
+        prog = file_manager.read_progress(course=course, assignment=assignment)
+
+        counts = array('I', progress.page_counts(prog, 'com', num_pages))
+
+        return names, len(names), counts, com
+
+
+def _percent(num_com, num_names):
+        num_names = num_names if num_names != 0 else 1
+        return (float(num_com)/num_names)*100
 
 
 def get_grades(user, course, assignment):
@@ -64,40 +85,22 @@ def get_grades(user, course, assignment):
 
 def get_students_for_grading(course, assignment):
         pages = []
-        num_pages = int(library.get_adetails(course, assignment)['pages'])
+        names, num_names, counts, com = _get_page_progress(course, assignment)
 
         response = {}
-        com = file_manager.read_completed(course=course, assignment=assignment)
 
-        for i in range(0, num_pages):
+        for i, num_com in enumerate(counts):
                 page = {}
                 page['num'] = (i+1)  # done this way to prevent zero-indexing
-                names, num_names, num_com = _get_names_by_page(course,
-                                                               assignment,
-                                                               str(i+1),
-                                                               com[str(i+1)])
-                num_done = (float(num_com)/num_names)*100
-                page['progress'] = num_done
+                page['progress'] = _percent(num_com, num_names)
                 page['names'] = names
-                page['com'] = com[str(i+1)]
+                page['com'] = com.get(str(i+1), [])
                 pages.append(page)
 
         response['pages'] = pages
         return response
 
 
-def _find_next_student(course, assignment, problem):
-        names = file_manager.get_students_for_assignment(course=course, assignment=assignment)
-        com = file_manager.read_completed(course=course, assignment=assignment)
-
-        unfinished_names = sorted([x for x in names if x not in com[problem]])
-
-        if len(unfinished_names) > 0:
-                return unfinished_names[0]
-        else:
-                return ''
-
-
 @pdf_page.route('/getProblemForStudent', methods=['GET'])
 def get_problem_for_student():
         response = {}
@@ -127,6 +130,191 @@ def get_problem_for_student():
         return get_prob(course=course)
 
 
+'''
+get_problem_batch -- streams one problem for many students as NDJSON, one
+                     record per student as soon as its file has been read:
+                     { "student" : "aplume01", "svg" : ["<svg>..."] }
+                     - students: comma-separated list, or 'all'
+'''
+
+
+@pdf_page.route('/getProblemBatch', methods=['GET'])
+def get_problem_batch():
+        course = request.args.get('course')
+        assignment = request.args.get('assign')
+        problem = request.args.get('problem')
+        students = request.args.get('students')
+
+        library.check_args({'course': course, 'assignment': assignment,
+                            'problem': problem, 'students': students})
+
+        src_convention = 'p' + problem + '.svg'
+        students = None if students == 'all' else \
+            [x for x in students.split(',') if x != '']
+
+        @auth.grader
+        def get_batch(course=''):
+                results = file_manager.get_problem_batch(course=course, assignment=assignment, students=students,
+                                                         src=src_convention)
+                records = ({'student': student, 'svg': [svg]}
+                           for student, svg in results)
+
+                return Response(stream.ndjson(records),
+                                mimetype='application/x-ndjson')
+
+        return get_batch(course=course)
+
+
+'''
+get_problem_file -- serves a student's problem source as a raw SVG file
+                    - strong ETag from the file's inode/mtime/size, with
+                      If-None-Match answered by 304 from the stat alone,
+                      before the file is read
+                    - pass 'version' to pin a submission; those responses
+                      are immutable and cached by the browser
+                    - served from the problem cache, precompressed if the
+                      browser accepts it, unless the file is too large to
+                      cache
+                    - the file is read on the COMP_PATH pool (see fsio.py),
+                      never in the request thread; one too large to cache
+                      is streamed, PROBLEM_STREAM_CHUNK bytes per read
+                    - the SVG is student content: PROBLEM_CSP and nosniff
+                      keep it from running scripts when opened directly
+'''
+
+
+@pdf_page.route('/getProblemFile', methods=['GET'])
+def get_problem_file():
+        course = request.args.get('course')
+        assignment = request.args.get('assign')
+        student = request.args.get('student')
+        problem = request.args.get('problem')
+        version = request.args.get('version')
+
+        library.check_args({'course': course, 'assignment': assignment,
+                            'student': student, 'problem': problem})
+
+        src_convention = 'p' + problem + '.svg'
+
+        @auth.grader
+        def get_file(course=''):
+                found = file_manager.get_problem_file(course=course, assignment=assignment, student=student,
+                                                      src=src_convention, version=version)
+                if found is None:
+                        return make_response('problem not found', 404)
+
+                path, st = found
+                etag = '%x-%x-%x' % (st.st_ino, st.st_mtime_ns, st.st_size)
+                encoding = None
+                if st.st_size <= constants.PROBLEM_CACHE_MAX_ITEM:
+                        encoding = request.accept_encodings.best_match(
+                            problem_cache.encodings())
+                if request.if_none_match.contains_weak(
+                        _encoded_etag(etag, encoding)):
+                        resp = Response(status=304)
+                        resp.set_etag(_encoded_etag(etag, encoding))
+                else:
+                        try:
+                                resp = _source_response(path, st, etag,
+                                                        encoding)
+                        except OSError:
+                                return make_response('problem not found', 404)
+                        resp.make_conditional(request)
+                if st.st_size <= constants.PROBLEM_CACHE_MAX_ITEM:
+                        resp.vary.add('Accept-Encoding')
+
+                if version is None:
+                        resp.headers['Cache-Control'] = \
+                            constants.PROBLEM_CACHE_CONTROL
+                else:
+                        resp.headers['Cache-Control'] = \
+                            constants.PROBLEM_IMMUTABLE_CACHE_CONTROL
+                resp.headers['X-Submission'] = path.split('/')[-2]
+                resp.headers['Content-Security-Policy'] = constants.PROBLEM_CSP
+                resp.headers['X-Content-Type-Options'] = 'nosniff'
+
+                return stream.exempt(resp)
+
+        return get_file(course=course)
+
+
+'''
+_encoded_etag -- the ETag of a problem file's variant in an encoding
+'''
+
+
+def _encoded_etag(etag, encoding):
+        return etag if encoding is None else etag + '.' + encoding
+
+
+'''
+_source_response -- the response for a problem source: from the problem
+                    cache in the chosen encoding, or, for a file too large
+                    to cache, streamed in chunks read on the COMP_PATH pool
+'''
+
+
+def _source_response(path, st, etag, encoding):
+        blob = fsio.call(path, problem_cache.read, path, st)
+        if blob is None:
+                f = fsio.call(path, open, path, 'rb')
+                resp = Response(_stream_source(path, f),
+                                mimetype='image/svg+xml')
+                resp.set_etag(etag)
+                return resp
+
+        resp = Response(problem_cache.get_variant(blob, encoding),
+                        mimetype='image/svg+xml')
+        if encoding is not None:
+                resp.headers['Content-Encoding'] = encoding
+        resp.set_etag(_encoded_etag(etag, encoding))
+        return resp
+
+
+def _stream_source(path, f):
+        try:
+                while True:
+                        chunk = fsio.call(path, f.read,
+                                          constants.PROBLEM_STREAM_CHUNK)
+                        if not chunk:
+                                return
+                        yield chunk
+        finally:
+                f.close()
+
+
+'''
+_prefetch_upcoming -- warms the problem cache with the claimed student's
+                      problem and those of the next students in the queue;
+                      how many is set per assignment by 'prefetch' in the
+                      alist
+'''
+
+
+def _prefetch_upcoming(course, assignment, problem, student, grader):
+        adetails = library.get_adetails(course, assignment)
+        num = int(adetails.get('prefetch', constants.PREFETCH_DEFAULT))
+        if num <= 0:
+                return
+
+        src_convention = 'p' + problem + '.svg'
+        students = [student] + workqueue.peek(course, assignment, problem, num)
+        upcoming = []
+        for name in students:
+                path = file_manager.get_problem_path(course=course, assignment=assignment, student=name,
+                                                     src=src_convention)
+                if path is not None:
+                        upcoming.append((name, path))
+
+        prefetch.schedule(course, assignment, problem, grader, upcoming)
+
+
+'''
+get_next_student -- hands the requesting grader the next student to grade for
+                    a problem, leased to them through the work queue
+'''
+
+
 @pdf_page.route('/getNextStudent', methods=['GET'])
 def get_next_student():
         course = request.args.get('course')
@@ -138,16 +326,122 @@ def get_next_student():
         library.check_args({'course': course, 'assignment': assignment,
                             'problem': problem})
 
-        next_student = _find_next_student(course, assignment, problem)
+        @auth.grader
+        def next_student(course=''):
+                grader = auth.get_user()
+                student = workqueue.claim(course, assignment, problem, grader)
+                if student != '':
+                        prefetch.claimed(course, assignment, problem, student,
+                                         grader)
+                        _prefetch_upcoming(course, assignment, problem,
+                                           student, grader)
+                return student
+
+        next_student = next_student(course=course)
 
         if next_student == '':
                 response['error'] = 'unable to find next student'
-                return response
+                return json.dumps(response)
 
         score = file_manager.get_score_for_problem(course, assignment,
                                                    next_student, problem)
 
         response['student'] = next_student
         response['score'] = score
+        response['lease'] = constants.LEASE_SECS
 
         return json.dumps(response)
+
+
+def _lease_args():
+        course = request.args.get('course')
+        assignment = request.args.get('assign')
+        problem = request.args.get('problem')
+        student = request.args.get('student')
+
+        library.check_args({'course': course, 'assignment': assignment,
+                            'problem': problem, 'student': student})
+
+        return course, assignment, problem, student
+
+
+'''
+renew_student -- extends the requesting grader's lease on a student
+'''
+
+
+@pdf_page.route('/renewStudent', methods=['POST'])
+def renew_student():
+        course, assignment, problem, student = _lease_args()
+
+        @auth.grader
+        def renew(course=''):
+                return workqueue.renew(course, assignment, problem, student,
+                                       auth.get_user())
+
+        response = {}
+        response['renewed'] = renew(course=course)
+        response['lease'] = constants.LEASE_SECS
+
+        return json.dumps(response)
+
+
+'''
+release_student -- gives the requesting grader's lease on a student back to
+                   the work queue
+'''
+
+
+@pdf_page.route('/releaseStudent', methods=['POST'])
+def release_student():
+        course, assignment, problem, student = _lease_args()
+
+        @auth.grader
+        def release(course=''):
+                return workqueue.release(course, assignment, problem, student,
+                                         auth.get_user())
+
+        response = {}
+        response['released'] = release(course=course)
+
+        return json.dumps(response)
+
+
+'''
+get_progress -- lightweight progress view for dashboards that poll: only
+                per-page completed/in-progress counts and percentages, no
+                name lists; O(pages), read from the progress document,
+                with in-progress counts from the live leases
+                404 if the course has no such assignment
+'''
+
+
+@pdf_page.route('/getProgress', methods=['GET'])
+def get_progress():
+        course = request.args.get('course')
+        assignment = request.args.get('assign')
+
+        library.check_args({'course': course, 'assignment': assignment})
+
+        @auth.grader
+        def get_prog(course=''):
+                adetails = library.get_adetails(course, assignment)
+                if 'pages' not in adetails:
+                        return make_response('assignment not found', 404)
+                num_pages = int(adetails['pages'])
+                num_names = len(file_manager.get_students_for_assignment(
+                    course=course, assignment=assignment))
+                prog = file_manager.read_progress(course=course,
+                                                  assignment=assignment)
+                com = progress.page_counts(prog, 'com', num_pages)
+                inp = progress.lease_counts(
+                    file_manager.read_inprogress(course=course,
+                                                 assignment=assignment),
+                    num_pages)
+                pages = [{'num': i+1, 'com': com[i], 'inp': inp[i],
+                          'progress': _percent(com[i], num_names)}
+                         for i in range(0, num_pages)]
+
+                return json.dumps({'total': num_names, 'pages': pages})
+
+        return get_prog(course=course)
@@ -0,0 +1,81 @@
+'''
+prefetch.py -- background warming of the problem cache ahead of graders
+Notes:
+   - Fetches run on a small, bounded thread pool (PREFETCH_WORKERS) and only
+     ever read through problem_cache (warm, which compresses it as well),
+     so a grader's next problem is served from memory instead of a cold NFS
+     read
+   - Paths are resolved (and permissions checked) in the request thread;
+     the pool threads have no request context and do no auth of their own
+   - Pending fetches are tracked per (course, assignment, problem, student)
+     so that they can be cancelled once the student is claimed by a grader
+     other than the one they were fetched for
+'''
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import constants
+from . import problem_cache
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def _get_executor():
+        global _executor
+        with _executor_lock:
+                if _executor is None:
+                        _executor = ThreadPoolExecutor(
+                            max_workers=constants.PREFETCH_WORKERS,
+                            thread_name_prefix='vg-prefetch')
+                return _executor
+
+
+def _done(key, future):
+        with _pending_lock:
+                if key in _pending and _pending[key][1] is future:
+                        del _pending[key]
+
+
+'''
+schedule -- warms the problem cache for a grader's upcoming students
+            - paths: list of (student, path) pairs, already resolved
+'''
+
+
+def schedule(course, assignment, problem, grader, paths):
+        executor = _get_executor()
+        for student, path in paths:
+                key = (course, assignment, problem, student)
+                with _pending_lock:
+                        if key in _pending:
+                                continue
+                        future = executor.submit(problem_cache.warm, path)
+                        _pending[key] = (grader, future)
+                future.add_done_callback(
+                    lambda f, key=key: _done(key, f))
+
+
+'''
+claimed -- cancels a pending fetch for a student that was just claimed by a
+           grader other than the one it was scheduled for
+           returns True if a fetch was cancelled
+'''
+
+
+def claimed(course, assignment, problem, student, grader):
+        key = (course, assignment, problem, student)
+        with _pending_lock:
+                entry = _pending.get(key)
+                if entry is None or entry[0] == grader:
+                        return False
+        # cancel() runs _done, which removes the entry, in this thread
+        return entry[1].cancel()
+
+
+def pending():
+        with _pending_lock:
+                return len(_pending)
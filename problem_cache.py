@@ -0,0 +1,309 @@
+'''
+problem_cache.py -- content-addressed cache of problem sources (p<N>.svg)
+Notes:
+   - Sources are stored by the sha256 of their contents, so identical files
+     (e.g. blank pages, resubmissions that did not change a page) are kept
+     once
+   - Each source is kept raw, plus a compressed copy per encoding (gzip,
+     and brotli if the brotli package is installed) built the first time
+     a browser asks for that encoding, at a level cheap enough to run in
+     the request (PROBLEM_GZIP_LEVEL, PROBLEM_BROTLI_QUALITY); warm()
+     builds them ahead of time off the request path (see prefetch.py);
+     brotli is only imported when it is first needed
+   - A path -> digest index, validated against the file's inode, mtime and
+     size, means a hit costs a single stat of the source file
+   - Two tiers: memory, bounded by total bytes with LRU eviction, and an
+     optional local-disk directory (PROBLEM_CACHE_DIR) that survives
+     restarts and is shared by all workers on a machine; the directory is
+     kept under PROBLEM_CACHE_DIR_BYTES by removing the least recently used
+     sources
+'''
+
+import os
+import gzip
+import hashlib
+import threading
+from . import constants
+from .cache import LRUCache
+
+_brotli = None
+
+
+def _get_brotli():
+        global _brotli
+        if _brotli is None:
+                try:
+                        import brotli
+                        _brotli = brotli
+                except ImportError:
+                        _brotli = False
+        return _brotli
+
+
+_SUFFIXES = {'gzip': '.gz', 'br': '.br'}
+
+
+'''
+encodings -- the content encodings a source can be served with
+'''
+
+
+def encodings():
+        return ['br', 'gzip'] if _get_brotli() else ['gzip']
+
+
+'''
+Blob -- one cached source; never modified once cached, a new variant makes
+        a new Blob (so the memory tier's byte count stays right)
+        - variants: encoding -> bytes, where the raw bytes are under None
+'''
+
+
+class Blob:
+        def __init__(self, digest, variants):
+                self.digest = digest
+                self.variants = variants
+
+        def raw(self):
+                return self.variants[None]
+
+        def size(self):
+                return sum(map(len, self.variants.values()))
+
+
+def _blob_size(blob):
+        return blob.size()
+
+
+_paths = LRUCache(constants.PROBLEM_INDEX_SIZE)
+_blobs = LRUCache(constants.PROBLEM_INDEX_SIZE,
+                  maxbytes=constants.PROBLEM_CACHE_BYTES, sizeof=_blob_size)
+_counts = {'hits': 0, 'misses': 0, 'disk_hits': 0}
+_counts_lock = threading.Lock()
+
+
+def _count(name):
+        with _counts_lock:
+                _counts[name] += 1
+
+
+def _compress(raw, encoding):
+        if encoding == 'br':
+                return _get_brotli().compress(
+                    raw, quality=constants.PROBLEM_BROTLI_QUALITY)
+        return gzip.compress(raw, constants.PROBLEM_GZIP_LEVEL)
+
+
+'''
+_disk_path -- path of a blob variant in the disk tier, None if there is no
+              disk tier
+'''
+
+
+def _disk_path(digest, encoding=None):
+        if constants.PROBLEM_CACHE_DIR is None:
+                return None
+        return os.path.join(constants.PROBLEM_CACHE_DIR,
+                            digest + _SUFFIXES.get(encoding, ''))
+
+
+def _disk_read(digest):
+        if constants.PROBLEM_CACHE_DIR is None:
+                return None
+        variants = {}
+        try:
+                with open(_disk_path(digest), 'rb') as f:
+                        variants[None] = f.read()
+                        os.utime(f.fileno())
+                for encoding in _SUFFIXES:
+                        try:
+                                with open(_disk_path(digest, encoding),
+                                          'rb') as f:
+                                        variants[encoding] = f.read()
+                        except OSError:
+                                pass
+        except OSError:
+                return None
+        return Blob(digest, variants)
+
+
+def _disk_write(digest, encoding, data):
+        if constants.PROBLEM_CACHE_DIR is None:
+                return
+        try:
+                os.makedirs(constants.PROBLEM_CACHE_DIR, exist_ok=True)
+                path = _disk_path(digest, encoding)
+                tmp = '%s.%d.%d.tmp' % (path, os.getpid(),
+                                        threading.get_ident())
+                with open(tmp, 'wb') as f:
+                        f.write(data)
+                os.replace(tmp, path)
+        except OSError:
+                return
+        _disk_grow(len(data))
+
+
+'''
+_disk_grow -- accounts for bytes written to the disk tier, pruning it once
+              it is over PROBLEM_CACHE_DIR_BYTES; the total is counted
+              from the directory the first time and after every prune, since
+              other workers write to it as well
+_disk_prune -- removes the least recently used sources (by the mtime of
+               their raw file, touched on every disk hit) until the
+               directory is under three quarters of PROBLEM_CACHE_DIR_BYTES
+'''
+
+_disk_bytes = [None]
+_disk_lock = threading.Lock()
+
+
+def _disk_grow(size):
+        with _disk_lock:
+                if _disk_bytes[0] is None:
+                        _disk_bytes[0] = sum(
+                            entry[2] for entry in _disk_entries().values())
+                _disk_bytes[0] += size
+                if _disk_bytes[0] > constants.PROBLEM_CACHE_DIR_BYTES:
+                        _disk_bytes[0] = _disk_prune()
+
+
+def _disk_entries():
+        entries = {}
+        try:
+                found = list(os.scandir(constants.PROBLEM_CACHE_DIR))
+        except OSError:
+                return entries
+        for entry in found:
+                if entry.name.endswith('.tmp'):
+                        continue
+                digest = entry.name.split('.', 1)[0]
+                try:
+                        st = entry.stat()
+                except OSError:
+                        continue
+                names, mtime, size = entries.get(digest, ([], 0, 0))
+                if entry.name == digest:
+                        mtime = st.st_mtime
+                entries[digest] = (names + [entry.name], mtime,
+                                   size + st.st_size)
+        return entries
+
+
+def _disk_prune():
+        entries = _disk_entries()
+        total = sum(entry[2] for entry in entries.values())
+        target = constants.PROBLEM_CACHE_DIR_BYTES * 3 // 4
+        for digest, (names, mtime, size) in sorted(entries.items(),
+                                                   key=lambda x: x[1][1]):
+                if total <= target:
+                        break
+                for name in names:
+                        try:
+                                os.unlink(os.path.join(
+                                    constants.PROBLEM_CACHE_DIR, name))
+                        except OSError:
+                                pass
+                total -= size
+        return total
+
+
+'''
+read -- the cached Blob for a source file, reading it on a miss; returns
+        None if the file cannot be read or is larger than
+        PROBLEM_CACHE_MAX_ITEM
+        - st: the file's stat result, if the caller already has one
+'''
+
+
+def read(path, st=None):
+        try:
+                if st is None:
+                        st = os.stat(path)
+        except OSError:
+                _paths.pop(path)
+                return None
+        if st.st_size > constants.PROBLEM_CACHE_MAX_ITEM:
+                return None
+
+        sig = (st.st_ino, st.st_mtime_ns, st.st_size)
+        entry = _paths.get(path, check=lambda x: x[0] == sig)
+        if entry is not None:
+                blob = _blobs.get(entry[1])
+                if blob is None:
+                        blob = _disk_read(entry[1])
+                        if blob is not None:
+                                _count('disk_hits')
+                                _blobs.put(blob.digest, blob)
+                if blob is not None:
+                        _count('hits')
+                        return blob
+
+        _count('misses')
+
+        try:
+                with open(path, 'rb') as f:
+                        raw = f.read()
+        except OSError:
+                return None
+
+        digest = hashlib.sha256(raw).hexdigest()
+        blob = _blobs.get(digest)
+        if blob is None:
+                blob = _disk_read(digest)
+                if blob is None:
+                        blob = Blob(digest, {None: raw})
+                        _disk_write(digest, None, raw)
+                _blobs.put(digest, blob)
+        _paths.put(path, (sig, digest))
+        return blob
+
+
+'''
+get_variant -- a blob's bytes in an encoding (None for raw), compressing and
+               caching them the first time that encoding is asked for
+'''
+
+
+def get_variant(blob, encoding):
+        data = blob.variants.get(encoding)
+        if data is not None:
+                return data
+        data = _compress(blob.raw(), encoding)
+        variants = dict(blob.variants)
+        variants[encoding] = data
+        _blobs.put(blob.digest, Blob(blob.digest, variants))
+        _disk_write(blob.digest, encoding, data)
+        return data
+
+
+'''
+warm -- reads a source into the cache along with every encoding of it, for
+        callers off the request path
+'''
+
+
+def warm(path):
+        blob = read(path)
+        if blob is not None:
+                for encoding in encodings():
+                        blob = _blobs.get(blob.digest, blob)
+                        get_variant(blob, encoding)
+        return blob
+
+
+'''
+get_stats -- byte sizes and hit rates of both the path index and the blob
+             store
+'''
+
+
+def get_stats():
+        with _counts_lock:
+                stats = dict(_counts)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = float(stats['hits']) / lookups if lookups else 0.0
+        stats['paths'] = _paths.stats()
+        stats['blobs'] = _blobs.stats()
+        stats['brotli'] = bool(_get_brotli())
+        stats['disk_bytes'] = _disk_bytes[0]
+        return stats
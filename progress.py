@@ -0,0 +1,90 @@
+'''
+progress.py -- materialized grading progress per assignment
+Notes:
+   - Counts live in the assignment's PROGRESS FILE, a state document kept
+     by the storage backend (see storage.COUNTED):
+         { 'com' : { '1' : 12, '2' : 9 }, 'inp' : { '1' : 2 },
+           'submissions' : 54 }
+   - com/inp are updated by every write to completed/inprogress, so
+     reading progress costs O(pages) no matter how many students there are
+   - inp also counts leases that have expired but were not reaped yet;
+     lease_counts counts the live ones from the inprogress document, which
+     only holds leases and so stays small
+   - submissions is updated whenever a worker's submission index sees the
+     number of students with a submission change
+   - Documents written before the counts existed are counted on first read
+'''
+
+import time
+from . import constants
+from . import fsio
+from . import storage
+from . import submissions
+
+
+def _read(course, assignment):
+        return storage.get_store().read_state(course, assignment,
+                                              constants.PROGRESS_FILE)
+
+
+def _on_submissions(course, assignment, num_students):
+        doc = fsio.call(constants.ASSIGN_PATH, _read, course, assignment)
+        if isinstance(doc, dict) and doc.get('submissions') != num_students:
+                fsio.check(constants.ASSIGN_PATH)
+                storage.get_store().append_state(course, assignment,
+                                                 constants.PROGRESS_FILE,
+                                                 [['put', 'submissions',
+                                                   None, num_students]])
+
+
+submissions.add_listener(_on_submissions)
+
+
+'''
+get_progress -- the progress document of an assignment, [] if the course or
+                assignment does not exist; shared, so read-only to callers
+                - read on the storage pool; counting an old document writes
+                  it, which is done in the calling thread (see fsio.py)
+'''
+
+
+def get_progress(course, assignment):
+        doc = fsio.call(constants.ASSIGN_PATH, _read, course, assignment)
+        if doc == [] or all(isinstance(doc.get(x), dict)
+                            for x in storage.COUNTED.values()):
+                return doc
+        fsio.check(constants.ASSIGN_PATH)
+        storage.get_store().count_state(course, assignment)
+        return fsio.call(constants.ASSIGN_PATH, _read, course, assignment)
+
+
+'''
+page_counts -- one of the counts of a progress document ('com' or 'inp') for
+               pages 1..num_pages, as a list
+'''
+
+
+def page_counts(doc, field, num_pages):
+        counts = doc.get(field, {}) if isinstance(doc, dict) else {}
+        return [counts.get(str(i+1), 0) for i in range(0, num_pages)]
+
+
+'''
+lease_counts -- the leases of an inprogress document that have not expired,
+                for pages 1..num_pages, as a list
+'''
+
+
+def _live(leases, now):
+        if isinstance(leases, dict):
+                return sum(1 for x in leases.values()
+                           if not isinstance(x, dict) or
+                           x.get('expires', now + 1) > now)
+        return len(leases) if isinstance(leases, list) else 0
+
+
+def lease_counts(doc, num_pages, now=None):
+        if now is None:
+                now = time.time()
+        leases = doc if isinstance(doc, dict) else {}
+        return [_live(leases.get(str(i+1)), now) for i in range(0, num_pages)]
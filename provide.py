@@ -2,102 +2,145 @@
 provide.py -- wrapper for A. Couch Provide system
 Created by: Adam Plumer
 Date created: Dec 6, 2016
+Notes:
+   - Everything here reads COMP_PATH through fsio, with a deadline (see
+     fsio.py)
 '''
 
 
 import os
-from . import constants
+import stat
 from . import auth
+from . import context
+from . import constants
+from . import fsio
+from . import paths
+from . import submissions
+from . import problem_cache
+from . import batch
 
 
-def _check_folder(path, folder):
-        folders = []
-        try:
-                folders = os.listdir(path)
-        except OSError as e:
-                pass
-        except:
-                pass
-
-        return folder in folders
+'''
+_LINE_BREAKS -- translation table deleting every character str.splitlines()
+                splits on, i.e. s.translate(_LINE_BREAKS) is
+                ''.join(s.splitlines()) without the intermediate list
+'''
 
+_LINE_BREAKS = dict.fromkeys(map(ord, '\n\r\x0b\x0c\x1c\x1d\x1e'
+                                      '\x85\u2028\u2029'))
 
-def _high_sub(s):
-        return s.split('.')[1]
 
+'''
+_find_problem -- resolves the path of a file source in a student's
+                 submission, None if it does not exist; the submission
+                 itself is resolved once per request
+'''
 
-def _get_latest(path, student):
-        all_subs = os.listdir(path)
-        student_subs = [x for x in all_subs if x.split('.')[0] == student]
 
-        return max(student_subs, key=_high_sub)
+def _find_problem(course, assignment, student, src, version=None):
+        sub = context.lookup(('submission', course, assignment, student,
+                              version), fsio.call, constants.COMP_PATH,
+                             submissions.get_submission_path, course,
+                             assignment, student, version)
+        if sub is None:
+                return None
+        return paths.resolve(sub, src)
 
 
 '''
-get_problem -- read the file source in the provide directory
+get_problem -- read the file source in the provide directory, through the
+               problem cache
 '''
 
 @auth.grader
 def get_problem(course='', assignment='', student='', src=''):
 
-        full_path = constants.COMP_PATH
-
-        if not _check_folder(full_path, course):
+        full_path = _find_problem(course, assignment, student, src)
+        if full_path is None:
                 return ''
 
-        full_path += course + constants.GRADING_PATH
+        return _read_problem(full_path)
 
-        if not _check_folder(full_path, assignment):
-                return ''
 
-        full_path += assignment
+'''
+get_problem_batch -- reads the same file source for many students
+                     concurrently on the batch pool
+                     - students: list of students, or None for every
+                                 student who submitted
+                     returns a generator of (student, source) pairs in the
+                     order the reads finish
+'''
 
-        latest_sub = _get_latest(full_path, student)
-        if latest_sub == '':
-                return ''
+@auth.grader
+def get_problem_batch(course='', assignment='', students=None, src=''):
+        if students is None:
+                students = submissions.get_students(course, assignment)
 
-        full_path += "/" + latest_sub + "/"
+        def read(student):
+                full_path = _find_problem(course, assignment, student, src)
+                return _read_problem(full_path) if full_path else ''
+
+        return batch.imap_unordered(read, students)
 
-        if not _check_folder(full_path, src):
-                return ''
 
-        full_path += src
+def _read_problem(full_path):
+        return fsio.call(full_path, _read_problem_file, full_path)
 
+
+def _read_problem_file(full_path):
+        blob = problem_cache.read(full_path)
         try:
+                if blob is not None:
+                        return blob.raw().decode().translate(_LINE_BREAKS)
                 with open(full_path, 'r') as f:
-                        return ''.join(f.read().splitlines())
+                        return f.read().translate(_LINE_BREAKS)
         except:
                 return ''
 
 
 '''
-get_students_for_assignment -- gets a list of all students in a provide
-                               directory for a particular course and
-                               assignment
+get_problem_path -- resolves the path of a file source in the provide
+                    directory from the submissions index, without touching
+                    the file itself; None if the student has not submitted
 '''
 
 @auth.grader
-def get_students_for_assignment(course='', assignment=''):
+def get_problem_path(course='', assignment='', student='', src=''):
+        return _find_problem(course, assignment, student, src)
 
-        full_path = constants.COMP_PATH
 
-        if not _check_folder(full_path, course):
-                return []
-
-        full_path += course + constants.GRADING_PATH
+'''
+get_problem_file -- resolves the file source in the provide directory for
+                    raw serving
+                    returns (path, stat) or None if it is not a regular file
+                    - version: a specific submission, defaults to the latest
+'''
 
-        if not _check_folder(full_path, assignment):
-                return []
+@auth.grader
+def get_problem_file(course='', assignment='', student='', src='',
+                     version=None):
 
-        full_path += assignment
+        full_path = _find_problem(course, assignment, student, src, version)
+        if full_path is None:
+                return None
 
-        names = []
         try:
-                names = [name.split('.')[0] for name in os.listdir(full_path)
-                         if os.path.isdir(os.path.join(full_path, name))]
-        except OSError as e:
-                pass
-        except:
-                pass
+                st = fsio.call(full_path, os.stat, full_path)
+        except OSError:
+                return None
+
+        return (full_path, st) if stat.S_ISREG(st.st_mode) else None
 
-        return list(set(names))
+
+'''
+get_students_for_assignment -- gets a list of all students in a provide
+                               directory for a particular course and
+                               assignment
+                               - served from the submissions index, so the
+                                 returned list is shared and read-only
+'''
+
+@auth.grader
+def get_students_for_assignment(course='', assignment=''):
+        return fsio.call(constants.COMP_PATH, submissions.get_students, course,
+                         assignment)
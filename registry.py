@@ -0,0 +1,87 @@
+'''
+registry.py -- registry of grading modules (pdf, scorecard, ...) by type
+Notes:
+   - Built once at startup (see routes.py) from VALID_MODULES; looking a
+     module up afterwards is a dictionary access with no file system or
+     process-wide side effects, so it is safe under threaded servers
+   - Third-party grading types can be added either by calling register()
+     or by installing a package that advertises the module under the
+     'virtualgrade.modules' entry point group, e.g.
+         entry_points={'virtualgrade.modules': ['rubric = vg_rubric']}
+   - A grading module must provide get_students_for_grading(course,
+     assignment), and get_grades(user, course, assignment) if it reports
+     grades; both are called with keyword arguments, so they may be
+     wrapped by @auth.grader/@auth.admin
+'''
+
+import threading
+from importlib import import_module
+from . import constants as cons
+
+
+ENTRY_POINT_GROUP = 'virtualgrade.modules'
+
+_modules = {}
+_loaded = False
+_lock = threading.RLock()
+
+
+'''
+register -- adds (or replaces) the module used for an assignment type
+            e.g. register('rubric', vg_rubric)
+'''
+
+
+def register(atype, module):
+        with _lock:
+                _modules[atype] = module
+
+
+def _entry_points():
+        try:
+                from importlib.metadata import entry_points
+        except ImportError:
+                return []
+        eps = entry_points()
+        if hasattr(eps, 'select'):
+                return eps.select(group=ENTRY_POINT_GROUP)
+        return eps.get(ENTRY_POINT_GROUP, [])
+
+
+'''
+load -- imports and registers every built-in module in VALID_MODULES and
+        every installed plugin; import errors are raised, not hidden
+'''
+
+
+def load():
+        global _loaded
+        with _lock:
+                if _loaded:
+                        return
+                for atype in cons.VALID_MODULES:
+                        if atype not in _modules:
+                                register(atype,
+                                         import_module('.' + atype, __package__))
+                for ep in _entry_points():
+                        if ep.name not in _modules:
+                                register(ep.name, ep.load())
+                _loaded = True
+
+
+'''
+get_module -- the grading module for an assignment type, None if there is no
+              module for it
+'''
+
+
+def get_module(atype):
+        if not _loaded:
+                load()
+        return _modules.get(atype)
+
+
+def get_types():
+        if not _loaded:
+                load()
+        return list(_modules)
@@ -1,22 +1,91 @@
 from flask import Flask, escape, session, request
-import os
+from werkzeug.wsgi import ClosingIterator
 from . import auth
+from . import constants
+from . import fsio
+from . import stream
 from . import library
 from . import pdf
+from . import registry
+from .config import config
 app = Flask(__name__)
 app.register_blueprint(auth.auth_page)
 app.register_blueprint(library.library_page)
 app.register_blueprint(pdf.pdf_page, url_prefix='/pdf')
+registry.load()
 
 @app.errorhandler(auth.NoAuthException)
 def no_auth_handler(error):
         return 'invalid credentials', 401
 
+
+@app.errorhandler(auth.NoUserException)
+def no_user_handler(error):
+        return 'not logged in', 401
+
+
+@app.errorhandler(library.BadArgsException)
+def bad_args_handler(error):
+        return 'bad arguments: ' + str(error.value), 400, \
+            {'Content-Type': 'text/plain; charset=utf-8'}
+
+
+@app.errorhandler(fsio.MountUnavailableException)
+def mount_unavailable_handler(error):
+        return 'storage unavailable: ' + error.value, 503, \
+            {'Retry-After': str(constants.FSIO_BREAKER_RESET_SECS)}
+
+'''
+post_req -- prepends the XSSI prefix to every response body and compresses
+            JSON/SVG bodies when the client accepts it
+            - buffered bodies stay lists of chunks (no copy of the body, and
+              Werkzeug still sets Content-Length)
+            - streamed and send_file bodies are wrapped lazily and are never
+              read into memory here
+            - responses marked with stream.exempt are passed through as-is
+'''
+
+
 @app.after_request
 def post_req(response):
-        d = response.get_data()
-        d = b")]}',\n" + d
-        response.set_data(d)
+        if response.status_code in (204, 304) or request.method == 'HEAD' \
+           or stream.is_exempt(response):
+                return response
+
+        encoding = None
+        if 'Content-Encoding' not in response.headers:
+                encoding = stream.negotiate(request.accept_encodings,
+                                            response.mimetype)
+        if response.mimetype in stream.COMPRESSIBLE:
+                response.vary.add('Accept-Encoding')
+
+        if not response.is_streamed:
+                chunks = list(response.iter_encoded())
+                if encoding is not None and \
+                   sum(map(len, chunks)) >= stream.COMPRESS_MIN_SIZE:
+                        chunks = list(stream.compressed(
+                            stream.prefixed(chunks), encoding))
+                        response.headers['Content-Encoding'] = encoding
+                else:
+                        chunks.insert(0, stream.XSSI_PREFIX)
+                response.response = chunks
+                response.headers.pop('Content-Length', None)
+                return response
+
+        body = response.response
+        chunks = stream.prefixed(response.iter_encoded())
+        length = response.content_length
+        if encoding is not None:
+                chunks = stream.compressed(
+                    chunks, encoding, response.mimetype in stream.SYNC_FLUSH)
+                response.headers['Content-Encoding'] = encoding
+                response.headers.pop('Content-Length', None)
+        elif length is not None:
+                response.content_length = length + len(stream.XSSI_PREFIX)
+
+        callbacks = [body.close] if hasattr(body, 'close') else []
+        response.response = ClosingIterator(chunks, callbacks)
+        response.direct_passthrough = False
         return response
 
 @app.route('/')
@@ -33,4 +102,4 @@ def test():
 if __name__ == '__main__':
         app.run(debug=True)
 
-app.secret_key = os.environ['SECRET_KEY']
+app.secret_key = config.get('secret_key')
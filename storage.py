@@ -0,0 +1,1132 @@
+'''
+storage.py -- storage backends for grading state: the per-assignment state
+              documents (completed, inprogress) and per-student score
+              documents
+Notes:
+   - file_manager goes through get_store() for all grading state; which
+     backend is used is the 'state_backend' setting ('json' by default)
+   - JSONStore is the original layout: one JSON file per document, under
+     ASSIGN_PATH/<course>/<assignment>/ and GRADES_PATH/<user>/<course>/
+     <assignment>/score, with an append-only journal next to each state
+     document so that a write costs O(records), not O(class size)
+   - SQLiteStore keeps the same documents as rows of an indexed SQLite
+     database in WAL mode, keyed by course/assignment/problem/student, so
+     readers never block the writer, an update only touches the rows that
+     changed and scores can be queried across students
+   - WAL is not safe on NFS, so the database lives on a local disk
+     (STATE_DB, or the 'state_db' setting) and opening one on a network
+     file system raises StorageException
+   - Both backends return the same shapes, so modules do not know which
+     one they run on; see migrate.py to move data between them
+'''
+
+import os
+import json
+import fcntl
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from . import constants
+from . import paths
+from . import batch
+from . import grades_index
+from .config import config
+from .cache import LRUCache
+
+
+def _stat_signature(st):
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _read_file(filename):
+        try:
+                with open(filename, 'r') as f:
+                        obj = {}
+                        try:
+                                obj = json.loads(f.read())
+                        except:
+                                pass
+                        return obj
+        except:
+                return {}
+
+
+'''
+_replace_file -- atomically replaces the contents of a file: readers see
+                 either the old or the new contents, never partial ones
+_write_file -- the same, with a JSON object
+'''
+
+
+def _replace_file(filename, data):
+        tmp = '%s.%d.%d.tmp' % (filename, os.getpid(), threading.get_ident())
+        with open(tmp, 'w') as f:
+                f.write(data)
+        os.replace(tmp, filename)
+
+
+def _write_file(filename, obj):
+        _replace_file(filename, json.dumps(obj))
+
+
+def _assign_path(course, assignment):
+        return paths.resolve(constants.ASSIGN_PATH, course, assignment)
+
+
+'''
+_missing -- what reading a document that does not exist returns: [] if the
+            course or assignment does not exist, {} otherwise
+'''
+
+
+def _missing(course, assignment):
+        return {} if paths.is_dir(_assign_path(course, assignment)) else []
+
+
+def _copy(doc):
+        return json.loads(json.dumps(doc))
+
+
+'''
+RECORDS -- small changes to a state document, [op, problem, student, value]
+           - ['put', problem, None, value]: doc[problem] = value
+           - ['del', problem, None, None]: del doc[problem]
+           - ['set', problem, student, value]: doc[problem][student] = value
+           - ['unset', problem, student, None]: del doc[problem][student]
+           - ['add', problem, student, None]: appends student to the list
+             doc[problem] unless it is already there (e.g. completed)
+           - ['remove', problem, student, None]: removes student from the
+             list doc[problem]
+           - problem and student are strings; append_state refuses any
+             other record, and _fold skips records that do not fit the
+             document (e.g. 'set' on a problem holding a list)
+'''
+
+_ABSENT = object()
+_OPS = frozenset(['put', 'del', 'set', 'unset', 'add', 'remove'])
+
+
+def _valid_record(record):
+        if not isinstance(record, (list, tuple)) or len(record) != 4:
+                return False
+        op, problem, student, value = record
+        if op not in _OPS or not isinstance(problem, str):
+                return False
+        return op in ('put', 'del') or isinstance(student, str)
+
+
+def _check_records(records):
+        bad = [x for x in records if not _valid_record(x)]
+        if bad:
+                raise StorageException('invalid state records: %r' % bad[:3])
+
+
+def _entry(doc, problem, kind, copied):
+        value = doc.get(problem)
+        if isinstance(value, kind) and problem in copied:
+                return value
+        value = kind(value) if isinstance(value, kind) else kind()
+        doc[problem] = value
+        copied.add(problem)
+        return value
+
+
+'''
+_fold -- applies records to a document, returning a new one; entries the
+         records do not touch are shared with the original
+         - a record that is malformed or does not fit the type of the
+           entry it changes is skipped, so one bad journal line cannot make
+           the document unreadable
+'''
+
+
+def _fold(doc, records):
+        doc = dict(doc) if isinstance(doc, dict) else {}
+        copied = set()
+        for record in records:
+                if not _valid_record(record):
+                        continue
+                op, problem, student, value = record
+                current = doc.get(problem, _ABSENT)
+                if op == 'put':
+                        doc[problem] = value
+                        copied.discard(problem)
+                elif op == 'del':
+                        doc.pop(problem, None)
+                        copied.discard(problem)
+                elif op == 'set':
+                        if current is _ABSENT or isinstance(current, dict):
+                                _entry(doc, problem, dict,
+                                       copied)[student] = value
+                elif op == 'unset':
+                        if isinstance(current, dict) and student in current:
+                                del _entry(doc, problem, dict, copied)[student]
+                elif op == 'add':
+                        if current is _ABSENT or \
+                           (isinstance(current, list) and
+                            student not in current):
+                                _entry(doc, problem, list,
+                                       copied).append(student)
+                elif op == 'remove':
+                        if isinstance(current, list) and student in current:
+                                _entry(doc, problem, list,
+                                       copied).remove(student)
+        return doc
+
+
+def _is_names(value):
+        return isinstance(value, list) and \
+            all(isinstance(x, str) for x in value) and \
+            len(set(value)) == len(value)
+
+
+'''
+_diff -- the records that turn the document old into new, touching only the
+         entries that changed
+'''
+
+
+def _diff(old, new):
+        records = [['del', p, None, None] for p in old if p not in new]
+        for problem, value in new.items():
+                before = old.get(problem, _ABSENT)
+                if before == value:
+                        continue
+                if isinstance(before, dict) and isinstance(value, dict):
+                        records.extend(['unset', problem, s, None]
+                                       for s in before if s not in value)
+                        records.extend(['set', problem, s, v]
+                                       for s, v in value.items()
+                                       if s not in before or before[s] != v)
+                        continue
+                if _is_names(before) and _is_names(value):
+                        kept, added = set(value), set(before)
+                        if [x for x in before if x in kept] + \
+                                [x for x in value if x not in added] == value:
+                                records.extend(['remove', problem, s, None]
+                                               for s in before
+                                               if s not in kept)
+                                records.extend(['add', problem, s, None]
+                                               for s in value
+                                               if s not in added)
+                                continue
+                records.append(['put', problem, None, value])
+        return records
+
+
+'''
+COUNTED -- state documents whose per-problem sizes are kept in the
+           assignment's PROGRESS_FILE document, which looks like
+           { 'com' : { '1' : 12, '2' : 9 }, 'inp' : { '1' : 2 },
+             'submissions' : 54 }
+           - com/inp are rewritten for the problems a write touches, in
+             the same lock (or transaction) as the write itself
+           - submissions is kept by progress.py from the submission index
+'''
+COUNTED = {constants.COMPLETED_FILE: 'com', constants.INPROGRESS_FILE: 'inp'}
+
+
+def _size(value):
+        return len(value) if isinstance(value, (list, dict)) else 0
+
+
+'''
+_count_records -- the records that bring a progress document up to date
+                  after a write of the named document changed old into new
+                  - problems: the problems the write touched
+                  - if the progress document has no counts for the named
+                    document yet, they are written in full
+'''
+
+
+def _count_records(name, progress, old, new, problems):
+        field = COUNTED.get(name)
+        if field is None:
+                return []
+        if not isinstance(progress, dict) or \
+                not isinstance(progress.get(field), dict):
+                return [['put', field, None,
+                         dict((p, _size(v)) for p, v in new.items())]]
+        return [['set', field, p, _size(new.get(p))] for p in problems
+                if _size(old.get(p)) != _size(new.get(p)) or
+                p not in progress[field]]
+
+
+'''
+Store -- what a backend provides
+         - read_state(course, assignment, name): the named state document
+           of an assignment; [] if the course or assignment does not exist,
+           {} if the document does not; shared, so read-only to callers
+         - update_state(course, assignment, name, update): read-modify-write
+           of a state document, atomic across threads and processes; update
+           is called with the document (a dict) and may modify it in place,
+           its return value is returned; None if the assignment does not
+           exist
+         - append_state(course, assignment, name, records): applies RECORDS
+           to a state document without reading it; False if the assignment
+           does not exist
+         - read_score(user, course, assignment): a student's score document,
+           {} if there is none
+         - read_scores(course, assignment): {student: score document} for
+           every scored student of an assignment
+         - read_user_courses(user): the courses a user has scores in
+         - read_course_users(course): the users with scores in a course, in
+           name order
+         - iter_course_scores(course, assignments=None, after=None): every
+           scored student of a course in name order, as (student,
+           [(assignment, score document), ...]), only for the given
+           assignments if any and only for students after the given one
+         - put_state/put_score: replace a whole document (used by migrate)
+         - count_state(course, assignment): writes the progress document's
+           counts for any COUNTED document it has none for
+         - iter_state()/iter_scores(): every stored document, as
+           (course, assignment, name, doc) and (user, course, assignment,
+           doc); state documents are the STATE_FILES as read_state returns
+           them (with any journal folded in), the progress counts are left
+           out since put_state rebuilds them
+'''
+
+
+class Store:
+        def read_state(self, course, assignment, name):
+                raise NotImplementedError
+
+        def update_state(self, course, assignment, name, update):
+                raise NotImplementedError
+
+        def append_state(self, course, assignment, name, records):
+                _check_records(records)
+
+                def fold(doc):
+                        new = _fold(doc, records)
+                        doc.clear()
+                        doc.update(new)
+                        return True
+
+                return bool(self.update_state(course, assignment, name, fold))
+
+        def count_state(self, course, assignment):
+                for name in COUNTED:
+                        self.update_state(course, assignment, name,
+                                          lambda doc: None)
+
+        def read_score(self, user, course, assignment):
+                raise NotImplementedError
+
+        def read_scores(self, course, assignment):
+                raise NotImplementedError
+
+        def read_user_courses(self, user):
+                raise NotImplementedError
+
+        def read_course_users(self, course):
+                raise NotImplementedError
+
+        def iter_course_scores(self, course, assignments=None, after=None):
+                raise NotImplementedError
+
+        def put_state(self, course, assignment, name, doc):
+                raise NotImplementedError
+
+        def put_score(self, user, course, assignment, doc):
+                raise NotImplementedError
+
+        def iter_state(self):
+                raise NotImplementedError
+
+        def iter_scores(self):
+                raise NotImplementedError
+
+
+STATE_FILES = [constants.COMPLETED_FILE, constants.INPROGRESS_FILE]
+SCORE_FILE = 'score'
+
+
+'''
+JSONStore -- one JSON file per document
+             - a document is a snapshot file (e.g. completed) plus an
+               append-only journal of RECORDS (completed.journal), so a write
+               appends a few lines under the assignment's lock file instead
+               of rewriting the whole document
+             - the journal's first line names the snapshot it applies to
+               (its inode, mtime and size), so a reader racing a compaction
+               notices and rereads under the lock
+             - folded documents are cached with the journal offset they were
+               read up to, so a read costs two stats, plus reading the new
+               records if the journal grew
+             - once a journal passes JOURNAL_COMPACT_BYTES it is folded into
+               a new snapshot in the background, and both files are
+               replaced atomically
+'''
+
+
+class JSONStore(Store):
+        def __init__(self):
+                self._cache = LRUCache(constants.STATE_CACHE_SIZE)
+                self._compacting = set()
+                self._compacting_lock = threading.Lock()
+                self._executor = None
+
+        @contextmanager
+        def _lock(self, assign_path):
+                with open(assign_path + '/' + constants.LOCK_FILE, 'a') as f:
+                        fcntl.flock(f, fcntl.LOCK_EX)
+                        try:
+                                yield
+                        finally:
+                                fcntl.flock(f, fcntl.LOCK_UN)
+
+        def _read_snapshot(self, full_path):
+                try:
+                        with open(full_path, 'r') as f:
+                                sig = _stat_signature(os.fstat(f.fileno()))
+                                try:
+                                        doc = json.loads(f.read())
+                                except ValueError:
+                                        doc = {}
+                except OSError:
+                        return None, None
+                return doc, sig
+
+        '''
+        _read_journal -- (inode, header, records, offset) of the journal from
+                         offset on, header only if reading from the start;
+                         None if there is no journal
+                         - only complete lines are read, offset is where
+                           the next read should start
+        '''
+
+        def _read_journal(self, journal_path, offset):
+                try:
+                        with open(journal_path, 'rb') as f:
+                                ino = os.fstat(f.fileno()).st_ino
+                                f.seek(offset)
+                                data = f.read()
+                except OSError:
+                        return None
+
+                data = data[:data.rfind(b'\n') + 1]
+                header = None
+                records = []
+                for line in data.splitlines():
+                        try:
+                                item = json.loads(line.decode())
+                        except ValueError:
+                                continue
+                        if isinstance(item, dict):
+                                header = item.get('snapshot')
+                        elif isinstance(item, list) and len(item) == 4:
+                                records.append(item)
+                return ino, header, records, offset + len(data)
+
+        '''
+        _load -- the folded document, None if there is neither a snapshot
+                 nor a journal
+                 - locked: the caller holds the assignment lock
+        '''
+
+        def _load(self, full_path, assign_path, locked=False):
+                journal_path = full_path + constants.JOURNAL_SUFFIX
+                try:
+                        snap_sig = _stat_signature(os.stat(full_path))
+                except OSError:
+                        snap_sig = None
+                try:
+                        journal_st = os.stat(journal_path)
+                except OSError:
+                        journal_st = None
+                if snap_sig is None and journal_st is None:
+                        self._cache.pop(full_path)
+                        return None
+
+                ino = journal_st.st_ino if journal_st is not None else None
+                cached = self._cache.get(full_path)
+                if cached is not None and cached[0] == snap_sig and \
+                        cached[1] == ino:
+                        doc, offset = cached[2], cached[3]
+                        if journal_st is None or journal_st.st_size <= offset:
+                                return doc
+                        tail = self._read_journal(journal_path, offset)
+                        if tail is not None and tail[0] == ino:
+                                doc = _fold(doc, tail[2])
+                                self._cache.put(full_path,
+                                                (snap_sig, ino, doc, tail[3]))
+                                return doc
+
+                doc, snap_sig = self._read_snapshot(full_path)
+                journal = self._read_journal(journal_path, 0)
+                if journal is None:
+                        self._cache.put(full_path, (snap_sig, None, doc, 0))
+                        return doc
+
+                ino, header, records, offset = journal
+                if header != (list(snap_sig) if snap_sig else None):
+                        if not locked:
+                                with self._lock(assign_path):
+                                        return self._load(full_path,
+                                                          assign_path,
+                                                          locked=True)
+                        # the snapshot was replaced behind our back; fold
+                        # what we have into it and start a new journal
+                        self._schedule_compaction(full_path, assign_path)
+
+                doc = _fold(doc, records)
+                self._cache.put(full_path, (snap_sig, ino, doc, offset))
+                return doc
+
+        def read_state(self, course, assignment, name):
+                full_path = paths.resolve(constants.ASSIGN_PATH, course,
+                                          assignment, name)
+                if full_path is None:
+                        return []
+
+                doc = self._load(full_path, full_path[:-len(name) - 1])
+                return doc if doc is not None else _missing(course, assignment)
+
+        '''
+        _append -- appends records to a document's journal; the caller holds
+                   the assignment lock
+        '''
+
+        def _append(self, full_path, assign_path, records):
+                if not records:
+                        return
+                journal_path = full_path + constants.JOURNAL_SUFFIX
+                data = ''.join(json.dumps(x) + '\n' for x in records)
+                fd = os.open(journal_path,
+                             os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o666)
+                try:
+                        size = os.fstat(fd).st_size
+                        if size == 0:
+                                try:
+                                        sig = list(_stat_signature(
+                                            os.stat(full_path)))
+                                except OSError:
+                                        sig = None
+                                data = json.dumps({'snapshot': sig}) + \
+                                    '\n' + data
+                        elif os.pread(fd, 1, size - 1) != b'\n':
+                                # a writer died mid-record; keep ours apart
+                                data = '\n' + data
+                        data = data.encode()
+                        while data:
+                                data = data[os.write(fd, data):]
+                        size = os.fstat(fd).st_size
+                finally:
+                        os.close(fd)
+
+                if size > constants.JOURNAL_COMPACT_BYTES:
+                        self._schedule_compaction(full_path, assign_path)
+
+        def _schedule_compaction(self, full_path, assign_path):
+                with self._compacting_lock:
+                        if full_path in self._compacting:
+                                return
+                        self._compacting.add(full_path)
+                        if self._executor is None:
+                                self._executor = ThreadPoolExecutor(
+                                    max_workers=1,
+                                    thread_name_prefix='vg-compact')
+                        self._executor.submit(self._compact, full_path,
+                                              assign_path)
+
+        '''
+        _compact -- folds a document's journal into a new snapshot and starts
+                    an empty journal naming it
+        '''
+
+        def _compact(self, full_path, assign_path):
+                try:
+                        with self._lock(assign_path):
+                                doc = self._load(full_path, assign_path,
+                                                 locked=True)
+                                if doc is not None:
+                                        self._replace(full_path, doc)
+                except OSError:
+                        pass
+                finally:
+                        with self._compacting_lock:
+                                self._compacting.discard(full_path)
+
+        def _replace(self, full_path, doc):
+                _write_file(full_path, doc)
+                sig = list(_stat_signature(os.stat(full_path)))
+                _replace_file(full_path + constants.JOURNAL_SUFFIX,
+                              json.dumps({'snapshot': sig}) + '\n')
+
+        '''
+        _count -- brings the assignment's progress document up to date after
+                  a write; the caller holds the assignment lock
+        '''
+
+        def _count(self, assign_path, name, old, new, problems):
+                if name not in COUNTED:
+                        return
+                full_path = assign_path + '/' + constants.PROGRESS_FILE
+                progress = self._load(full_path, assign_path, locked=True)
+                self._append(full_path, assign_path,
+                             _count_records(name, progress, old, new,
+                                            problems))
+
+        def _load_dict(self, full_path, assign_path):
+                doc = self._load(full_path, assign_path, locked=True)
+                return doc if isinstance(doc, dict) else {}
+
+        def update_state(self, course, assignment, name, update):
+                assign_path = _assign_path(course, assignment)
+                if not paths.is_dir(assign_path) or not paths.valid_name(name):
+                        return None
+
+                full_path = assign_path + '/' + name
+                with self._lock(assign_path):
+                        old = self._load_dict(full_path, assign_path)
+                        doc = _copy(old)
+                        result = update(doc)
+                        records = _diff(old, doc)
+                        self._append(full_path, assign_path, records)
+                        self._count(assign_path, name, old, doc,
+                                    set(x[1] for x in records))
+                return result
+
+        def append_state(self, course, assignment, name, records):
+                _check_records(records)
+                assign_path = _assign_path(course, assignment)
+                if not paths.is_dir(assign_path) or not paths.valid_name(name):
+                        return False
+
+                full_path = assign_path + '/' + name
+                with self._lock(assign_path):
+                        if name in COUNTED:
+                                old = self._load_dict(full_path, assign_path)
+                                self._count(assign_path, name, old,
+                                            _fold(old, records),
+                                            set(x[1] for x in records))
+                        self._append(full_path, assign_path, records)
+                return True
+
+        def put_state(self, course, assignment, name, doc):
+                assign_path = _assign_path(course, assignment)
+                if not paths.is_dir(assign_path) or not paths.valid_name(name):
+                        return None
+
+                full_path = assign_path + '/' + name
+                with self._lock(assign_path):
+                        old = self._load_dict(full_path, assign_path)
+                        self._replace(full_path, doc)
+                        self._count(assign_path, name, old, doc,
+                                    set(old) | set(doc))
+
+        def read_score(self, user, course, assignment):
+                full_path = paths.resolve(constants.GRADES_PATH, user, course,
+                                          assignment, SCORE_FILE)
+                if full_path is None:
+                        return {}
+                return _read_file(full_path)
+
+        def read_scores(self, course, assignment):
+                scores = {}
+                for user in grades_index.get_users(course):
+                        full_path = paths.resolve(constants.GRADES_PATH, user,
+                                                  course, assignment,
+                                                  SCORE_FILE)
+                        if full_path is not None and os.path.isfile(full_path):
+                                scores[user] = _read_file(full_path)
+                return scores
+
+        '''
+        _read_course_scores -- a student's score documents for a course, one
+                               scandir of GRADES_PATH/<user>/<course> plus
+                               one read per scored assignment
+        '''
+
+        def _read_course_scores(self, user, course, assignments):
+                scores = []
+                for assignment in _listdir(constants.GRADES_PATH + user +
+                                           '/' + course):
+                        if assignments is not None and \
+                                assignment not in assignments:
+                                continue
+                        full_path = '%s%s/%s/%s/%s' % (
+                            constants.GRADES_PATH, user, course, assignment,
+                            SCORE_FILE)
+                        if os.path.isfile(full_path):
+                                scores.append((assignment,
+                                               _read_file(full_path)))
+                return scores
+
+        def iter_course_scores(self, course, assignments=None, after=None):
+                if not paths.valid_name(course):
+                        return
+                users = [x for x in grades_index.get_users(course)
+                         if after is None or x > after]
+
+                def read(user):
+                        return self._read_course_scores(user, course,
+                                                        assignments)
+
+                for user, scores in batch.imap(read, users):
+                        if scores:
+                                yield user, scores
+
+        def put_score(self, user, course, assignment, doc):
+                dir_path = paths.resolve(constants.GRADES_PATH, user, course,
+                                         assignment)
+                if dir_path is None:
+                        return
+                os.makedirs(dir_path, exist_ok=True)
+                _write_file(dir_path + '/' + SCORE_FILE, doc)
+                grades_index.update(user)
+
+        def read_user_courses(self, user):
+                return grades_index.get_courses(user)
+
+        def read_course_users(self, course):
+                return grades_index.get_users(course)
+
+
+        def iter_state(self):
+                for course in _listdir(constants.ASSIGN_PATH):
+                        course_path = constants.ASSIGN_PATH + course
+                        for assignment in _listdir(course_path):
+                                assign_path = course_path + '/' + assignment
+                                for name in STATE_FILES:
+                                        doc = self._load(
+                                            assign_path + '/' + name,
+                                            assign_path)
+                                        if doc is not None:
+                                                yield (course, assignment,
+                                                       name, doc)
+
+        def iter_scores(self):
+                for user in _listdir(constants.GRADES_PATH):
+                        user_path = constants.GRADES_PATH + user
+                        for course in _listdir(user_path):
+                                course_path = user_path + '/' + course
+                                for assignment in _listdir(course_path):
+                                        full_path = '%s/%s/%s' % (
+                                            course_path, assignment,
+                                            SCORE_FILE)
+                                        if os.path.isfile(full_path):
+                                                yield (user, course,
+                                                       assignment,
+                                                       _read_file(full_path))
+
+
+'''
+_listdir -- the valid names of the subdirectories of a directory, [] if it
+            cannot be listed
+'''
+
+
+def _listdir(path):
+        try:
+                entries = list(os.scandir(path))
+        except OSError:
+                return []
+        return sorted(x.name for x in entries
+                      if paths.valid_name(x.name) and x.is_dir())
+
+
+'''
+SQLiteStore -- state documents as rows of an SQLite database in WAL mode
+               - state rows: (course, assignment, name, problem, student),
+                 one per top-level key of a document and, within it, per
+                 student; kind records whether the key held a list of names
+                 (completed), a mapping (inprogress) or any other value
+               - versions: bumped by every write to a document, so a cached
+                 document is validated with one indexed lookup
+               - scores: one row per (course, assignment, student, problem)
+               - one connection per thread (and per process, after a fork)
+'''
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS state (
+        course TEXT NOT NULL,
+        assignment TEXT NOT NULL,
+        name TEXT NOT NULL,
+        problem TEXT NOT NULL,
+        student TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        value TEXT,
+        PRIMARY KEY (course, assignment, name, problem, student)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS versions (
+        course TEXT NOT NULL,
+        assignment TEXT NOT NULL,
+        name TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        PRIMARY KEY (course, assignment, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS scores (
+        course TEXT NOT NULL,
+        assignment TEXT NOT NULL,
+        student TEXT NOT NULL,
+        problem TEXT NOT NULL,
+        value TEXT NOT NULL,
+        PRIMARY KEY (course, assignment, student, problem)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS scores_by_problem
+        ON scores (course, assignment, problem);
+CREATE INDEX IF NOT EXISTS scores_by_student
+        ON scores (course, student, assignment);
+CREATE INDEX IF NOT EXISTS scores_by_user
+        ON scores (student, course);
+'''
+
+_LIST, _MAP, _VALUE = 'list', 'map', 'value'
+SCORE_PAGE = 500
+
+'''
+_EMPTY -- student column of the row standing for an empty list or mapping
+          (seq -1), or for a plain value
+'''
+_EMPTY = ''
+
+
+def _to_rows(doc):
+        rows = {}
+        for problem, value in doc.items():
+                problem = str(problem)
+                if isinstance(value, list) and value and \
+                    all(isinstance(x, str) and x for x in value) and \
+                        len(set(value)) == len(value):
+                        for seq, student in enumerate(value):
+                                rows[(problem, student)] = (_LIST, seq, None)
+                elif isinstance(value, dict) and value and \
+                        _EMPTY not in value:
+                        for seq, (student, item) in enumerate(value.items()):
+                                rows[(problem, str(student))] = (
+                                    _MAP, seq, json.dumps(item))
+                elif value == [] or value == {}:
+                        rows[(problem, _EMPTY)] = (
+                            _LIST if value == [] else _MAP, -1, None)
+                else:
+                        rows[(problem, _EMPTY)] = (_VALUE, 0,
+                                                   json.dumps(value))
+        return rows
+
+
+def _from_rows(rows):
+        doc = {}
+        for problem, student, kind, seq, value in rows:
+                if kind == _VALUE:
+                        doc[problem] = json.loads(value)
+                elif kind == _LIST:
+                        names = doc.setdefault(problem, [])
+                        if seq >= 0:
+                                names.append(student)
+                else:
+                        items = doc.setdefault(problem, {})
+                        if seq >= 0:
+                                items[student] = json.loads(value)
+        return doc
+
+
+class StorageException(Exception):
+        def __init__(self, value):
+                self.value = value
+
+        def __str__(self):
+                return repr(self.value)
+
+
+'''
+_fs_type -- the type of the file system a path is on (e.g. 'ext4',
+            'nfs4'), from the longest matching mount point in MOUNTINFO;
+            None if it cannot be told
+'''
+
+MOUNTINFO = '/proc/self/mountinfo'
+
+
+def _unescape(field):
+        return field.encode().decode('unicode_escape')
+
+
+def _fs_type(path):
+        path = os.path.realpath(path)
+        best = None
+        try:
+                with open(MOUNTINFO, 'r') as f:
+                        lines = f.read().splitlines()
+        except OSError:
+                return None
+        for line in lines:
+                fields, sep, rest = line.partition(' - ')
+                fields = fields.split()
+                if not sep or len(fields) < 5 or not rest:
+                        continue
+                mount = _unescape(fields[4])
+                prefix = mount.rstrip('/') + '/'
+                if path != mount and not path.startswith(prefix):
+                        continue
+                if best is None or len(mount) >= len(best[0]):
+                        best = (mount, rest.split()[0])
+        return best[1] if best is not None else None
+
+
+class SQLiteStore(Store):
+        def __init__(self, path):
+                directory = os.path.dirname(os.path.abspath(path))
+                fs_type = _fs_type(directory)
+                if fs_type in constants.NETWORK_FILE_SYSTEMS:
+                        raise StorageException(
+                            '%s is on %s; SQLite in WAL mode needs a local '
+                            'disk, set state_db to a local path' %
+                            (path, fs_type))
+                try:
+                        os.makedirs(directory, exist_ok=True)
+                except OSError:
+                        pass
+                self.path = path
+                self._local = threading.local()
+                self._cache = LRUCache(constants.STATE_CACHE_SIZE)
+                self._schema_lock = threading.Lock()
+                self._schema_ready = False
+
+        def _con(self):
+                con = getattr(self._local, 'con', None)
+                if con is None or self._local.pid != os.getpid():
+                        con = sqlite3.connect(
+                            self.path, isolation_level=None,
+                            timeout=constants.SQLITE_BUSY_TIMEOUT)
+                        con.execute('PRAGMA journal_mode=WAL')
+                        con.execute('PRAGMA synchronous=NORMAL')
+                        with self._schema_lock:
+                                if not self._schema_ready:
+                                        con.executescript(_SCHEMA)
+                                        self._schema_ready = True
+                        self._local.con = con
+                        self._local.pid = os.getpid()
+                return con
+
+        @contextmanager
+        def _transaction(self, write=False):
+                con = self._con()
+                con.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+                try:
+                        yield con
+                except:
+                        con.execute('ROLLBACK')
+                        raise
+                con.execute('COMMIT')
+
+        def _version(self, con, key):
+                row = con.execute('SELECT version FROM versions WHERE '
+                                  'course=? AND assignment=? AND name=?',
+                                  key).fetchone()
+                return row[0] if row is not None else None
+
+        def _rows(self, con, key):
+                return con.execute('SELECT problem, student, kind, seq, value '
+                                   'FROM state WHERE course=? AND '
+                                   'assignment=? AND name=? '
+                                   'ORDER BY problem, seq', key).fetchall()
+
+        def read_state(self, course, assignment, name):
+                if not paths.valid_name(course) or \
+                        not paths.valid_name(assignment):
+                        return []
+
+                key = (course, assignment, name)
+                with self._transaction() as con:
+                        version = self._version(con, key)
+                        if version is None:
+                                self._cache.pop(key)
+                                doc = None
+                        else:
+                                cached = self._cache.get(key)
+                                if cached is not None and \
+                                        cached[0] == version:
+                                        return cached[1]
+                                doc = _from_rows(self._rows(con, key))
+                if doc is None:
+                        return _missing(course, assignment)
+                self._cache.put(key, (version, doc))
+                return doc
+
+        def _write(self, con, key, old, new):
+                old_rows = _to_rows(old)
+                new_rows = _to_rows(new)
+                deleted = [key + x for x in old_rows if x not in new_rows]
+                changed = [key + x + y for x, y in new_rows.items()
+                           if old_rows.get(x) != y]
+                if not deleted and not changed:
+                        return
+                con.executemany('DELETE FROM state WHERE course=? AND '
+                                'assignment=? AND name=? AND problem=? AND '
+                                'student=?', deleted)
+                con.executemany('INSERT OR REPLACE INTO state VALUES '
+                                '(?, ?, ?, ?, ?, ?, ?, ?)', changed)
+                con.execute('INSERT INTO versions VALUES (?, ?, ?, 1) '
+                            'ON CONFLICT (course, assignment, name) '
+                            'DO UPDATE SET version = version + 1', key)
+
+        def update_state(self, course, assignment, name, update):
+                if not paths.is_dir(_assign_path(course, assignment)):
+                        return None
+
+                key = (course, assignment, name)
+                with self._transaction(write=True) as con:
+                        old = _from_rows(self._rows(con, key))
+                        doc = _copy(old)
+                        result = update(doc)
+                        self._write(con, key, old, doc)
+                        self._count(con, key, old, doc,
+                                    set(x[1] for x in _diff(old, doc)))
+                return result
+
+        def put_state(self, course, assignment, name, doc):
+                key = (course, assignment, name)
+                with self._transaction(write=True) as con:
+                        old = _from_rows(self._rows(con, key))
+                        self._write(con, key, old, doc)
+                        self._count(con, key, old, doc, set(old) | set(doc))
+
+        def _count(self, con, key, old, new, problems):
+                course, assignment, name = key
+                if name not in COUNTED:
+                        return
+                progress_key = (course, assignment, constants.PROGRESS_FILE)
+                progress = _from_rows(self._rows(con, progress_key))
+                records = _count_records(name, progress, old, new, problems)
+                if records:
+                        self._write(con, progress_key, progress,
+                                    _fold(progress, records))
+
+        def read_score(self, user, course, assignment):
+                with self._transaction() as con:
+                        rows = con.execute('SELECT problem, value FROM scores '
+                                           'WHERE course=? AND assignment=? '
+                                           'AND student=?',
+                                           (course, assignment, user))
+                        return dict((p, json.loads(v)) for p, v in rows)
+
+        def read_scores(self, course, assignment):
+                scores = {}
+                with self._transaction() as con:
+                        rows = con.execute('SELECT student, problem, value '
+                                           'FROM scores WHERE course=? AND '
+                                           'assignment=?',
+                                           (course, assignment))
+                        for student, problem, value in rows:
+                                scores.setdefault(student, {})[problem] = \
+                                    json.loads(value)
+                return scores
+
+        def read_user_courses(self, user):
+                with self._transaction() as con:
+                        return [x[0] for x in con.execute(
+                            'SELECT DISTINCT course FROM scores WHERE '
+                            'student=? ORDER BY course', (user,))]
+
+        def read_course_users(self, course):
+                with self._transaction() as con:
+                        return [x[0] for x in con.execute(
+                            'SELECT DISTINCT student FROM scores WHERE '
+                            'course=? ORDER BY student', (course,))]
+
+        '''
+        iter_course_scores -- reads SCORE_PAGE students at a time, each page
+                              in its own short read transaction
+        '''
+
+        def iter_course_scores(self, course, assignments=None, after=None):
+                after = after if after is not None else ''
+                while True:
+                        with self._transaction() as con:
+                                users = [x[0] for x in con.execute(
+                                    'SELECT DISTINCT student FROM scores '
+                                    'WHERE course=? AND student>? ORDER BY '
+                                    'student LIMIT ?',
+                                    (course, after, SCORE_PAGE))]
+                                if not users:
+                                        return
+                                rows = con.execute(
+                                    'SELECT student, assignment, problem, '
+                                    'value FROM scores WHERE course=? AND '
+                                    'student BETWEEN ? AND ? ORDER BY '
+                                    'student, assignment',
+                                    (course, users[0],
+                                     users[-1])).fetchall()
+                        page = OrderedDict()
+                        for user, assignment, problem, value in rows:
+                                if assignments is not None and \
+                                        assignment not in assignments:
+                                        continue
+                                docs = page.setdefault(user, OrderedDict())
+                                docs.setdefault(assignment, {})[problem] = \
+                                    json.loads(value)
+                        for user, docs in page.items():
+                                yield user, list(docs.items())
+                        after = users[-1]
+
+        def put_score(self, user, course, assignment, doc):
+                with self._transaction(write=True) as con:
+                        con.execute('DELETE FROM scores WHERE course=? AND '
+                                    'assignment=? AND student=?',
+                                    (course, assignment, user))
+                        con.executemany('INSERT INTO scores VALUES '
+                                        '(?, ?, ?, ?, ?)',
+                                        [(course, assignment, user, str(p),
+                                          json.dumps(v))
+                                         for p, v in doc.items()])
+
+        def iter_state(self):
+                with self._transaction() as con:
+                        keys = con.execute('SELECT course, assignment, name '
+                                           'FROM versions WHERE name IN '
+                                           '(?, ?) ORDER BY course, '
+                                           'assignment, name',
+                                           STATE_FILES).fetchall()
+                for key in keys:
+                        with self._transaction() as con:
+                                doc = _from_rows(self._rows(con, key))
+                        yield key + (doc,)
+
+        def iter_scores(self):
+                with self._transaction() as con:
+                        keys = con.execute('SELECT DISTINCT student, course, '
+                                           'assignment FROM scores ORDER BY '
+                                           'student, course, '
+                                           'assignment').fetchall()
+                for user, course, assignment in keys:
+                        yield (user, course, assignment,
+                               self.read_score(user, course, assignment))
+
+
+'''
+open_store -- a new store for a backend name ('json' or 'sqlite')
+              - path: the SQLite database, 'state_db' (STATE_DB) by default
+'''
+
+
+def open_store(backend, path=None):
+        if backend == 'json':
+                return JSONStore()
+        if backend == 'sqlite':
+                if path is None:
+                        path = config.get('state_db', constants.STATE_DB)
+                return SQLiteStore(path)
+        raise ValueError('unknown storage backend: %s' % backend)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+'''
+get_store -- the process-wide store for the configured 'state_backend'
+'''
+
+
+def get_store():
+        global _store
+        with _store_lock:
+                if _store is None:
+                        _store = open_store(config.get(
+                            'state_backend', constants.STATE_BACKEND))
+                return _store
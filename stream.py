@@ -0,0 +1,100 @@
+'''
+stream.py -- response body wrappers shared by every way of serving the API
+Notes:
+   - Bodies are treated as iterables of byte chunks and wrapped lazily, so
+     streamed and send_file responses are never buffered in memory
+   - All responses carry the XSSI prefix )]}',\n that the AngularJS frontend
+     strips before parsing
+'''
+
+import json
+import zlib
+
+
+XSSI_PREFIX = b")]}',\n"
+
+'''
+COMPRESSIBLE -- mimetypes worth compressing; most of the API still returns
+                json.dumps() strings, which Flask labels text/html
+'''
+COMPRESSIBLE = frozenset(['application/json', 'application/x-ndjson',
+                          'image/svg+xml', 'text/plain', 'text/html'])
+'''
+SYNC_FLUSH -- streamed mimetypes whose chunks are records the client should
+              see as soon as they are produced, so the compressor is flushed
+              after each one
+'''
+SYNC_FLUSH = frozenset(['application/x-ndjson'])
+ENCODINGS = ['gzip', 'deflate']
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+
+
+'''
+exempt -- marks a response that is not part of the JSON API (e.g. a raw
+          problem file) so that it is sent untouched: no XSSI prefix and no
+          on-the-fly compression, which keeps send_file/sendfile zero-copy
+'''
+
+
+def exempt(response):
+        response.xssi_exempt = True
+        return response
+
+
+def is_exempt(response):
+        return getattr(response, 'xssi_exempt', False)
+
+
+'''
+prefixed -- yields the XSSI prefix followed by the body chunks
+'''
+
+
+def prefixed(chunks):
+        yield XSSI_PREFIX
+        for chunk in chunks:
+                yield chunk
+
+
+'''
+ndjson -- encodes records (dicts) as newline-delimited JSON, one chunk per
+          record
+'''
+
+
+def ndjson(records):
+        for record in records:
+                yield (json.dumps(record) + '\n').encode()
+
+
+'''
+compressed -- gzip/deflate-compresses body chunks as they are produced
+              - encoding: 'gzip' or 'deflate' (zlib-wrapped, as HTTP expects)
+              - sync: flush the compressor after every chunk
+'''
+
+
+def compressed(chunks, encoding, sync=False):
+        wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+        comp = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, wbits)
+        for chunk in chunks:
+                data = comp.compress(chunk)
+                if sync:
+                        data += comp.flush(zlib.Z_SYNC_FLUSH)
+                if data:
+                        yield data
+        yield comp.flush()
+
+
+'''
+negotiate -- picks a content encoding from an Accept-Encoding header value
+             (already parsed into werkzeug's accept object) for a response
+             of the given mimetype, None if it should be sent as-is
+'''
+
+
+def negotiate(accept_encodings, mimetype):
+        if mimetype not in COMPRESSIBLE:
+                return None
+        return accept_encodings.best_match(ENCODINGS)
@@ -0,0 +1,385 @@
+'''
+submissions.py -- live, in-process index of provide submission directories
+Notes:
+   - Layout being indexed:
+         /comp/<course>/grading/<assignment>/<student>.<version>/
+   - Each assignment directory is scanned once (one os.scandir pass, no
+     per-entry stat) and kept current by an inotify watch, so lookups are
+     dictionary accesses that never touch the file system
+   - inotify only reports changes made through this machine's kernel; for
+     NFS mounts (and wherever inotify is unavailable) the directory's mtime
+     is re-checked and the directory rescanned when it changes
+   - Everything returned from this module is shared and must be treated as
+     read-only
+'''
+
+import os
+import time
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from . import constants
+from . import fsio
+from . import paths
+
+
+_IN_CLOEXEC = 0o2000000
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+
+_WATCH_MASK = (_IN_CREATE | _IN_DELETE | _IN_MOVED_FROM | _IN_MOVED_TO |
+               _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR)
+_EVENT = struct.Struct('iIII')
+
+
+'''
+_Inotify -- minimal ctypes wrapper around the Linux inotify API
+            - one file descriptor for the whole process, read by a daemon
+              thread that dispatches events to the callback registered for
+              each watch descriptor
+'''
+
+
+class _Inotify:
+        def __init__(self):
+                libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                   use_errno=True)
+                self._add = libc.inotify_add_watch
+                self._rm = libc.inotify_rm_watch
+                self._fd = libc.inotify_init1(_IN_CLOEXEC)
+                if self._fd < 0:
+                        raise OSError(ctypes.get_errno(), 'inotify_init1')
+                self._callbacks = {}
+                self._lock = threading.Lock()
+                self._thread = threading.Thread(target=self._run,
+                                                 name='vg-inotify',
+                                                 daemon=True)
+                self._thread.start()
+
+        def add_watch(self, path, callback):
+                wd = self._add(self._fd, os.fsencode(path), _WATCH_MASK)
+                if wd < 0:
+                        return None
+                with self._lock:
+                        self._callbacks[wd] = callback
+                return wd
+
+        def rm_watch(self, wd):
+                with self._lock:
+                        self._callbacks.pop(wd, None)
+                self._rm(self._fd, wd)
+
+        def _run(self):
+                while True:
+                        try:
+                                buf = os.read(self._fd, 65536)
+                        except InterruptedError:
+                                continue
+                        offset = 0
+                        while offset < len(buf):
+                                wd, mask, cookie, length = \
+                                    _EVENT.unpack_from(buf, offset)
+                                offset += _EVENT.size
+                                name = buf[offset:offset + length]
+                                offset += length
+                                name = os.fsdecode(name.rstrip(b'\0'))
+                                self._dispatch(wd, mask, name)
+
+        def _dispatch(self, wd, mask, name):
+                if mask & _IN_Q_OVERFLOW:
+                        with self._lock:
+                                callbacks = list(self._callbacks.values())
+                        for callback in callbacks:
+                                callback(mask, '')
+                        return
+                with self._lock:
+                        callback = self._callbacks.get(wd)
+                        if mask & _IN_IGNORED:
+                                self._callbacks.pop(wd, None)
+                if callback is not None:
+                        callback(mask, name)
+
+
+_inotify = None
+_inotify_failed = False
+_inotify_lock = threading.Lock()
+
+
+def _get_inotify():
+        global _inotify, _inotify_failed
+        with _inotify_lock:
+                if _inotify is None and not _inotify_failed:
+                        try:
+                                _inotify = _Inotify()
+                        except:
+                                _inotify_failed = True
+                return _inotify
+
+
+'''
+_student -- the student login for a submission directory name
+            e.g. 'aplume01.3' -> 'aplume01'
+'''
+
+
+def _student(name):
+        return name.split('.')[0]
+
+
+'''
+_version -- the version of a submission directory name, as a number; None
+            if the name has none
+            e.g. 'aplume01.3' -> 3, 'aplume01' -> None
+_latest -- the submission directory with the highest version, None if none
+           of them has one
+           e.g. ['aplume01.9', 'aplume01.10'] -> 'aplume01.10'
+'''
+
+
+def _version(name):
+        try:
+                return int(name.split('.')[1])
+        except (IndexError, ValueError):
+                return None
+
+
+def _latest(subs):
+        versions = [(_version(x), x) for x in subs]
+        versions = [x for x in versions if x[0] is not None]
+        return max(versions)[1] if versions else None
+
+
+'''
+_AssignmentIndex -- student -> submission directories for one assignment
+                    - refresh() rescans if inotify reported a problem, or if
+                      the directory's mtime changed since the last scan; the
+                      mtime is only checked every SUBMISSION_RECHECK_SECS
+                      while a watch is active
+'''
+
+
+class _AssignmentIndex:
+        def __init__(self, path):
+                self.path = path
+                self.subs = {}
+                self.names = []
+                self.notified = None
+                self.mtime = None
+                self.checked = 0
+                self.wd = None
+                self.stale = True
+                self.lock = threading.Lock()
+
+        def scan(self):
+                st = os.stat(self.path)
+                subs = {}
+                with os.scandir(self.path) as entries:
+                        for entry in entries:
+                                if entry.is_dir():
+                                        student = _student(entry.name)
+                                        subs.setdefault(student, set()).add(
+                                            entry.name)
+                self.subs = subs
+                self.names = list(subs)
+                self.mtime = st.st_mtime_ns
+                self.checked = time.monotonic()
+                self.stale = False
+
+        def on_event(self, mask, name):
+                with self.lock:
+                        if mask & (_IN_Q_OVERFLOW | _IN_IGNORED |
+                                   _IN_DELETE_SELF | _IN_MOVE_SELF):
+                                self.stale = True
+                                if mask & _IN_IGNORED:
+                                        self.wd = None
+                                return
+                        if not mask & _IN_ISDIR:
+                                return
+                        student = _student(name)
+                        if mask & (_IN_CREATE | _IN_MOVED_TO):
+                                if student not in self.subs:
+                                        self.subs[student] = set()
+                                        self.names = list(self.subs)
+                                self.subs[student].add(name)
+                        elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                                subs = self.subs.get(student)
+                                if subs is None:
+                                        return
+                                subs.discard(name)
+                                if not subs:
+                                        del self.subs[student]
+                                        self.names = list(self.subs)
+
+        def refresh(self):
+                with self.lock:
+                        now = time.monotonic()
+                        if not self.stale:
+                                if self.wd is not None and \
+                                   now - self.checked < \
+                                   constants.SUBMISSION_RECHECK_SECS:
+                                        return
+                                mtime = os.stat(self.path).st_mtime_ns
+                                self.checked = now
+                                if mtime == self.mtime:
+                                        return
+                        elif self.wd is None:
+                                inotify = _get_inotify()
+                                if inotify is not None:
+                                        self.wd = inotify.add_watch(
+                                            self.path, self.on_event)
+                        self.scan()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+_listeners = []
+_log = logging.getLogger(__name__)
+
+
+'''
+add_listener -- calls fn(course, assignment, num_students) whenever the
+                number of students with a submission for an assignment is
+                seen to change, including when its index is first built
+                - listeners run in the request thread that noticed the
+                  change, never in the inotify thread or on an fsio pool
+                  (see fsio.defer)
+                - a listener that raises is logged and does not stop the
+                  others; all of them are called again the next time the
+                  index is used
+'''
+
+
+def add_listener(fn):
+        _listeners.append(fn)
+
+
+def _notify(course, assignment, index):
+        with index.lock:
+                num = len(index.names)
+                if num == index.notified:
+                        return
+        fsio.defer(_call_listeners, course, assignment, index, num)
+
+
+def _call_listeners(course, assignment, index, num):
+        failed = False
+        for fn in _listeners:
+                try:
+                        fn(course, assignment, num)
+                except Exception:
+                        _log.exception('submission listener %r failed for '
+                                       '%s/%s', fn, course, assignment)
+                        failed = True
+        if not failed:
+                # otherwise try again next time instead of dropping it
+                with index.lock:
+                        index.notified = num
+
+
+'''
+_get_index -- gets the up-to-date index for a course's assignment, building
+              it (and its inotify watch) on first use
+              returns None if the assignment directory cannot be read
+'''
+
+
+def _get_index(course, assignment):
+        key = (course, assignment)
+        index = _indexes.get(key)
+        try:
+                if index is not None:
+                        index.refresh()
+                        _notify(course, assignment, index)
+                        return index
+
+                path = paths.resolve(constants.COMP_PATH, course,
+                                     constants.GRADING_PATH.strip('/'),
+                                     assignment)
+                if path is None:
+                        return None
+                with _indexes_lock:
+                        index = _indexes.get(key)
+                        if index is None:
+                                index = _AssignmentIndex(path)
+                                inotify = _get_inotify()
+                                if inotify is not None:
+                                        index.wd = inotify.add_watch(
+                                            path, index.on_event)
+                                with index.lock:
+                                        index.scan()
+                                _indexes[key] = index
+                _notify(course, assignment, index)
+                return index
+        except OSError:
+                with _indexes_lock:
+                        _indexes.pop(key, None)
+                if index is not None and index.wd is not None:
+                        _get_inotify().rm_watch(index.wd)
+                return None
+
+
+'''
+get_students -- all students with at least one submission for an assignment
+                e.g. ('15', 'hw4') -> ['aplume01', 'molay', ...]
+'''
+
+
+def get_students(course, assignment):
+        index = _get_index(course, assignment)
+        return index.names if index is not None else []
+
+
+'''
+get_latest -- the newest submission directory for a student, or '' if the
+              student has not submitted
+              e.g. ('15', 'hw4', 'aplume01') -> 'aplume01.3'
+'''
+
+
+def get_latest(course, assignment, student):
+        index = _get_index(course, assignment)
+        if index is None:
+                return ''
+        with index.lock:
+                subs = index.subs.get(student)
+                if not subs:
+                        return ''
+                return _latest(subs) or ''
+
+
+'''
+get_submission_path -- the absolute path (ending in '/') of a student's
+                       submission directory, or None if there is no such
+                       submission
+                       - version: a specific submission (e.g. '3'); defaults
+                                  to the newest one
+'''
+
+
+def get_submission_path(course, assignment, student, version=None):
+        index = _get_index(course, assignment)
+        if index is None:
+                return None
+        with index.lock:
+                subs = index.subs.get(student)
+                if not subs:
+                        return None
+                if version is None:
+                        sub = _latest(subs)
+                        if sub is None:
+                                return None
+                else:
+                        sub = student + '.' + version
+                        if sub not in subs:
+                                return None
+                return index.path + '/' + sub + '/'
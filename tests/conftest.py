@@ -0,0 +1,160 @@
+'''
+conftest.py -- fixtures shared by the Virtual Grade tests
+Notes:
+   - vg_tree points STORAGE_PATH and COMP_PATH at an empty temporary tree
+     and gives every module with process-wide state (caches, indexes, the
+     store, fsio's mounts) a fresh copy of it, so tests never see the live
+     system or each other
+   - client is a Flask test client logged in (session mode) as GRADER, an
+     admin and grader of COURSE
+   - as_grader runs the test inside a request made by GRADER, for code that
+     calls @auth.grader functions directly
+   - syscalls counts file system calls made by the code under test, from
+     any thread, while its counting() context is active
+'''
+
+import os
+import json
+import builtins
+import contextlib
+import pytest
+from collections import Counter
+
+os.environ.setdefault('SECRET_KEY', 'test')
+
+from .. import fsio
+from .. import storage
+from .. import constants
+from .. import grades_index
+from .. import submissions
+from .. import file_manager
+from ..cache import LRUCache
+
+GRADER = 'g00'
+COURSE = '15'
+
+
+class Tree:
+        def __init__(self, base):
+                self.base = base
+                self.storage = base + '/storage/'
+                self.comp = base + '/comp/'
+
+        def write_json(self, path, doc):
+                full_path = self.storage + path
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                with open(full_path, 'w') as f:
+                        f.write(json.dumps(doc))
+
+        def add_assignment(self, course, assignment, pages=2, atype='pdf'):
+                alist_path = 'assignments/%s/alist' % course
+                full_path = self.storage + alist_path
+                alist = {}
+                if os.path.isfile(full_path):
+                        with open(full_path, 'r') as f:
+                                alist = json.loads(f.read())
+                alist[assignment] = {'type': atype, 'source': 'provide',
+                                     'pages': str(pages), 'publish': True,
+                                     'publish_com': True}
+                self.write_json(alist_path, alist)
+                os.makedirs(self.storage + 'assignments/%s/%s' %
+                            (course, assignment), exist_ok=True)
+
+        def add_score(self, user, course, assignment, doc):
+                self.write_json('grades/%s/%s/%s/score' %
+                                (user, course, assignment), doc)
+
+        def add_submission(self, course, assignment, student, version=1,
+                           pages=2, body='<svg></svg>'):
+                sub = '%s%s/grading/%s/%s.%d/' % (self.comp, course,
+                                                  assignment, student,
+                                                  version)
+                os.makedirs(sub, exist_ok=True)
+                for k in range(1, pages + 1):
+                        with open(sub + 'p%d.svg' % k, 'w') as f:
+                                f.write(body)
+
+
+@pytest.fixture
+def vg_tree(tmp_path, monkeypatch):
+        tree = Tree(str(tmp_path))
+        os.makedirs(tree.storage + 'grades')
+        os.makedirs(tree.storage + 'assignments')
+        os.makedirs(tree.comp)
+        for name, value in (('STORAGE_PATH', tree.storage),
+                            ('GRADES_PATH', tree.storage + 'grades/'),
+                            ('ASSIGN_PATH', tree.storage + 'assignments/'),
+                            ('COMP_PATH', tree.comp)):
+                monkeypatch.setattr(constants, name, value, raising=False)
+        monkeypatch.setattr(storage, '_store', None)
+        monkeypatch.setattr(grades_index, '_index',
+                            grades_index._GradesIndex())
+        monkeypatch.setattr(submissions, '_indexes', {})
+        monkeypatch.setattr(file_manager, '_alist_cache',
+                            LRUCache(constants.ALIST_CACHE_SIZE))
+        monkeypatch.setattr(fsio, '_mounts', None)
+        return tree
+
+
+def make_client(user, admin=(), grading=()):
+        from .. import routes
+        client = routes.app.test_client()
+        with client.session_transaction() as session:
+                session['username'] = user
+                session['admin'] = list(admin)
+                session['grading'] = list(grading)
+        return client
+
+
+@pytest.fixture
+def client(vg_tree):
+        return make_client(GRADER, [COURSE], [COURSE])
+
+
+@pytest.fixture
+def as_grader(vg_tree):
+        from flask import g
+        from .. import routes
+        with routes.app.test_request_context():
+                g.vg_identity = (GRADER, frozenset([COURSE]),
+                                 frozenset([COURSE]))
+                yield
+
+
+def load(response):
+        return json.loads(response.get_data(as_text=True).split('\n', 1)[1])
+
+
+class Syscalls:
+        NAMES = ('stat', 'lstat', 'listdir', 'scandir')
+
+        def __init__(self, monkeypatch):
+                self.counts = Counter()
+                self.active = False
+                for name in self.NAMES:
+                        monkeypatch.setattr(os, name,
+                                            self._wrap(name,
+                                                       getattr(os, name)))
+                monkeypatch.setattr(builtins, 'open',
+                                    self._wrap('open', builtins.open))
+
+        def _wrap(self, name, func):
+                def counted(*args, **kwargs):
+                        if self.active:
+                                self.counts[name] += 1
+                        return func(*args, **kwargs)
+                return counted
+
+        @contextlib.contextmanager
+        def counting(self):
+                self.counts.clear()
+                self.active = True
+                try:
+                        yield self.counts
+                finally:
+                        self.active = False
+
+
+@pytest.fixture
+def syscalls(monkeypatch):
+        return Syscalls(monkeypatch)
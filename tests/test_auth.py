@@ -0,0 +1,184 @@
+import os
+import time
+import threading
+import pytest
+from collections import namedtuple
+from .. import auth
+from .. import constants
+from .. import ldap_pool
+from ..config import config
+from .conftest import load
+
+_Group = namedtuple('_Group', 'gr_name gr_gid gr_mem')
+_User = namedtuple('_User', 'pw_name pw_gid')
+
+
+'''
+_FakeNSS -- grp/pwd/getgrouplist of a directory that cannot be enumerated,
+            like sssd or LDAP with enumerate = false
+'''
+
+
+class _FakeNSS:
+        def __init__(self):
+                self.users = {'alice': 100, 'bob': 101}
+                self.groups = {100: _Group('ta15', 100, []),
+                               101: _Group('users', 101, []),
+                               200: _Group('grade170', 200, ['bob']),
+                               201: _Group('staff', 201, ['alice']),
+                               202: _Group('ta00', 202, ['alice'])}
+                self.member_of = {'alice': [201, 202], 'bob': [200]}
+                self.lookups = 0
+                self.block = None
+
+        def getpwnam(self, name):
+                if name not in self.users:
+                        raise KeyError(name)
+                return _User(name, self.users[name])
+
+        def getgrouplist(self, user, gid):
+                self.lookups += 1
+                if self.block is not None:
+                        self.block.wait()
+                return [gid] + self.member_of.get(user, [])
+
+        def getgrgid(self, gid):
+                if gid not in self.groups:
+                        raise KeyError(gid)
+                return self.groups[gid]
+
+        def getgrnam(self, name):
+                for group in self.groups.values():
+                        if group.gr_name == name:
+                                return group
+                raise KeyError(name)
+
+        def getgrall(self):
+                return []
+
+
+@pytest.fixture
+def nss(monkeypatch):
+        fake = _FakeNSS()
+        monkeypatch.setattr(auth, 'grp', fake)
+        monkeypatch.setattr(auth, 'pwd', fake)
+        monkeypatch.setattr(os, 'getgrouplist', fake.getgrouplist)
+        monkeypatch.setattr(auth, '_groups', auth._GroupIndex())
+        return fake
+
+
+def _wait_refreshed():
+        deadline = time.monotonic() + 5
+        while auth._groups.refreshing and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+
+def test_user_groups_without_enumeration(nss):
+        admin, grading = auth._get_admin_grading('alice')
+        assert sorted(admin) == ['00', '15']
+        assert sorted(grading) == ['00', '15']
+        assert auth._get_admin_grading('bob') == ([], ['170'])
+        assert auth._get_admin_grading('nobody') == ([], [])
+
+
+def test_group_members(nss):
+        assert auth._get_graders('grade170') == ['bob']
+        assert auth._get_graders('grade999') == []
+
+
+def test_lookups_are_cached(nss):
+        auth._get_admin_grading('alice')
+        auth._get_admin_grading('alice')
+        assert nss.lookups == 1
+
+
+def test_stale_entry_is_served_and_refreshed_in_background(nss, monkeypatch):
+        assert auth._get_admin_grading('bob') == ([], ['170'])
+        monkeypatch.setattr(constants, 'GROUP_CACHE_TTL', 0)
+        nss.member_of['bob'] = [200, 202]
+        nss.block = threading.Event()
+
+        start = time.monotonic()
+        assert auth._get_admin_grading('bob') == ([], ['170'])
+        assert time.monotonic() - start < 1
+
+        nss.block.set()
+        _wait_refreshed()
+        admin, grading = auth._get_admin_grading('bob')
+        assert admin == ['00'] and sorted(grading) == ['00', '170']
+
+
+
+def test_group_index_is_bounded(nss, monkeypatch):
+        monkeypatch.setattr(constants, 'GROUP_CACHE_SIZE', 8)
+        monkeypatch.setattr(auth, '_groups', auth._GroupIndex())
+        for i in range(100):
+                assert auth._get_graders('grade%d' % i) == []
+        assert len(auth._groups.entries) == 8
+        assert auth._get_graders('grade170') == ['bob']
+
+class _AcceptAll:
+        def check_credentials(self, dn, password):
+                return True
+
+
+@pytest.fixture
+def token_client(vg_tree, nss, monkeypatch):
+        from .. import routes
+        monkeypatch.setattr(config, '_values', {'auth_mode': 'token',
+                                                'secret_key': 'k' * 32,
+                                                'cookie_secure': 'false'})
+        monkeypatch.setattr(auth, '_token_cache', auth.LRUCache(16))
+        monkeypatch.setattr(ldap_pool, 'get_pool', lambda url: _AcceptAll())
+        client = routes.app.test_client()
+        response = client.post('/login', data={'username': 'bob',
+                                               'password': 'x'})
+        assert response.status_code == 200
+        return client
+
+
+def _cookies(client):
+        return dict((cookie.name, cookie.value)
+                    for cookie in client.cookie_jar)
+
+
+def _with_refresh_token(token):
+        from .. import routes
+        client = routes.app.test_client()
+        client.set_cookie('localhost', auth._REFRESH_COOKIE, token)
+        return client
+
+
+def test_token_mode_course_defaults_to_own_user(vg_tree, token_client):
+        vg_tree.add_assignment('170', 'hw1')
+        response = token_client.get('/getType?course=170&assign=hw1')
+        assert response.status_code == 200
+        assert load(response) == {'type': 'pdf'}
+
+
+def test_refresh_reissues_auth_token(token_client):
+        token = _cookies(token_client)[auth._REFRESH_COOKIE]
+        response = _with_refresh_token(token).post('/refresh')
+        assert response.status_code == 200
+
+
+def test_logout_revokes_refresh_token(vg_tree, token_client):
+        token = _cookies(token_client)[auth._REFRESH_COOKIE]
+        assert token_client.post('/logout').status_code == 200
+        response = _with_refresh_token(token).post('/refresh')
+        assert response.status_code == 401
+        response = _with_refresh_token(token).get('/getUser')
+        assert response.status_code == 401
+
+
+def test_logout_drops_expired_revocations(vg_tree, token_client):
+        directory = vg_tree.storage + constants.TOKEN_REVOKED_DIR
+        os.makedirs(directory)
+        old = directory + '/0'
+        with open(old, 'w'):
+                pass
+        then = time.time() - constants.TOKEN_REFRESH_SECS - 60
+        os.utime(old, (then, then))
+        assert token_client.post('/logout').status_code == 200
+        assert os.listdir(directory) != []
+        assert not os.path.exists(old)
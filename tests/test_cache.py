@@ -0,0 +1,39 @@
+import os
+from .. import file_manager
+from ..cache import LRUCache
+from .conftest import COURSE
+
+
+def test_hits_misses_and_eviction():
+        cache = LRUCache(2)
+        assert cache.get('a') is None
+        cache.put('a', 1)
+        cache.put('b', 2)
+        assert cache.get('a') == 1
+        cache.put('c', 3)
+        assert 'b' not in cache and 'a' in cache
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses'], stats['evictions']) == \
+            (1, 1, 1)
+
+
+def test_failed_check_counts_as_miss():
+        cache = LRUCache(2)
+        cache.put('a', ('sig1', 1))
+        assert cache.get('a', check=lambda x: x[0] == 'sig2') is None
+        assert cache.get('a', check=lambda x: x[0] == 'sig1') == ('sig1', 1)
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses']) == (1, 1)
+
+
+def test_changed_alist_counts_as_miss(vg_tree):
+        vg_tree.add_assignment(COURSE, 'hw1')
+        file_manager.read_alist(COURSE)
+        file_manager.read_alist(COURSE)
+        vg_tree.add_assignment(COURSE, 'hw2')
+        path = vg_tree.storage + 'assignments/%s/alist' % COURSE
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert sorted(file_manager.read_alist(COURSE)) == ['hw1', 'hw2']
+        stats = file_manager._alist_cache.stats()
+        assert (stats['hits'], stats['misses']) == (1, 2)
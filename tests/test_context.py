@@ -0,0 +1,63 @@
+from collections import Counter
+from .. import context
+from .conftest import COURSE
+
+
+def _counted(calls):
+        def compute(*args):
+                calls[args] += 1
+                return 'value of %s' % (args,)
+        return compute
+
+
+def test_lookup_runs_once_per_request(vg_tree):
+        from .. import routes
+        calls = Counter()
+        compute = _counted(calls)
+        with routes.app.test_request_context():
+                for i in range(3):
+                        assert context.lookup(('k', 1), compute, 1) == \
+                            'value of (1,)'
+                context.lookup(('k', 2), compute, 2)
+                assert context.resolved() == [('k', 1), ('k', 2)]
+        assert calls == Counter({(1,): 1, (2,): 1})
+
+
+def test_lookup_does_not_leak_between_requests(vg_tree):
+        from .. import routes
+        calls = Counter()
+        compute = _counted(calls)
+        for i in range(2):
+                with routes.app.test_request_context():
+                        assert context.resolved() == []
+                        context.lookup(('k', 1), compute, 1)
+        assert calls[(1,)] == 2
+
+
+def test_lookup_outside_a_request_is_not_memoized():
+        calls = Counter()
+        compute = _counted(calls)
+        context.lookup(('k', 1), compute, 1)
+        context.lookup(('k', 1), compute, 1)
+        assert calls[(1,)] == 2
+        assert context.resolved() == []
+
+
+def test_route_checks_permissions_once(vg_tree, client, monkeypatch):
+        from .. import auth
+        vg_tree.add_assignment(COURSE, 'hw1')
+        vg_tree.add_submission(COURSE, 'hw1', 's1')
+        checks = Counter()
+        is_grader = auth._is_grader
+
+        def counted(course):
+                checks[course] += 1
+                return is_grader(course)
+
+        monkeypatch.setattr(auth, '_is_grader', counted)
+        for i in range(2):
+                response = client.get('/pdf/getProblemForStudent?course=%s&'
+                                      'assign=hw1&student=s1&problem=1' %
+                                      COURSE)
+                assert response.status_code == 200
+                assert checks[COURSE] == i + 1
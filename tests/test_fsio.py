@@ -0,0 +1,182 @@
+import os
+import time
+import errno
+import builtins
+import threading
+import pytest
+from .. import fsio
+from .. import constants
+from .conftest import COURSE, load
+
+
+'''
+_SlowFS -- makes file system calls on paths under root wait delay seconds,
+           then fail with error if one is set, like a stalled NFS mount;
+           heal() lets every waiting call go on at once
+'''
+
+
+class _SlowFS:
+        WRAPPED = ((os, 'stat'), (os, 'lstat'), (os, 'scandir'),
+                   (os, 'listdir'), (builtins, 'open'))
+
+        def __init__(self, monkeypatch):
+                self.root = None
+                self.delay = 0
+                self.error = None
+                self.released = threading.Event()
+                for mod, name in self.WRAPPED:
+                        monkeypatch.setattr(mod, name,
+                                            self._wrap(getattr(mod, name)))
+
+        def _wrap(self, func):
+                def slow(path, *args, **kwargs):
+                        root = self.root
+                        if root is not None and isinstance(path, str) and \
+                           path.startswith(root):
+                                self.released.wait(self.delay)
+                                if self.error is not None:
+                                        raise OSError(self.error,
+                                                      os.strerror(self.error),
+                                                      path)
+                        return func(path, *args, **kwargs)
+                return slow
+
+        def stall(self, root, delay=10, error=None):
+                self.root = root
+                self.delay = delay
+                self.error = error
+                self.released.clear()
+
+        def heal(self):
+                self.root = None
+                self.released.set()
+
+
+@pytest.fixture
+def slowfs(vg_tree, monkeypatch):
+        monkeypatch.setattr(constants, 'FSIO_DEADLINE_SECS', 0.05)
+        monkeypatch.setattr(constants, 'FSIO_BREAKER_FAILURES', 3)
+        monkeypatch.setattr(constants, 'FSIO_BREAKER_WINDOW_SECS', 30)
+        monkeypatch.setattr(constants, 'FSIO_BREAKER_RESET_SECS', 30)
+        fs = _SlowFS(monkeypatch)
+        yield fs
+        fs.heal()
+
+
+def _stat_comp(tree):
+        return fsio.call(tree.comp, os.stat, tree.comp)
+
+
+def _unavailable(func, *args):
+        start = time.monotonic()
+        with pytest.raises(fsio.MountUnavailableException):
+                func(*args)
+        return time.monotonic() - start
+
+
+def test_deadline(vg_tree, slowfs):
+        slowfs.stall(vg_tree.comp)
+        elapsed = _unavailable(_stat_comp, vg_tree)
+        assert 0.05 <= elapsed < 1
+        assert fsio.get_status()[vg_tree.comp]['failures'] == 1
+
+
+def test_breaker_trips_after_failures(vg_tree, slowfs):
+        slowfs.stall(vg_tree.comp)
+        for i in range(constants.FSIO_BREAKER_FAILURES):
+                assert not fsio.get_status()[vg_tree.comp]['open']
+                _unavailable(_stat_comp, vg_tree)
+        assert fsio.get_status()[vg_tree.comp]['open']
+        assert _unavailable(_stat_comp, vg_tree) < 0.05
+        with pytest.raises(fsio.MountUnavailableException):
+                fsio.check(vg_tree.comp + COURSE)
+
+
+def test_mount_errors_count_and_others_do_not(vg_tree, slowfs):
+        slowfs.stall(vg_tree.comp, 0, errno.ENOENT)
+        for i in range(constants.FSIO_BREAKER_FAILURES):
+                with pytest.raises(FileNotFoundError):
+                        _stat_comp(vg_tree)
+        assert fsio.get_status()[vg_tree.comp]['failures'] == 0
+        slowfs.stall(vg_tree.comp, 0, errno.ESTALE)
+        for i in range(constants.FSIO_BREAKER_FAILURES):
+                with pytest.raises(OSError):
+                        _stat_comp(vg_tree)
+        assert fsio.get_status()[vg_tree.comp]['open']
+
+
+def test_tripped_mount_fails_fast_while_the_other_serves(vg_tree, slowfs,
+                                                         client):
+        vg_tree.add_assignment(COURSE, 'hw1')
+        vg_tree.add_submission(COURSE, 'hw1', 's1')
+        problem = '/pdf/getProblemFile?course=%s&assign=hw1&student=s1&' \
+                  'problem=1' % COURSE
+        vg_tree.add_score('s1', COURSE, 'hw1', {'1': 7})
+        grades = '/getGrades?course=%s&assign=hw1&student=s1' % COURSE
+        assert client.get(grades).status_code == 200
+
+        slowfs.stall(vg_tree.comp)
+        for i in range(constants.FSIO_BREAKER_FAILURES):
+                assert client.get(problem).status_code == 503
+        start = time.monotonic()
+        response = client.get(problem)
+        assert time.monotonic() - start < 0.05
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == \
+            str(constants.FSIO_BREAKER_RESET_SECS)
+
+        response = client.get(grades)
+        assert response.status_code == 200
+        assert load(response)['grades'] == {'1': 7}
+        assert not fsio.get_status()[vg_tree.storage]['open']
+
+
+def test_half_open_probe_recovers(vg_tree, slowfs, monkeypatch):
+        slowfs.stall(vg_tree.comp)
+        for i in range(constants.FSIO_BREAKER_FAILURES):
+                _unavailable(_stat_comp, vg_tree)
+        monkeypatch.setattr(constants, 'FSIO_BREAKER_RESET_SECS', 0.05)
+        time.sleep(0.06)
+
+        # the probe stalls too: the breaker opens again
+        _unavailable(_stat_comp, vg_tree)
+        assert fsio.get_status()[vg_tree.comp]['open']
+        assert _unavailable(_stat_comp, vg_tree) < 0.05
+
+        slowfs.heal()
+        time.sleep(0.06)
+        assert _stat_comp(vg_tree).st_mtime_ns > 0
+        status = fsio.get_status()[vg_tree.comp]
+        assert not status['open'] and status['failures'] == 0
+        assert _stat_comp(vg_tree).st_mtime_ns > 0
+
+
+def test_nested_calls_run_inline_only_on_their_own_mount(vg_tree):
+        def current():
+                return threading.current_thread()
+
+        def nested():
+                return (threading.current_thread(),
+                        fsio.call(vg_tree.comp, current),
+                        fsio.call(vg_tree.storage, current))
+
+        outer, same, other = fsio.call(vg_tree.comp, nested)
+        assert same is outer
+        assert other is not outer
+        assert other is not threading.current_thread()
+
+
+def test_deferred_work_runs_in_the_calling_thread(vg_tree):
+        threads = []
+
+        def record():
+                threads.append(threading.current_thread())
+
+        def read():
+                fsio.defer(record)
+                return threading.current_thread()
+
+        pool_thread = fsio.call(vg_tree.comp, read)
+        assert pool_thread is not threading.current_thread()
+        assert threads == [threading.current_thread()]
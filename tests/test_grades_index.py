@@ -0,0 +1,75 @@
+import shutil
+from .. import storage
+from .. import grades_index
+from .conftest import COURSE
+
+
+def _users(num):
+        return ['s%03d' % i for i in range(num)]
+
+
+def test_user_courses_stats_only_that_user(vg_tree, syscalls):
+        for user in _users(50):
+                vg_tree.add_score(user, COURSE, 'hw1', {'1': 5})
+        vg_tree.add_score('s000', '20', 'hw1', {'1': 5})
+        with syscalls.counting() as counts:
+                assert grades_index.get_courses('s000') == [COURSE, '20']
+        assert counts['scandir'] == 0
+        assert counts['stat'] <= 2
+        assert counts['listdir'] == 1
+        with syscalls.counting() as counts:
+                assert grades_index.get_courses('s000') == [COURSE, '20']
+        assert counts['stat'] == 1
+        assert counts['listdir'] == 0
+
+
+def test_course_users_sees_scores_from_other_processes(vg_tree):
+        vg_tree.add_score('s1', COURSE, 'hw1', {'1': 5})
+        assert grades_index.get_users(COURSE) == ['s1']
+        # written straight to disk, as another worker would
+        vg_tree.add_score('s2', COURSE, 'hw1', {'1': 6})
+        vg_tree.add_score('s1', '20', 'hw1', {'1': 7})
+        assert grades_index.get_users(COURSE) == ['s1', 's2']
+        assert grades_index.get_users('20') == ['s1']
+        scores = dict(storage.get_store().iter_course_scores(COURSE))
+        assert sorted(scores) == ['s1', 's2']
+
+
+def test_export_sees_scores_from_other_processes(vg_tree, client):
+        vg_tree.add_assignment(COURSE, 'hw1')
+        vg_tree.add_score('s1', COURSE, 'hw1', {'1': 5})
+        assert 's1,hw1,1,5' in client.get(
+            '/exportGrades?course=%s' % COURSE).get_data(as_text=True)
+        vg_tree.add_score('s2', COURSE, 'hw1', {'1': 6})
+        body = client.get('/exportGrades?course=%s' %
+                          COURSE).get_data(as_text=True)
+        assert 's1,hw1,1,5' in body
+        assert 's2,hw1,1,6' in body
+
+
+def test_update_before_first_lookup(vg_tree):
+        storage.get_store().put_score('s1', COURSE, 'hw1', {'1': 5})
+        assert grades_index.get_courses('s1') == [COURSE]
+        assert grades_index.get_users(COURSE) == ['s1']
+
+
+def test_removed_user_drops_out(vg_tree):
+        vg_tree.add_score('s1', COURSE, 'hw1', {'1': 5})
+        vg_tree.add_score('s2', COURSE, 'hw1', {'1': 5})
+        assert grades_index.get_users(COURSE) == ['s1', 's2']
+        shutil.rmtree(vg_tree.storage + 'grades/s2')
+        assert grades_index.get_users(COURSE) == ['s1']
+        assert grades_index.get_courses('s2') == []
+
+
+def test_user_courses_from_saved_index(vg_tree, syscalls, monkeypatch):
+        for user in _users(20):
+                vg_tree.add_score(user, COURSE, 'hw1', {'1': 5})
+        grades_index.get_users(COURSE)
+        # a restarted worker loads the saved index instead of listing
+        monkeypatch.setattr(grades_index, '_index',
+                            grades_index._GradesIndex())
+        with syscalls.counting() as counts:
+                assert grades_index.get_courses('s005') == [COURSE]
+        assert counts['listdir'] == 0
+        assert counts['scandir'] == 0
@@ -0,0 +1,153 @@
+import time
+import threading
+import pytest
+from .. import constants
+from .. import ldap_pool
+from ..bench.fakeldap import FakeServer
+
+DN = 'uid=alice,ou=People,dc=eecs,dc=tufts,dc=edu'
+OTHER = 'uid=bob,ou=People,dc=eecs,dc=tufts,dc=edu'
+
+
+@pytest.fixture
+def server(monkeypatch):
+        server = FakeServer({DN: 'secret', OTHER: 'hunter2'})
+        monkeypatch.setattr(ldap_pool, '_ldap', server)
+        monkeypatch.setattr(constants, 'LDAP_ACQUIRE_TIMEOUT', 0.2)
+        return server
+
+
+def test_bind(server):
+        pool = ldap_pool.LDAPPool('ldap://fake', size=2)
+        assert pool.check_credentials(DN, 'secret')
+        assert not pool.check_credentials(DN, 'wrong')
+        assert not pool.check_credentials('uid=nobody', 'secret')
+
+
+def test_connections_are_reused(server):
+        pool = ldap_pool.LDAPPool('ldap://fake', size=2)
+        for i in range(10):
+                assert pool.check_credentials(DN, 'secret')
+        assert server.connects == 1
+        assert pool.stats() == {'size': 2, 'idle': 1}
+
+
+def test_options_are_set(server):
+        pool = ldap_pool.LDAPPool('ldap://fake', size=1)
+        con = pool.acquire()
+        assert con.options[server.OPT_NETWORK_TIMEOUT] == \
+            constants.LDAP_CONNECT_TIMEOUT
+        assert con.options[server.OPT_TIMEOUT] == constants.LDAP_OP_TIMEOUT
+        pool.release(con)
+
+
+def test_pool_exhaustion(server):
+        pool = ldap_pool.LDAPPool('ldap://fake', size=2)
+        held = [pool.acquire(), pool.acquire()]
+        start = time.monotonic()
+        with pytest.raises(ldap_pool.LDAPUnavailableException):
+                pool.check_credentials(DN, 'secret')
+        assert time.monotonic() - start < 2
+        pool.release(held.pop())
+        assert pool.check_credentials(DN, 'secret')
+        pool.release(held.pop())
+
+
+def test_pool_bounds_concurrent_binds(server):
+        server.latency = 0.01
+        pool = ldap_pool.LDAPPool('ldap://fake', size=3)
+        results = []
+
+        def login():
+                results.append(pool.check_credentials(DN, 'secret'))
+
+        threads = [threading.Thread(target=login) for i in range(12)]
+        for thread in threads:
+                thread.start()
+        for thread in threads:
+                thread.join()
+        assert results == [True] * 12
+        assert server.peak <= 3
+        assert server.connects <= 3
+
+
+def test_reconnect_after_server_drop(server):
+        pool = ldap_pool.LDAPPool('ldap://fake', size=2)
+        held = [pool.acquire(), pool.acquire()]
+        pool.release(held[0])
+        pool.release(held[1])
+        assert pool.check_credentials(DN, 'secret')
+        connects = server.connects
+
+        server.drop()
+        assert pool.check_credentials(DN, 'secret')
+        assert server.connects == connects + 1
+        assert pool.stats()['idle'] == 1
+
+
+def test_server_down(server):
+        pool = ldap_pool.LDAPPool('ldap://fake', size=2)
+        assert pool.check_credentials(DN, 'secret')
+        server.down = True
+        server.drop()
+        with pytest.raises(ldap_pool.LDAPUnavailableException):
+                pool.check_credentials(DN, 'secret')
+        assert pool.stats()['idle'] == 0
+
+        server.down = False
+        assert pool.check_credentials(DN, 'secret')
+
+
+def test_rebind_after_failed_bind(server):
+        pool = ldap_pool.LDAPPool('ldap://fake', size=1)
+        assert not pool.check_credentials(DN, 'wrong')
+        assert pool.check_credentials(OTHER, 'hunter2')
+        assert server.connects == 1
+
+
+def test_rebind_failure_discards_connection(server):
+        pool = ldap_pool.LDAPPool('ldap://fake', size=1)
+        assert pool.check_credentials(DN, 'secret')
+        server.fail_binds = 1
+        with pytest.raises(ldap_pool.LDAPUnavailableException):
+                pool.check_credentials(OTHER, 'hunter2')
+        assert server.unbinds == 1
+        assert pool.stats()['idle'] == 0
+
+        assert pool.check_credentials(OTHER, 'hunter2')
+        assert server.connects == 2
+
+
+def test_stale_idle_connection_is_health_checked(server, monkeypatch):
+        monkeypatch.setattr(constants, 'LDAP_HEALTH_CHECK_SECS', 0)
+        pool = ldap_pool.LDAPPool('ldap://fake', size=1)
+        assert pool.check_credentials(DN, 'secret')
+        server.drop()
+        con = pool.acquire()
+        assert server.unbinds == 1
+        pool.release(con)
+        assert pool.check_credentials(DN, 'secret')
+        assert server.connects == 2
+
+
+def test_waiting_logins_are_served_in_order(server):
+        pool = ldap_pool.LDAPPool('ldap://fake', size=1)
+        held = pool.acquire()
+        order = []
+
+        def login(name):
+                con = pool.acquire()
+                order.append(name)
+                pool.release(con)
+
+        threads = []
+        for name in ('first', 'second', 'third'):
+                thread = threading.Thread(target=login, args=(name,))
+                thread.start()
+                threads.append(thread)
+                while len(pool._waiters) < len(threads):
+                        time.sleep(0.001)
+        pool.release(held)
+        for thread in threads:
+                thread.join()
+        assert order == ['first', 'second', 'third']
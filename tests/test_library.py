@@ -0,0 +1,103 @@
+import os
+import pytest
+from .conftest import COURSE, load, make_client
+
+
+def test_get_students_scorecard(vg_tree, client):
+        vg_tree.add_assignment(COURSE, 'lab1', atype='scorecard')
+        vg_tree.add_submission(COURSE, 'lab1', 's1')
+        response = client.get('/getStudents?course=%s&assign=lab1' % COURSE)
+        assert response.status_code == 200
+        doc = load(response)
+        assert doc['type'] == 'scorecard'
+        assert doc['names'] == ['s1']
+
+
+def test_get_students_pdf(vg_tree, client):
+        vg_tree.add_assignment(COURSE, 'hw1', pages=2)
+        vg_tree.add_submission(COURSE, 'hw1', 's1')
+        response = client.get('/getStudents?course=%s&assign=hw1' % COURSE)
+        assert response.status_code == 200
+        doc = load(response)
+        assert doc['type'] == 'pdf'
+        assert len(doc['pages']) == 2
+
+
+def test_get_own_grades(vg_tree):
+        vg_tree.add_assignment(COURSE, 'hw1')
+        vg_tree.add_score('s1', COURSE, 'hw1', {'1': 7})
+        client = make_client('s1')
+        response = client.get('/getGrades?course=%s&assign=hw1' % COURSE)
+        assert response.status_code == 200
+        doc = load(response)
+        assert doc['grades'] == {'1': 7}
+        assert doc['type'] == 'pdf'
+
+
+def test_get_grades_of_another_student(vg_tree, client):
+        vg_tree.add_assignment(COURSE, 'hw1')
+        vg_tree.add_score('s1', COURSE, 'hw1', {'1': 7})
+        response = client.get('/getGrades?course=%s&assign=hw1&student=s1' %
+                              COURSE)
+        assert response.status_code == 200
+        assert load(response)['grades'] == {'1': 7}
+
+        response = make_client('s2').get(
+            '/getGrades?course=%s&assign=hw1&student=s1' % COURSE)
+        assert response.status_code == 401
+
+
+def test_export_grades(vg_tree, client):
+        vg_tree.add_assignment(COURSE, 'hw1')
+        vg_tree.add_score('s1', COURSE, 'hw1', {'1': 7})
+        vg_tree.add_score('s2', COURSE, 'hw1', {'1': 5})
+        response = client.get('/exportGrades?course=%s&after=s1' % COURSE)
+        assert response.status_code == 200
+        assert 's2,hw1,1,5' in response.get_data(as_text=True)
+        assert 's1,' not in response.get_data(as_text=True)
+
+
+@pytest.mark.parametrize('query', ['format=xml', 'after=..',
+                                   'after=a/b', 'format=<b>x</b>'])
+def test_export_grades_bad_args(vg_tree, client, query):
+        response = client.get('/exportGrades?course=%s&%s' % (COURSE, query))
+        assert response.status_code == 400
+        assert response.mimetype == 'text/plain'
+
+
+def test_missing_args(vg_tree, client):
+        response = client.get('/pdf/getProgress?course=%s' % COURSE)
+        assert response.status_code == 400
+
+
+def test_get_grades_module_without_grades(vg_tree):
+        vg_tree.add_assignment(COURSE, 'lab1', atype='scorecard')
+        vg_tree.add_score('s1', COURSE, 'lab1', {'1': 7})
+        response = make_client('s1').get('/getGrades?course=%s&assign=lab1' %
+                                         COURSE)
+        assert response.status_code == 200
+        assert load(response) == {'type': 'scorecard'}
+
+
+def _touch(path):
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def test_get_user_sees_alist_and_course_changes(vg_tree):
+        vg_tree.add_assignment(COURSE, 'hw1')
+        vg_tree.add_score('s1', COURSE, 'hw1', {'1': 7})
+        client = make_client('s1')
+        assert load(client.get('/getUser'))['courses'] == \
+            [{'name': COURSE, 'assigns': ['hw1']}]
+        assert load(client.get('/getUser'))['courses'] == \
+            [{'name': COURSE, 'assigns': ['hw1']}]
+
+        vg_tree.add_assignment(COURSE, 'hw2')
+        _touch(vg_tree.storage + 'assignments/%s/alist' % COURSE)
+        vg_tree.add_assignment('16', 'lab1')
+        vg_tree.add_score('s1', '16', 'lab1', {'1': 3})
+        _touch(vg_tree.storage + 'grades/s1')
+        courses = load(client.get('/getUser'))['courses']
+        assert sorted((x['name'], sorted(x['assigns'])) for x in courses) == \
+            [(COURSE, ['hw1', 'hw2']), ('16', ['lab1'])]
@@ -0,0 +1,90 @@
+import os
+import pytest
+from .. import paths
+from .. import storage
+from .. import file_manager
+
+
+@pytest.mark.parametrize('name', ['', '.', '..', 'a/b', '/', '../x',
+                                  'x\0y', None, 3])
+def test_valid_name_rejects(name):
+        assert not paths.valid_name(name)
+
+
+@pytest.mark.parametrize('name', ['15', 'hw1', 'aplume01', '.hidden',
+                                  '..x', 'a.b'])
+def test_valid_name_accepts(name):
+        assert paths.valid_name(name)
+
+
+def test_resolve_joins_valid_names():
+        assert paths.resolve('/r/grades/', 'aplume01', '15') == \
+            '/r/grades/aplume01/15'
+
+
+@pytest.mark.parametrize('names', [('..',), ('15', '..', '..'),
+                                   ('../../etc',), ('15', ''),
+                                   ('/etc',), ('15', 'a\0')])
+def test_resolve_stays_inside_root(names):
+        assert paths.resolve('/r/grades/', *names) is None
+
+
+def test_is_dir(tmp_path):
+        root = str(tmp_path) + '/'
+        os.makedirs(root + 'inside')
+        assert paths.is_dir(paths.resolve(root, 'inside'))
+        assert not paths.is_dir(paths.resolve(root, 'missing'))
+        assert not paths.is_dir(paths.resolve(root, '..'))
+        assert not paths.is_dir(None)
+
+
+def _add_users(tree, num):
+        for i in range(num):
+                tree.add_score('s%05d' % i, '15', 'hw1', {'1': i})
+
+
+@pytest.mark.parametrize('users', [10, 200])
+def test_read_score_is_constant_in_directory_size(vg_tree, syscalls, users):
+        _add_users(vg_tree, users)
+        with syscalls.counting() as counts:
+                assert file_manager.read_score('s00003', '15', 'hw1') == \
+                    {'1': 3}
+        assert counts['listdir'] == 0 and counts['scandir'] == 0
+        assert counts['open'] == 1
+        assert counts['stat'] <= 1
+
+
+def test_read_score_missing(vg_tree, syscalls):
+        _add_users(vg_tree, 10)
+        with syscalls.counting() as counts:
+                assert file_manager.read_score('nobody', '15', 'hw1') == {}
+                assert file_manager.read_score('s00001', '16', 'hw1') == {}
+                assert file_manager.read_score('..', '15', 'hw1') == {}
+        assert counts['listdir'] == 0 and counts['scandir'] == 0
+        assert counts['open'] == 2
+
+
+@pytest.mark.parametrize('assignments', [2, 100])
+def test_read_state_is_constant_in_directory_size(vg_tree, syscalls,
+                                                  assignments):
+        for i in range(assignments):
+                vg_tree.add_assignment('15', 'hw%d' % i)
+        vg_tree.write_json('assignments/15/hw1/completed', {'1': ['s1']})
+        store = storage.get_store()
+        with syscalls.counting() as counts:
+                assert store.read_state('15', 'hw1', 'completed') == \
+                    {'1': ['s1']}
+        assert counts['listdir'] == 0 and counts['scandir'] == 0
+        assert counts['open'] <= 2
+        assert counts['stat'] <= 3
+
+
+def test_read_state_missing_contracts(vg_tree, syscalls):
+        vg_tree.add_assignment('15', 'hw1')
+        store = storage.get_store()
+        with syscalls.counting() as counts:
+                assert store.read_state('15', 'hw1', 'completed') == {}
+                assert store.read_state('15', 'hw9', 'completed') == []
+                assert store.read_state('99', 'hw1', 'inprogress') == []
+                assert store.read_state('..', 'hw1', 'completed') == []
+        assert counts['listdir'] == 0 and counts['scandir'] == 0
@@ -0,0 +1,158 @@
+import os
+import json
+import builtins
+import threading
+import pytest
+from .. import constants
+from .. import problem_cache
+from ..cache import LRUCache
+from .conftest import COURSE, load
+
+
+def test_get_progress(vg_tree, client):
+        vg_tree.add_assignment(COURSE, 'hw1', pages=2)
+        vg_tree.add_submission(COURSE, 'hw1', 's1')
+        response = client.get('/pdf/getProgress?course=%s&assign=hw1' %
+                              COURSE)
+        assert response.status_code == 200
+        doc = load(response)
+        assert doc['total'] == 1
+        assert [page['num'] for page in doc['pages']] == [1, 2]
+
+
+def test_get_progress_unknown_assignment(vg_tree, client):
+        vg_tree.add_assignment(COURSE, 'hw1')
+        response = client.get('/pdf/getProgress?course=%s&assign=hw9' %
+                              COURSE)
+        assert response.status_code == 404
+
+
+def test_get_progress_unknown_course(vg_tree, client):
+        response = client.get('/pdf/getProgress?course=%s&assign=hw1' %
+                              COURSE)
+        assert response.status_code == 404
+
+
+_EVIL = '<svg xmlns="http://www.w3.org/2000/svg"><script>alert(1)</script>' \
+    '</svg>'
+
+
+def _get_file(client):
+        return client.get('/pdf/getProblemFile?course=%s&assign=hw1&'
+                          'student=s1&problem=1' % COURSE)
+
+
+def _check_sandboxed(response):
+        assert response.status_code == 200
+        assert response.mimetype == 'image/svg+xml'
+        csp = response.headers['Content-Security-Policy']
+        assert 'sandbox' in csp and "default-src 'none'" in csp
+        assert response.headers['X-Content-Type-Options'] == 'nosniff'
+
+
+def test_problem_file_is_sandboxed(vg_tree, client):
+        vg_tree.add_assignment(COURSE, 'hw1')
+        vg_tree.add_submission(COURSE, 'hw1', 's1', body=_EVIL)
+        response = _get_file(client)
+        _check_sandboxed(response)
+        assert response.get_data(as_text=True) == _EVIL
+
+
+def test_uncached_problem_file_is_sandboxed(vg_tree, client, monkeypatch):
+        monkeypatch.setattr(constants, 'PROBLEM_CACHE_MAX_ITEM', 1)
+        vg_tree.add_assignment(COURSE, 'hw1')
+        vg_tree.add_submission(COURSE, 'hw1', 's1', body=_EVIL)
+        response = _get_file(client)
+        _check_sandboxed(response)
+        assert response.get_data(as_text=True) == _EVIL
+
+
+class _RecordingFile:
+        def __init__(self, f, readers):
+                self.f = f
+                self.readers = readers
+
+        def read(self, *args):
+                self.readers.append(threading.current_thread())
+                return self.f.read(*args)
+
+        def __getattr__(self, name):
+                return getattr(self.f, name)
+
+        def __enter__(self):
+                return self
+
+        def __exit__(self, *args):
+                self.f.close()
+
+
+@pytest.mark.parametrize('max_item', [2**20, 1])
+def test_problem_file_is_read_off_the_request_thread(vg_tree, client,
+                                                     monkeypatch, max_item):
+        monkeypatch.setattr(constants, 'PROBLEM_CACHE_MAX_ITEM', max_item)
+        monkeypatch.setattr(constants, 'PROBLEM_STREAM_CHUNK', 8)
+        vg_tree.add_assignment(COURSE, 'hw1')
+        vg_tree.add_submission(COURSE, 'hw1', 's1', body=_EVIL)
+        readers = []
+        real_open = builtins.open
+
+        def recording_open(path, *args, **kwargs):
+                f = real_open(path, *args, **kwargs)
+                if isinstance(path, str) and path.endswith('/p1.svg'):
+                        readers.append(threading.current_thread())
+                        return _RecordingFile(f, readers)
+                return f
+
+        monkeypatch.setattr(builtins, 'open', recording_open)
+        response = _get_file(client)
+        assert response.get_data(as_text=True) == _EVIL
+        assert len(readers) > 1
+        assert threading.current_thread() not in readers
+        if max_item == 1:
+                assert len(readers) > len(_EVIL) // 8
+
+        # a 304 is answered from the stat, without reading the file
+        monkeypatch.setattr(problem_cache, '_paths',
+                            LRUCache(constants.PROBLEM_INDEX_SIZE))
+        del readers[:]
+        etag = response.headers['ETag']
+        response = client.get('/pdf/getProblemFile?course=%s&assign=hw1&'
+                              'student=s1&problem=1' % COURSE,
+                              headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.headers['ETag'] == etag
+        assert readers == []
+
+
+def _batch(client, students):
+        response = client.get('/pdf/getProblemBatch?course=%s&assign=hw1&'
+                              'problem=1&students=%s' % (COURSE, students))
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        lines = response.get_data(as_text=True).split('\n')[1:]
+        return dict((x['student'], x['svg']) for x in
+                    map(json.loads, filter(None, lines)))
+
+
+def test_problem_batch(vg_tree, client):
+        vg_tree.add_assignment(COURSE, 'hw1')
+        for student in ('s1', 's2', 's3'):
+                vg_tree.add_submission(COURSE, 'hw1', student,
+                                       body='<svg>%s</svg>' % student)
+        assert _batch(client, 'all') == {'s1': ['<svg>s1</svg>'],
+                                         's2': ['<svg>s2</svg>'],
+                                         's3': ['<svg>s3</svg>']}
+        assert _batch(client, 's3,s1') == {'s1': ['<svg>s1</svg>'],
+                                           's3': ['<svg>s3</svg>']}
+
+
+def test_problem_batch_missing_file(vg_tree, client):
+        vg_tree.add_assignment(COURSE, 'hw1')
+        vg_tree.add_submission(COURSE, 'hw1', 's1', pages=1)
+        vg_tree.add_submission(COURSE, 'hw1', 's2', pages=1)
+        os.remove(vg_tree.comp + '%s/grading/hw1/s2.1/p1.svg' % COURSE)
+        # one record per student asked for; an empty source for a missing
+        # file or a student who did not submit
+        assert _batch(client, 's1,s2,nobody') == {'s1': ['<svg></svg>'],
+                                                  's2': [''],
+                                                  'nobody': ['']}
@@ -0,0 +1,78 @@
+import os
+import gzip
+import pytest
+from .. import constants
+from .. import problem_cache
+from ..cache import LRUCache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+        monkeypatch.setattr(problem_cache, '_paths', LRUCache(64))
+        monkeypatch.setattr(problem_cache, '_blobs', LRUCache(
+            64, maxbytes=constants.PROBLEM_CACHE_BYTES,
+            sizeof=problem_cache._blob_size))
+        monkeypatch.setattr(problem_cache, '_disk_bytes', [None])
+        monkeypatch.setattr(problem_cache, '_brotli', False)
+        return tmp_path
+
+
+def _source(tmp_path, name, size):
+        path = str(tmp_path / name)
+        with open(path, 'wb') as f:
+                f.write(os.urandom(size // 2).hex().encode())
+        return path
+
+
+def test_miss_does_not_compress(cache, monkeypatch):
+        compressed = []
+        monkeypatch.setattr(problem_cache, '_compress',
+                            lambda raw, encoding: compressed.append(encoding))
+        path = _source(cache, 'p1.svg', 1000)
+        blob = problem_cache.read(path)
+        assert blob.variants.keys() == {None}
+        assert compressed == []
+
+
+def test_variant_is_built_once_and_accounted(cache):
+        path = _source(cache, 'p1.svg', 1000)
+        blob = problem_cache.read(path)
+        before = problem_cache._blobs.bytes
+        data = problem_cache.get_variant(blob, 'gzip')
+        assert gzip.decompress(data) == blob.raw()
+        assert problem_cache._blobs.bytes == before + len(data)
+
+        blob = problem_cache.read(path)
+        assert blob.variants['gzip'] is data
+        assert problem_cache.get_variant(blob, 'gzip') is data
+        assert problem_cache.get_variant(blob, None) is blob.raw()
+
+
+def test_warm_builds_every_encoding(cache):
+        path = _source(cache, 'p1.svg', 1000)
+        problem_cache.warm(path)
+        blob = problem_cache.read(path)
+        assert set(blob.variants) == set([None] + problem_cache.encodings())
+
+
+def test_disk_tier_is_capped(cache, monkeypatch):
+        disk = str(cache / 'disk')
+        monkeypatch.setattr(constants, 'PROBLEM_CACHE_DIR', disk)
+        monkeypatch.setattr(constants, 'PROBLEM_CACHE_DIR_BYTES', 10000)
+        for i in range(30):
+                path = _source(cache, 'p%d.svg' % i, 1000)
+                blob = problem_cache.read(path)
+                problem_cache.get_variant(blob, 'gzip')
+                os.utime(problem_cache._disk_path(blob.digest),
+                         (i, i))
+        total = sum(os.path.getsize(os.path.join(disk, x))
+                    for x in os.listdir(disk))
+        assert total <= 10000
+        assert problem_cache._disk_bytes[0] == total
+
+        newest = problem_cache.read(path).digest
+        assert os.path.exists(problem_cache._disk_path(newest))
+        names = os.listdir(disk)
+        for name in names:
+                digest = name.split('.', 1)[0]
+                assert digest in names
@@ -0,0 +1,74 @@
+import time
+import threading
+from .. import progress
+from .. import submissions
+from .. import file_manager
+from .conftest import COURSE, load
+
+
+def test_lease_counts_skip_expired():
+        now = 1000.0
+        doc = {'1': {'s1': {'grader': 'g1', 'expires': now + 60},
+                     's2': {'grader': 'g2', 'expires': now - 1}},
+               '2': {'s3': {'grader': 'g1', 'expires': now - 60}},
+               '3': ['s4', 's5']}
+        assert progress.lease_counts(doc, 4, now) == [1, 0, 2, 0]
+        assert progress.lease_counts({}, 2, now) == [0, 0]
+        assert progress.lease_counts([], 2, now) == [0, 0]
+
+
+def test_get_progress_skips_expired_leases(vg_tree, client, as_grader):
+        vg_tree.add_assignment(COURSE, 'hw1', pages=1)
+        vg_tree.add_submission(COURSE, 'hw1', 's1', pages=1)
+        vg_tree.add_submission(COURSE, 'hw1', 's2', pages=1)
+        now = time.time()
+        file_manager.update_inprogress(
+            course=COURSE, assignment='hw1',
+            update=lambda doc: doc.update(
+                {'1': {'s1': {'grader': 'g1', 'expires': now + 600},
+                       's2': {'grader': 'g2', 'expires': now - 600}}}))
+        response = client.get('/pdf/getProgress?course=%s&assign=hw1' %
+                              COURSE)
+        assert load(response)['pages'][0]['inp'] == 1
+
+
+def test_failing_listener_is_logged_and_retried(vg_tree, as_grader,
+                                                monkeypatch, caplog):
+        vg_tree.add_assignment(COURSE, 'hw1')
+        vg_tree.add_submission(COURSE, 'hw1', 's1')
+        calls = []
+
+        def broken(course, assignment, num):
+                calls.append('broken')
+                raise ValueError('boom')
+
+        def counting(course, assignment, num):
+                calls.append(num)
+
+        monkeypatch.setattr(submissions, '_listeners', [broken, counting])
+        assert submissions.get_students(COURSE, 'hw1') == ['s1']
+        assert calls == ['broken', 1]
+        assert 'submission listener' in caplog.text
+
+        submissions.get_students(COURSE, 'hw1')
+        assert calls == ['broken', 1, 'broken', 1]
+
+
+def test_listeners_run_in_the_request_thread(vg_tree, as_grader, monkeypatch):
+        vg_tree.add_assignment(COURSE, 'hw1')
+        vg_tree.add_submission(COURSE, 'hw1', 's1')
+        threads = []
+        monkeypatch.setattr(submissions, '_listeners', [
+            lambda course, assignment, num:
+                threads.append(threading.current_thread())])
+        assert file_manager.get_students_for_assignment(
+            course=COURSE, assignment='hw1') == ['s1']
+        assert threads == [threading.current_thread()]
+
+
+def test_old_progress_is_counted(vg_tree, as_grader):
+        vg_tree.add_assignment(COURSE, 'hw1')
+        vg_tree.write_json('assignments/%s/hw1/completed' % COURSE,
+                           {'1': ['s1', 's2'], '2': ['s1']})
+        doc = file_manager.read_progress(course=COURSE, assignment='hw1')
+        assert progress.page_counts(doc, 'com', 2) == [2, 1]
@@ -0,0 +1,124 @@
+import os
+import json
+import shutil
+import pytest
+from .. import migrate
+from .. import storage
+from .. import constants
+
+_MOUNTINFO = '''\
+22 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw
+40 22 0:35 / /r rw,relatime shared:20 - nfs4 fs:/export/r rw,vers=4.2
+41 40 8:2 / /r/local rw,relatime shared:21 - xfs /dev/sdb1 rw
+42 22 0:36 / /mnt/my\\040disk rw,relatime - nfs fs:/x rw
+'''
+
+
+@pytest.fixture
+def mountinfo(tmp_path, monkeypatch):
+        path = tmp_path / 'mountinfo'
+        path.write_text(_MOUNTINFO)
+        monkeypatch.setattr(storage, 'MOUNTINFO', str(path))
+
+
+@pytest.mark.parametrize('path, fs_type', [
+        ('/var/lib/virtualgrade', 'ext4'),
+        ('/r', 'nfs4'),
+        ('/r/virtualgrade', 'nfs4'),
+        ('/r/local/db', 'xfs'),
+        ('/rx', 'ext4'),
+        ('/mnt/my disk/db', 'nfs'),
+])
+def test_fs_type(mountinfo, path, fs_type):
+        assert storage._fs_type(path) == fs_type
+
+
+def test_sqlite_refuses_network_file_system(mountinfo):
+        with pytest.raises(storage.StorageException):
+                storage.SQLiteStore('/r/virtualgrade/state.db')
+
+
+def test_sqlite_opens_on_local_disk(tmp_path):
+        store = storage.SQLiteStore(str(tmp_path / 'db' / 'state.db'))
+        assert store.read_score('s1', '15', 'hw1') == {}
+
+
+def _state(store):
+        return sorted((course, assignment, name,
+                       json.dumps(doc, sort_keys=True))
+                      for course, assignment, name, doc in store.iter_state()
+                      if name in storage.STATE_FILES)
+
+
+def test_migrate_json_to_sqlite_with_journal(vg_tree, tmp_path, monkeypatch):
+        monkeypatch.setattr(constants, 'JOURNAL_COMPACT_BYTES', 2**30)
+        vg_tree.add_assignment('15', 'hw1')
+        vg_tree.add_assignment('15', 'hw2')
+        vg_tree.write_json('assignments/15/hw1/completed', {'1': ['s1']})
+        vg_tree.add_score('s1', '15', 'hw1', {'1': 9})
+
+        src = storage.JSONStore()
+        src.append_state('15', 'hw1', 'completed',
+                         [['add', '1', 's2', None], ['add', '2', 's1', None]])
+        src.append_state('15', 'hw2', 'inprogress',
+                         [['set', '1', 's3', {'grader': 'g00',
+                                              'expires': 1.0}]])
+        assert os.path.exists(vg_tree.storage +
+                              'assignments/15/hw1/completed.journal')
+        assert not os.path.exists(vg_tree.storage +
+                                  'assignments/15/hw2/inprogress')
+
+        dst = storage.SQLiteStore(str(tmp_path / 'state.db'))
+        assert migrate.migrate(src, dst) == (2, 1)
+        assert dst.read_state('15', 'hw1', 'completed') == \
+            {'1': ['s1', 's2'], '2': ['s1']}
+        assert dst.read_state('15', 'hw2', 'inprogress') == \
+            {'1': {'s3': {'grader': 'g00', 'expires': 1.0}}}
+        assert dst.read_score('s1', '15', 'hw1') == {'1': 9}
+        assert _state(dst) == _state(src)
+
+        back = storage.JSONStore()
+        shutil.rmtree(vg_tree.storage + 'assignments/15/hw1')
+        shutil.rmtree(vg_tree.storage + 'assignments/15/hw2')
+        vg_tree.add_assignment('15', 'hw1')
+        vg_tree.add_assignment('15', 'hw2')
+        assert migrate.migrate(dst, back) == (2, 1)
+        assert _state(back) == _state(dst)
+
+
+@pytest.mark.parametrize('record', [['set', 1, 's1', 2], ['bump', '1', 's1', 2],
+                                    ['add', '1', None, None], ['put', '1']])
+def test_append_refuses_malformed_records(vg_tree, record):
+        vg_tree.add_assignment('15', 'hw1')
+        store = storage.JSONStore()
+        with pytest.raises(storage.StorageException):
+                store.append_state('15', 'hw1', 'flags',
+                                   [['set', '1', 's1', 1], record])
+        assert not os.path.exists(vg_tree.storage +
+                                  'assignments/15/hw1/flags.journal')
+        assert store.read_state('15', 'hw1', 'flags') == {}
+
+
+def test_fold_skips_records_of_the_wrong_type():
+        doc = {'d': {'s1': 1}, 'l': ['s1'], 's': 'as1b', 'n': 5}
+        records = [['set', 'l', 's2', 1], ['add', 'd', 's2', None],
+                   ['unset', 'l', 's1', None], ['remove', 'd', 's1', None],
+                   ['unset', 's', 's1', None], ['remove', 's', 's1', None],
+                   ['set', 'n', 's1', 1], ['add', 'n', 's1', None],
+                   ['remove', 'n', 's1', None], ['set', 2, 's1', 1],
+                   ['set', 'd', 's2', 2], ['remove', 'l', 's1', None]]
+        assert storage._fold(doc, records) == \
+            {'d': {'s1': 1, 's2': 2}, 'l': [], 's': 'as1b', 'n': 5}
+
+
+def test_bad_journal_line_does_not_break_reads(vg_tree, monkeypatch):
+        monkeypatch.setattr(constants, 'JOURNAL_COMPACT_BYTES', 2**30)
+        vg_tree.add_assignment('15', 'hw1')
+        store = storage.JSONStore()
+        store.append_state('15', 'hw1', 'flags', [['put', '1', None, 'xs1x']])
+        path = vg_tree.storage + 'assignments/15/hw1/flags.journal'
+        with open(path, 'a') as f:
+                f.write(json.dumps(['remove', '1', 's1', None]) + '\n')
+        store.append_state('15', 'hw1', 'flags', [['set', '2', 's1', 3]])
+        assert storage.JSONStore().read_state('15', 'hw1', 'flags') == \
+            {'1': 'xs1x', '2': {'s1': 3}}
@@ -0,0 +1,108 @@
+import gzip
+import json
+import zlib
+import pytest
+from .. import stream
+from .conftest import COURSE
+
+
+def _decode(response):
+        data = response.get_data()
+        encoding = response.headers.get('Content-Encoding')
+        if encoding == 'gzip':
+                return gzip.decompress(data)
+        if encoding == 'deflate':
+                return zlib.decompress(data)
+        assert encoding is None
+        return data
+
+
+def _students(tree, num):
+        tree.add_assignment(COURSE, 'lab1', atype='scorecard')
+        for i in range(num):
+                tree.add_submission(COURSE, 'lab1', 's%03d' % i)
+        return '/getStudents?course=%s&assign=lab1' % COURSE
+
+
+def _batch(tree, num):
+        tree.add_assignment(COURSE, 'hw1')
+        for i in range(num):
+                tree.add_submission(COURSE, 'hw1', 's%03d' % i,
+                                    body='<svg>%d</svg>' % i)
+        return '/pdf/getProblemBatch?course=%s&assign=hw1&problem=1&' \
+               'students=all' % COURSE
+
+
+def test_small_response_is_prefixed_not_compressed(vg_tree, client):
+        response = client.get(_students(vg_tree, 2),
+                              headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in response.headers
+        assert 'Accept-Encoding' in response.headers['Vary']
+        body = response.get_data()
+        assert body.startswith(stream.XSSI_PREFIX)
+        assert response.content_length == len(body)
+        doc = json.loads(body[len(stream.XSSI_PREFIX):])
+        assert sorted(doc['names']) == ['s000', 's001']
+
+
+@pytest.mark.parametrize('encoding', ['gzip', 'deflate'])
+def test_buffered_response_is_compressed(vg_tree, client, encoding):
+        response = client.get(_students(vg_tree, 300),
+                              headers={'Accept-Encoding': encoding})
+        assert response.headers['Content-Encoding'] == encoding
+        assert 'Accept-Encoding' in response.headers['Vary']
+        body = _decode(response)
+        assert body.startswith(stream.XSSI_PREFIX)
+        doc = json.loads(body[len(stream.XSSI_PREFIX):])
+        assert len(doc['names']) == 300
+
+
+def test_encoding_follows_client_preference(vg_tree, client):
+        response = client.get(_students(vg_tree, 300),
+                              headers={'Accept-Encoding':
+                                       'gzip;q=0.5, deflate'})
+        assert response.headers['Content-Encoding'] == 'deflate'
+        response = client.get(_students(vg_tree, 300),
+                              headers={'Accept-Encoding': 'br'})
+        assert 'Content-Encoding' not in response.headers
+        assert response.get_data().startswith(stream.XSSI_PREFIX)
+
+
+@pytest.mark.parametrize('encoding', [None, 'gzip', 'deflate'])
+def test_streamed_response_is_prefixed(vg_tree, client, encoding):
+        headers = {'Accept-Encoding': encoding} if encoding else {}
+        response = client.get(_batch(vg_tree, 5), headers=headers)
+        assert response.is_streamed
+        assert response.headers.get('Content-Encoding') == encoding
+        assert 'Accept-Encoding' in response.headers['Vary']
+        body = _decode(response)
+        assert body.startswith(stream.XSSI_PREFIX)
+        lines = body[len(stream.XSSI_PREFIX):].decode().splitlines()
+        assert len(lines) == 5
+
+
+def test_problem_file_is_exempt(vg_tree, client):
+        vg_tree.add_assignment(COURSE, 'hw1')
+        svg = '<svg>%s</svg>' % ('x' * 4096)
+        vg_tree.add_submission(COURSE, 'hw1', 's1', body=svg)
+        url = '/pdf/getProblemFile?course=%s&assign=hw1&student=s1&' \
+              'problem=1' % COURSE
+        response = client.get(url)
+        assert 'Content-Encoding' not in response.headers
+        assert response.get_data() == svg.encode()
+        # the problem cache's own precompressed copy, not the API's wrapper
+        response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert _decode(response) == svg.encode()
+
+
+def test_export_is_exempt(vg_tree, client):
+        vg_tree.add_assignment(COURSE, 'hw1')
+        for i in range(100):
+                vg_tree.add_score('s%03d' % i, COURSE, 'hw1', {'1': i})
+        response = client.get('/exportGrades?course=%s' % COURSE,
+                              headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in response.headers
+        body = response.get_data(as_text=True)
+        assert body.startswith('student,assignment,problem,score')
+        assert 's099,hw1,1,99' in body
@@ -0,0 +1,31 @@
+import os
+from .. import submissions
+from .conftest import COURSE
+
+
+def test_latest_compares_versions_as_numbers(vg_tree):
+        for version in (1, 2, 9, 10):
+                vg_tree.add_submission(COURSE, 'hw1', 's1', version=version)
+        assert submissions.get_latest(COURSE, 'hw1', 's1') == 's1.10'
+        assert submissions.get_submission_path(
+            COURSE, 'hw1', 's1').endswith('/s1.10/')
+        assert submissions.get_submission_path(
+            COURSE, 'hw1', 's1', '9').endswith('/s1.9/')
+
+
+def test_names_without_a_version_are_skipped(vg_tree):
+        vg_tree.add_submission(COURSE, 'hw1', 's1', version=2)
+        base = vg_tree.comp + '%s/grading/hw1/' % COURSE
+        os.makedirs(base + 's1.old')
+        os.makedirs(base + 's2')
+        assert submissions.get_latest(COURSE, 'hw1', 's1') == 's1.2'
+        assert submissions.get_latest(COURSE, 'hw1', 's2') == ''
+        assert submissions.get_submission_path(COURSE, 'hw1', 's2') is None
+
+
+def test_problem_file_of_unversioned_directory(vg_tree, client):
+        vg_tree.add_assignment(COURSE, 'hw1')
+        os.makedirs(vg_tree.comp + '%s/grading/hw1/s2' % COURSE)
+        response = client.get('/pdf/getProblemFile?course=%s&assign=hw1&'
+                              'student=s2&problem=1' % COURSE)
+        assert response.status_code == 404
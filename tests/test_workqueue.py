@@ -0,0 +1,106 @@
+import pytest
+from .. import constants
+from .. import workqueue
+from .. import file_manager
+from .conftest import COURSE
+
+
+class _Clock:
+        def __init__(self, now):
+                self.now = now
+
+        def time(self):
+                return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+        clock = _Clock(1000.0)
+        monkeypatch.setattr(workqueue, 'time', clock)
+        return clock
+
+
+@pytest.fixture
+def students(vg_tree, as_grader, monkeypatch):
+        monkeypatch.setattr(workqueue, '_queues', {})
+        vg_tree.add_assignment(COURSE, 'hw1')
+        names = ['s1', 's2', 's3']
+        for student in names:
+                vg_tree.add_submission(COURSE, 'hw1', student)
+        return names
+
+
+def _worker(monkeypatch, queues):
+        monkeypatch.setattr(workqueue, '_queues', queues)
+
+
+def _claim(grader):
+        return workqueue.claim(COURSE, 'hw1', '1', grader)
+
+
+def _leases():
+        doc = file_manager.read_inprogress(course=COURSE, assignment='hw1')
+        return doc.get('1', {})
+
+
+def test_claims_in_order_and_once(students, clock):
+        assert [_claim('g%d' % i) for i in range(4)] == \
+            ['s1', 's2', 's3', '']
+        assert _claim('g0') == 's1'
+
+
+def test_expired_lease_goes_back(students, clock):
+        assert _claim('g1') == 's1'
+        assert workqueue._get_queue(COURSE, 'hw1', '1').reap_at == \
+            clock.now + constants.LEASE_SECS
+        clock.now += constants.LEASE_SECS + 1
+        assert _claim('g2') == 's1'
+        assert _leases()['s1']['grader'] == 'g2'
+
+
+def test_lease_reaped_by_another_worker(students, clock, monkeypatch):
+        a, b = {}, {}
+        _worker(monkeypatch, a)
+        assert [_claim('g1'), _claim('g2'), _claim('g3')] == \
+            ['s1', 's2', 's3']
+
+        clock.now += constants.LEASE_SECS + 1
+        _worker(monkeypatch, b)
+        assert _claim('g4') == 's1'
+        assert workqueue.release(COURSE, 'hw1', '1', 's1', 'g4')
+
+        _worker(monkeypatch, a)
+        assert _claim('g5') in ('s1', 's2', 's3')
+        assert 's1' in _leases()
+
+
+def test_empty_queue_is_not_rebuilt_until_something_changes(students, clock,
+                                                             monkeypatch):
+        for i in range(3):
+                _claim('g%d' % i)
+        rebuilds = []
+        rebuild = workqueue._rebuild
+
+        def counted(queue, leases):
+                changed = rebuild(queue, leases)
+                rebuilds.append(changed)
+                return changed
+
+        monkeypatch.setattr(workqueue, '_rebuild', counted)
+        assert _claim('g9') == ''
+        assert _claim('g9') == ''
+        assert rebuilds.count(True) <= 1
+        assert rebuilds[-1] is False
+
+
+def test_completed_students_are_skipped(students, clock):
+        file_manager.append_completed(course=COURSE, assignment='hw1',
+                                      records=[['add', '1', 's1', None]])
+        assert _claim('g1') == 's2'
+
+
+def test_own_lease_on_completed_student_is_not_returned(students, clock):
+        assert _claim('g1') == 's1'
+        file_manager.append_completed(course=COURSE, assignment='hw1',
+                                      records=[['add', '1', 's1', None]])
+        assert _claim('g1') == 's2'
@@ -0,0 +1,277 @@
+'''
+workqueue.py -- lease-based queue of students to grade, per
+                (course, assignment, problem)
+Notes:
+   - Every process keeps a heap of the students it has not handed out yet;
+     claiming pops from it, so it costs O(log n) instead of sorting the
+     whole class on every getNextStudent
+   - Another worker may reap or release a lease this process handed out;
+     such a student is not in this process's heap, so an empty heap is
+     rebuilt from the student list and the inprogress file before the
+     queue is reported empty
+   - Expired leases are only looked for once the earliest lease seen has
+     expired, not on every claim
+   - Leases are the source of truth and live in the 'inprogress' file,
+     which is only modified under the assignment lock (see
+     file_manager.update_inprogress), so two graders -- in the same worker
+     or not -- are never handed the same student
+   - INPROGRESS FILE (pdf):
+         stores as:
+         { '1' : { 'aplume01' : { 'grader' : 'molay',
+                                  'expires' : 1489075200.0 }, ... }, ... }
+'''
+
+import time
+import heapq
+import threading
+from . import constants
+from . import file_manager
+
+
+'''
+_Queue -- local view of the students still to be handed out for a problem
+          - heap/members: students not handed out by this process
+          - deferred: students popped from the heap while leased by someone
+                      else; they go back into the heap once their lease is
+                      gone from the inprogress file
+          - names: the student list the heap was built from, used to notice
+                   new submissions
+          - reap_at: when the earliest lease seen by the last reap expires
+          - rebuilt: what the heap was last rebuilt from, so an empty queue
+                     is not rebuilt again until something changes
+'''
+
+
+class _Queue:
+        def __init__(self):
+                self.heap = []
+                self.members = set()
+                self.deferred = set()
+                self.names = None
+                self.com_doc = None
+                self.com = frozenset()
+                self.reap_at = 0
+                self.rebuilt = None
+                self.lock = threading.Lock()
+
+        def push(self, student):
+                if student not in self.members:
+                        self.members.add(student)
+                        heapq.heappush(self.heap, student)
+
+        def sync(self, names, com_doc, problem):
+                if com_doc is not self.com_doc:
+                        self.com_doc = com_doc
+                        done = com_doc.get(problem, []) \
+                            if isinstance(com_doc, dict) else []
+                        self.com = frozenset(done)
+                if names is not self.names:
+                        if self.names is None:
+                                self.heap = [x for x in names
+                                             if x not in self.com]
+                                heapq.heapify(self.heap)
+                                self.members = set(self.heap)
+                        else:
+                                for student in set(names).difference(
+                                                self.names):
+                                        self.push(student)
+                        self.names = names
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def _get_queue(course, assignment, problem):
+        key = (course, assignment, problem)
+        with _queues_lock:
+                if key not in _queues:
+                        _queues[key] = _Queue()
+                return _queues[key]
+
+
+def _lease(grader, now):
+        return {'grader': grader, 'expires': now + constants.LEASE_SECS}
+
+
+'''
+_reap -- drops expired leases and leases on completed students from a
+         problem's leases, putting expired students back into the queue and
+         releasing deferred students whose lease is gone
+         - the leases are only scanned once queue.reap_at has passed; a
+           lease taken later expires later, so none can expire before it
+'''
+
+
+def _reap(queue, leases, now):
+        if now >= queue.reap_at:
+                earliest = now + constants.LEASE_SECS
+                for student in list(leases):
+                        expires = leases[student]['expires']
+                        if student in queue.com:
+                                del leases[student]
+                        elif expires <= now:
+                                del leases[student]
+                                queue.deferred.discard(student)
+                                queue.push(student)
+                        else:
+                                earliest = min(earliest, expires)
+                queue.reap_at = earliest
+
+        for student in list(queue.deferred):
+                if student not in leases:
+                        queue.deferred.discard(student)
+                        if student not in queue.com:
+                                queue.push(student)
+
+
+'''
+_rebuild -- refills an empty heap with every student that is neither
+            completed nor leased, and defers the leased ones; picks up
+            students whose lease another worker reaped or released
+            returns False if nothing changed since the last rebuild
+'''
+
+
+def _rebuild(queue, leases):
+        seen = (queue.names, queue.com_doc, frozenset(leases))
+        if seen == queue.rebuilt:
+                return False
+        queue.rebuilt = seen
+        queue.heap = [x for x in queue.names
+                      if x not in queue.com and x not in leases]
+        heapq.heapify(queue.heap)
+        queue.members = set(queue.heap)
+        queue.deferred = set(x for x in queue.names
+                             if x in leases and x not in queue.com)
+        return True
+
+
+def _pop(queue, leases, grader, now):
+        while queue.heap:
+                student = heapq.heappop(queue.heap)
+                queue.members.discard(student)
+                if student in queue.com:
+                        continue
+                if student in leases:
+                        queue.deferred.add(student)
+                        continue
+                leases[student] = _lease(grader, now)
+                return student
+        return ''
+
+
+'''
+claim -- hands out the next student for a grader, leasing them for
+         LEASE_SECS; a grader that already holds an active lease on the
+         problem gets the same student back (with the lease renewed)
+         returns '' if there is nobody left to grade
+'''
+
+
+def claim(course, assignment, problem, grader):
+        queue = _get_queue(course, assignment, problem)
+        names = file_manager.get_students_for_assignment(course=course, assignment=assignment)
+        com = file_manager.read_completed(course=course, assignment=assignment)
+
+        def take(doc):
+                now = time.time()
+                leases = doc.setdefault(problem, {})
+                _reap(queue, leases, now)
+
+                for student, lease in leases.items():
+                        if lease['grader'] == grader and \
+                                student not in queue.com:
+                                lease['expires'] = now + constants.LEASE_SECS
+                                return student
+
+                student = _pop(queue, leases, grader, now)
+                if student == '' and _rebuild(queue, leases):
+                        student = _pop(queue, leases, grader, now)
+                return student
+
+        with queue.lock:
+                queue.sync(names, com, problem)
+                student = file_manager.update_inprogress(course=course,
+                                                         assignment=assignment,
+                                                         update=take)
+        return student if student is not None else ''
+
+
+'''
+_smallest -- the n smallest items of a heap that are not in skip, walking it
+             from the root instead of scanning it, so it costs O(m log m) for
+             the m items visited regardless of the heap's size
+'''
+
+
+def _smallest(heap, n, skip):
+        result = []
+        frontier = [(heap[0], 0)] if heap else []
+        while frontier and len(result) < n:
+                item, i = heapq.heappop(frontier)
+                if item not in skip:
+                        result.append(item)
+                for child in (2*i + 1, 2*i + 2):
+                        if child < len(heap):
+                                heapq.heappush(frontier, (heap[child], child))
+        return result
+
+
+'''
+peek -- the next students this process would hand out for a problem, without
+        claiming them; used to warm caches ahead of the graders
+'''
+
+
+def peek(course, assignment, problem, n):
+        queue = _get_queue(course, assignment, problem)
+        with queue.lock:
+                return _smallest(queue.heap, n, queue.com)
+
+
+'''
+renew -- extends a grader's lease on a student
+         returns False if the grader does not hold the lease (e.g. it
+         expired and the student was handed to someone else)
+'''
+
+
+def renew(course, assignment, problem, student, grader):
+        def extend(doc):
+                lease = doc.get(problem, {}).get(student)
+                if lease is None or lease['grader'] != grader:
+                        return False
+                lease['expires'] = time.time() + constants.LEASE_SECS
+                return True
+
+        return bool(file_manager.update_inprogress(course=course,
+                                                   assignment=assignment,
+                                                   update=extend))
+
+
+'''
+release -- gives up a grader's lease on a student, putting the student back
+           into the queue
+           returns False if the grader did not hold the lease
+'''
+
+
+def release(course, assignment, problem, student, grader):
+        queue = _get_queue(course, assignment, problem)
+
+        def drop(doc):
+                leases = doc.get(problem, {})
+                lease = leases.get(student)
+                if lease is None or lease['grader'] != grader:
+                        return False
+                del leases[student]
+                return True
+
+        with queue.lock:
+                released = file_manager.update_inprogress(
+                    course=course, assignment=assignment, update=drop)
+                if released and student not in queue.com:
+                        queue.deferred.discard(student)
+                        queue.push(student)
+        return bool(released)